@@ -1,11 +1,13 @@
 from setuptools import setup
 
 install_reqs = [
+    'futures; python_version < "3"',
     'netaddr',
     'python-keystoneclient',
     'python-neutronclient',
     'python-novaclient',
     'pyyaml',
+    'requests',
 ]
 
 tests_require = [
@@ -29,6 +31,9 @@ setup(
     packages=["testiny"],
     install_requires=install_reqs,
     tests_require=tests_require,
-    extras_require={'test': tests_require},
+    extras_require={
+        'notifications': ['kombu'],
+        'test': tests_require,
+    },
     zip_safe=False,
     )
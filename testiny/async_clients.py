@@ -0,0 +1,86 @@
+# Copyright (C) 2015 Cisco, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Shared worker pool for concurrent Openstack API calls.
+
+Independent calls made by the fixtures are submitted to a bounded pool
+of worker threads, so that they can be in flight at the same time, and
+their futures waited for together:
+
+    network = get_executor().submit(neutron.create_network, body)
+    keypair = get_executor().submit(nova.keypairs.create, name)
+    wait_all([network, keypair])
+"""
+
+from __future__ import (
+    absolute_import,
+    print_function,
+    unicode_literals,
+    )
+
+str = None
+
+__metaclass__ = type
+__all__ = [
+    'get_executor',
+    'wait_all',
+    ]
+
+from concurrent import futures
+import threading
+
+from testiny.config import CONF
+
+# Default for the 'concurrency' section of the config.
+DEFAULT_MAX_WORKERS = 8
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Return the worker pool shared by all the fixtures.
+
+    Its size, which bounds the number of API calls in flight, is
+    'max_workers' in the 'concurrency' section of the config.
+    """
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            config = CONF.get('concurrency') or {}
+            _executor = futures.ThreadPoolExecutor(
+                max_workers=config.get('max_workers', DEFAULT_MAX_WORKERS))
+        return _executor
+
+
+def wait_all(fs, timeout=None):
+    """Wait for all the futures in `fs` and return their results.
+
+    The results are in the order of `fs`.  All the futures are waited
+    for, even if some of them fail: unless the timeout expires, no call
+    is still in flight when this returns.  The first exception raised
+    by a call, in the order of `fs`, is then re-raised.
+
+    :raise concurrent.futures.TimeoutError: if some calls aren't done
+        after `timeout` seconds.  Those calls may still be running:
+        the futures can't be stopped once started.
+    """
+    fs = list(fs)
+    _, not_done = futures.wait(fs, timeout=timeout)
+    if not_done:
+        raise futures.TimeoutError(
+            "%d API calls still pending" % len(not_done))
+    return [f.result() for f in fs]
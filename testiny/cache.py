@@ -0,0 +1,262 @@
+# Copyright (C) 2015 Cisco, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Cache of lookups of objects which don't change during a run.
+
+Flavors, images, roles and the external network are looked up by name
+over and over by the fixtures, and the client-side `find` of novaclient
+and keystoneclient lists all the objects to do so.  The lookups are
+cached process-wide for a configurable time, keyed on the keystone
+endpoint, the kind of object and its name.
+
+A lookup whose object turns out to be gone, i.e. using it fails with a
+404, is dropped from the cache and done again, see `call_with_lookup`.
+
+When the cache is first used, the lookups of the configured flavor,
+image, roles and external network are started in the background, so
+they are warm by the time the first fixtures need them.
+"""
+
+from __future__ import (
+    absolute_import,
+    print_function,
+    unicode_literals,
+    )
+
+str = None
+
+__metaclass__ = type
+__all__ = [
+    'call_with_lookup',
+    'call_with_network',
+    'find_flavor',
+    'find_image',
+    'find_network',
+    'find_role',
+    'get_lookup_cache',
+    'invalidate',
+    'is_not_found',
+    'lookup',
+    'TTLCache',
+    ]
+
+from concurrent import futures
+import threading
+import time
+
+from testiny.async_clients import get_executor
+from testiny.clients import (
+    get_keystone_v3_client,
+    get_neutron_client,
+    get_nova_v3_client,
+)
+from testiny.config import CONF
+
+# Defaults for the 'lookup_cache' section of the config.
+DEFAULT_TTL = 600
+DEFAULT_WARM = True
+
+# Roles granted by the fixtures.
+WARM_ROLES = ('admin', 'Member')
+
+
+def is_not_found(error):
+    """Return True if `error` is an HTTP 404 Not Found from an API client.
+
+    See testiny.teardown.is_conflict.
+    """
+    for attribute in ('status_code', 'http_status', 'code'):
+        if getattr(error, attribute, None) == 404:
+            return True
+    return False
+
+
+class TTLCache:
+    """A thread-safe cache whose entries expire after `ttl` seconds.
+
+    Concurrent requests for a missing key wait for a single lookup.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # Maps keys to (expiry time, value).
+        self._entries = {}
+        # Maps the keys being looked up to a Future of the value.
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, create):
+        """Return the value cached under `key`.
+
+        If there isn't one, or it expired, `create()` is called to make
+        it and the result is cached.  Exceptions aren't cached.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.time():
+                self.hits += 1
+                return entry[1]
+            loading = self._loading.get(key)
+            if loading is None:
+                self.misses += 1
+                loading = self._loading[key] = futures.Future()
+                owner = True
+            else:
+                owner = False
+        if not owner:
+            try:
+                return loading.result()
+            except Exception:
+                # The other lookup may have been done with different
+                # credentials, try ours.
+                return create()
+        try:
+            value = create()
+        except Exception as e:
+            with self._lock:
+                del self._loading[key]
+            loading.set_exception(e)
+            raise
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, value)
+            del self._loading[key]
+        loading.set_result(value)
+        return value
+
+    def invalidate(self, key):
+        """Drop the value cached under `key`, if any."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_lookup_cache():
+    """Return the process-wide lookup cache."""
+    global _cache
+
+    with _cache_lock:
+        if _cache is not None:
+            return _cache
+        config = CONF.get('lookup_cache') or {}
+        _cache = TTLCache(ttl=config.get('ttl', DEFAULT_TTL))
+    if config.get('warm', DEFAULT_WARM):
+        _warm()
+    return _cache
+
+
+def _key(kind, name):
+    return (CONF.auth_url, kind, name)
+
+
+def lookup(kind, name, find):
+    """Return the object of type `kind` named `name`.
+
+    :param find: Called, with no arguments, to look the object up if it
+        isn't cached.
+    """
+    return get_lookup_cache().get(_key(kind, name), find)
+
+
+def invalidate(kind, name):
+    """Drop the cached object of type `kind` named `name`."""
+    get_lookup_cache().invalidate(_key(kind, name))
+
+
+def call_with_lookup(kind, name, find, func):
+    """Return `func(obj)` where `obj` is looked up as with `lookup`.
+
+    If `func` fails with a 404, the cached object is assumed to be
+    gone: it is looked up again and `func` retried once.
+    """
+    try:
+        return func(lookup(kind, name, find))
+    except Exception as e:
+        if not is_not_found(e):
+            raise
+    invalidate(kind, name)
+    return func(lookup(kind, name, find))
+
+
+def find_flavor(nova, name):
+    return lookup('flavor', name, lambda: nova.flavors.find(name=name))
+
+
+def find_image(nova, name):
+    return lookup('image', name, lambda: nova.images.find(name=name))
+
+
+def find_role(keystone, name):
+    return lookup('role', name, lambda: keystone.roles.find(name=name))
+
+
+def _find_one_network(neutron, name):
+    networks = neutron.list_networks(name=name)['networks']
+    if len(networks) != 1:
+        raise LookupError("No single network named %s" % name)
+    return networks[0]
+
+
+def find_network(neutron, name):
+    """Find a network which is the same for all projects, by name.
+
+    Returns None if there isn't exactly one network with that name;
+    that isn't cached.
+    """
+    try:
+        return lookup(
+            'network', name, lambda: _find_one_network(neutron, name))
+    except LookupError:
+        return None
+
+
+def call_with_network(neutron, name, func):
+    """Return `func(network)` for the network found with `find_network`.
+
+    See `call_with_lookup`.
+    """
+    return call_with_lookup(
+        'network', name, lambda: _find_one_network(neutron, name), func)
+
+
+def _warm():
+    """Start looking up the configured objects in the background."""
+    executor = get_executor()
+
+    def warm_nova():
+        nova = get_nova_v3_client(project_name=CONF.admin_project)
+        find_flavor(nova, CONF.fast_image['flavor_name'])
+        find_image(nova, CONF.fast_image['image_name'])
+
+    def warm_keystone():
+        keystone = get_keystone_v3_client(project_name=CONF.admin_project)
+        for role in WARM_ROLES:
+            find_role(keystone, role)
+
+    def warm_neutron():
+        neutron = get_neutron_client(project_name=CONF.admin_project)
+        find_network(neutron, CONF.network['external_network'])
+
+    for warm in (warm_nova, warm_keystone, warm_neutron):
+        # Failures don't matter: the lookups are done again when needed.
+        executor.submit(warm)
@@ -29,10 +29,18 @@ str = None
 
 __metaclass__ = type
 __all__ = [
+    'ClientRegistry',
+    'forget_sessions',
     'get_keystone_v3_client',
+    'get_neutron_client',
     'get_nova_v3_client',
+    'get_or_create_session',
+    'SessionCache',
     ]
 
+from collections import OrderedDict
+import threading
+
 from keystoneclient import (
     client,
     session,
@@ -41,9 +49,183 @@ from keystoneclient.auth import identity
 from neutronclient.neutron import client as neutron_client
 from novaclient import client as nova_client
 from testiny.config import CONF
+from testiny.connections import get_http_session
+
+# Defaults for the 'clients' section of the config.
+DEFAULT_SESSION_CACHE_SIZE = 64
+DEFAULT_SESSION_EXPIRY_MARGIN = 300
+
+
+class SessionCache:
+    """A bounded, thread-safe LRU cache of keystone sessions.
+
+    Entries are keyed on the full set of credentials used to create the
+    session.  When the token held by a cached session is due to expire
+    within `expiry_margin` seconds, its auth plugin is invalidated so
+    that the session re-authenticates before its next request rather
+    than failing mid-test.
+
+    Hit, miss, expiry and eviction counts are kept and available via
+    `stats()`.
+    """
+
+    def __init__(self, maxsize=DEFAULT_SESSION_CACHE_SIZE,
+                 expiry_margin=DEFAULT_SESSION_EXPIRY_MARGIN):
+        self.maxsize = maxsize
+        self.expiry_margin = expiry_margin
+        self._sessions = OrderedDict()
+        self._lock = threading.RLock()
+        self._eviction_listeners = []
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def get_or_create(self, key, create):
+        """Return the session cached under `key`.
+
+        If there isn't one, `create()` is called to make one and the
+        result is cached, evicting the least recently used session if
+        the cache is full.
+        """
+        with self._lock:
+            sess = self._sessions.get(key)
+            if sess is not None:
+                self.hits += 1
+                self._sessions.pop(key)
+                self._sessions[key] = sess
+                self._refresh_if_expiring(sess)
+                return sess
+            self.misses += 1
+            return self._put(key, create())
+
+    def put(self, key, sess):
+        """Cache `sess` under `key`, replacing any existing session."""
+        with self._lock:
+            return self._put(key, sess)
+
+    def _put(self, key, sess):
+        old = self._sessions.pop(key, None)
+        if old is not None:
+            self._notify_evicted(old)
+        self._sessions[key] = sess
+        while len(self._sessions) > self.maxsize:
+            _, evicted = self._sessions.popitem(last=False)
+            self.evictions += 1
+            self._notify_evicted(evicted)
+        return sess
+
+    def _refresh_if_expiring(self, sess):
+        auth_ref = getattr(sess.auth, 'auth_ref', None)
+        if auth_ref is None:
+            # Not authenticated yet, nothing to refresh.
+            return
+        if auth_ref.will_expire_soon(stale_duration=self.expiry_margin):
+            self.expired += 1
+            sess.auth.invalidate()
+
+    def discard(self, predicate):
+        """Drop all sessions whose key satisfies `predicate(key)`."""
+        with self._lock:
+            keys = [key for key in self._sessions if predicate(key)]
+            for key in keys:
+                self._notify_evicted(self._sessions.pop(key))
+            return len(keys)
+
+    def clear(self):
+        """Drop all the cached sessions."""
+        return self.discard(lambda key: True)
+
+    def add_eviction_listener(self, listener):
+        """Call `listener(session)` whenever a session leaves the cache."""
+        with self._lock:
+            self._eviction_listeners.append(listener)
+
+    def _notify_evicted(self, sess):
+        for listener in self._eviction_listeners:
+            listener(sess)
+
+    def stats(self):
+        """Return a dict of the cache's counters."""
+        with self._lock:
+            return {
+                'size': len(self._sessions),
+                'hits': self.hits,
+                'misses': self.misses,
+                'expired': self.expired,
+                'evictions': self.evictions,
+            }
+
+
+class ClientRegistry:
+    """A thread-safe registry of API client objects.
+
+    Clients are keyed on (session, service, API version) so that the
+    same client instance is handed back for the same credentials rather
+    than being rebuilt (and, for some clients, re-running discovery) on
+    every call.  The clients built on a session are dropped when that
+    session is invalidated.
+    """
+
+    def __init__(self):
+        self._clients = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_create(self, sess, service, version, create):
+        """Return the client for `service` at `version` on `sess`.
+
+        If there isn't one, `create()` is called to build it.
+        """
+        key = (sess, service, version)
+        with self._lock:
+            api_client = self._clients.get(key)
+            if api_client is not None:
+                self.hits += 1
+                return api_client
+            self.misses += 1
+        # Build outside the lock, some clients make HTTP calls when
+        # constructed.  If two threads race here, the first one to
+        # register its client wins.
+        api_client = create()
+        with self._lock:
+            return self._clients.setdefault(key, api_client)
+
+    def invalidate(self, sess):
+        """Drop all the clients built on `sess`."""
+        with self._lock:
+            for key in [key for key in self._clients if key[0] is sess]:
+                del self._clients[key]
+
+    def stats(self):
+        """Return a dict of the registry's counters."""
+        with self._lock:
+            return {
+                'size': len(self._clients),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+def _get_clients_config():
+    return CONF.get('clients') or {}
+
 
 # Cached session info.
-sessions = dict()
+sessions = SessionCache(
+    maxsize=_get_clients_config().get(
+        'session_cache_size', DEFAULT_SESSION_CACHE_SIZE),
+    expiry_margin=_get_clients_config().get(
+        'session_expiry_margin', DEFAULT_SESSION_EXPIRY_MARGIN))
+
+# Cached API clients, dropped along with their session.
+api_clients = ClientRegistry()
+sessions.add_eviction_listener(api_clients.invalidate)
 
 
 def get_or_create_session(user_name=None, project_name=None,
@@ -52,31 +234,47 @@ def get_or_create_session(user_name=None, project_name=None,
                           force_new=False):
     """Return a keystoneclient.session.Session object.
 
-    Sessions are cached on a per (user, project) basis.  If a cached one
-    exists, return it, otherwise create a new one.  Setting force_new to
-    True always makes a new one.
+    Sessions are cached on a per (user, project, domains, password) basis
+    and all share the connection pool from testiny.connections.
+    If a cached one exists, return it, otherwise create a new one.
+    Setting force_new to True always makes a new one.
 
     If user_name is not set, defaults to the configured admin user.
     If project_name is not set, an unscoped session is created.
     If password is not set, CONF.password is used.
     """
-    global sessions
-
     if user_name is None:
         user_name = CONF.username
     if password is None:
         password = CONF.password
-    session_key = (user_name, project_name)
-    sess = sessions.get(session_key)
-    if sess is not None and force_new is False:
-        return sess
-    auth = identity.v3.Password(
-        CONF.auth_url, username=user_name, password=password,
-        project_name=project_name, user_domain_name=user_domain_name,
-        project_domain_name=project_domain_name)
-    sess = session.Session(auth=auth)
-    sessions[session_key] = sess
-    return sess
+    session_key = (
+        user_name, project_name, user_domain_name, project_domain_name,
+        password)
+
+    def create():
+        auth = identity.v3.Password(
+            CONF.auth_url, username=user_name, password=password,
+            project_name=project_name, user_domain_name=user_domain_name,
+            project_domain_name=project_domain_name)
+        return session.Session(auth=auth, session=get_http_session())
+
+    if force_new:
+        return sessions.put(session_key, create())
+    return sessions.get_or_create(session_key, create)
+
+
+def forget_sessions(user_name=None, project_name=None):
+    """Drop the cached sessions for a user and/or a project.
+
+    Used by the user and project fixtures when they are cleaned up, as
+    the sessions can't be used once their user or project is gone.
+    """
+    def matches(key):
+        return (
+            (user_name is not None and key[0] == user_name) or
+            (project_name is not None and key[1] == project_name))
+
+    return sessions.discard(matches)
 
 
 def get_keystone_v3_client(user_name=None, project_name=None,
@@ -86,7 +284,9 @@ def get_keystone_v3_client(user_name=None, project_name=None,
         user_name=user_name, project_name=project_name,
         user_domain_name=user_domain_name,
         project_domain_name=project_domain_name, password=password)
-    return client.Client(version='v3', session=sess)
+    return api_clients.get_or_create(
+        sess, 'keystone', 'v3',
+        lambda: client.Client(version='v3', session=sess))
 
 
 def get_nova_v3_client(user_name=None, project_name=None,
@@ -97,7 +297,9 @@ def get_nova_v3_client(user_name=None, project_name=None,
         user_domain_name=user_domain_name,
         project_domain_name=project_domain_name, password=password)
     # TODO: Ensure novaclient v3 available (liberty)
-    return nova_client.Client(version='2', session=sess)
+    return api_clients.get_or_create(
+        sess, 'nova', '2',
+        lambda: nova_client.Client(version='2', session=sess))
 
 
 def get_neutron_client(user_name=None, project_name=None,
@@ -107,4 +309,6 @@ def get_neutron_client(user_name=None, project_name=None,
         user_name=user_name, project_name=project_name,
         user_domain_name=user_domain_name,
         project_domain_name=project_domain_name, password=password)
-    return neutron_client.Client(api_version='2.0', session=sess)
+    return api_clients.get_or_create(
+        sess, 'neutron', '2.0',
+        lambda: neutron_client.Client(api_version='2.0', session=sess))
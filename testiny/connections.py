@@ -0,0 +1,214 @@
+# Copyright (C) 2015 Cisco, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Shared HTTP connection pool for the Openstack API clients.
+
+All the keystone sessions created by Testiny send their requests
+through a single requests.Session, so that connections to keystone,
+nova and neutron are kept alive and reused across sessions, fixtures
+and threads.
+"""
+
+from __future__ import (
+    absolute_import,
+    print_function,
+    unicode_literals,
+    )
+
+str = None
+
+__metaclass__ = type
+__all__ = [
+    'get_http_session',
+    'PoolStats',
+    'pool_stats',
+    ]
+
+import socket
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+try:
+    from urllib3 import connectionpool
+    from urllib3.util.retry import Retry
+except ImportError:
+    # Older requests vendor their own urllib3.
+    from requests.packages.urllib3 import connectionpool
+    from requests.packages.urllib3.util.retry import Retry
+from testiny.config import CONF
+
+# Defaults for the 'connection_pool' section of the config.
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 20
+DEFAULT_POOL_BLOCK = True
+DEFAULT_CONNECT_RETRIES = 3
+DEFAULT_TCP_KEEPALIVE = True
+
+
+class PoolStats:
+    """Thread-safe counters for the shared connection pool.
+
+    - opened: new connections made to an endpoint.
+    - reused: requests which got an already open connection.
+    - waited: requests which had to wait for a connection to be
+      returned to a full pool, and `wait_time` the total seconds spent
+      waiting.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.opened = 0
+            self.reused = 0
+            self.waited = 0
+            self.wait_time = 0.0
+
+    def record_get(self, opened, waited_for):
+        with self._lock:
+            if opened:
+                self.opened += 1
+            else:
+                self.reused += 1
+            if waited_for is not None:
+                self.waited += 1
+                self.wait_time += waited_for
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'opened': self.opened,
+                'reused': self.reused,
+                'waited': self.waited,
+                'wait_time': self.wait_time,
+            }
+
+
+# Statistics for the shared pool.
+pool_stats = PoolStats()
+
+
+class _CountingPoolMixin:
+    """Records `pool_stats` for a urllib3 connection pool."""
+
+    def __init__(self, *args, **kwargs):
+        # Whether the connection handed out by _get_conn in the current
+        # thread was freshly opened.
+        self._opened_conn = threading.local()
+        super(_CountingPoolMixin, self).__init__(*args, **kwargs)
+
+    def _new_conn(self):
+        self._opened_conn.opened = True
+        return super(_CountingPoolMixin, self)._new_conn()
+
+    def _get_conn(self, timeout=None):
+        self._opened_conn.opened = False
+        # The pool holds None placeholders for connections not yet
+        # opened, so an empty queue means they are all in use.
+        must_wait = self.block and self.pool is not None and self.pool.empty()
+        start = time.time()
+        conn = super(_CountingPoolMixin, self)._get_conn(timeout=timeout)
+        pool_stats.record_get(
+            self._opened_conn.opened,
+            time.time() - start if must_wait else None)
+        return conn
+
+
+class CountingHTTPConnectionPool(
+        _CountingPoolMixin, connectionpool.HTTPConnectionPool):
+    pass
+
+
+class CountingHTTPSConnectionPool(
+        _CountingPoolMixin, connectionpool.HTTPSConnectionPool):
+    pass
+
+
+class SharedHTTPAdapter(HTTPAdapter):
+    """An HTTPAdapter whose pools record `pool_stats`."""
+
+    def __init__(self, tcp_keepalive=DEFAULT_TCP_KEEPALIVE, **kwargs):
+        self.tcp_keepalive = tcp_keepalive
+        super(SharedHTTPAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.tcp_keepalive:
+            kwargs['socket_options'] = (
+                connectionpool.HTTPConnection.default_socket_options +
+                [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)])
+        super(SharedHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': CountingHTTPConnectionPool,
+            'https': CountingHTTPSConnectionPool,
+        }
+
+
+def make_http_session(pool_connections=DEFAULT_POOL_CONNECTIONS,
+                      pool_maxsize=DEFAULT_POOL_MAXSIZE,
+                      pool_block=DEFAULT_POOL_BLOCK,
+                      connect_retries=DEFAULT_CONNECT_RETRIES,
+                      tcp_keepalive=DEFAULT_TCP_KEEPALIVE):
+    """Return a requests.Session using a `SharedHTTPAdapter`.
+
+    :param pool_connections: Number of endpoints to keep pools for.
+    :param pool_maxsize: Maximum number of connections per endpoint.
+    :param pool_block: If True, wait for a free connection when an
+        endpoint's pool is full rather than opening an extra one.
+    :param connect_retries: Number of retries when a connection can't
+        be made or is reset.
+    :param tcp_keepalive: Enable TCP keep-alive on the connections.
+    """
+    retries = Retry(
+        total=connect_retries, connect=connect_retries, read=connect_retries,
+        status=0, backoff_factor=0.1, raise_on_status=False)
+    adapter = SharedHTTPAdapter(
+        tcp_keepalive=tcp_keepalive, pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize, pool_block=pool_block,
+        max_retries=retries)
+    http_session = requests.Session()
+    http_session.mount('http://', adapter)
+    http_session.mount('https://', adapter)
+    return http_session
+
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+
+def get_http_session():
+    """Return the requests.Session shared by all the keystone sessions.
+
+    It is configured from the 'connection_pool' section of the config.
+    """
+    global _http_session
+
+    with _http_session_lock:
+        if _http_session is None:
+            config = CONF.get('connection_pool') or {}
+            _http_session = make_http_session(
+                pool_connections=config.get(
+                    'pool_connections', DEFAULT_POOL_CONNECTIONS),
+                pool_maxsize=config.get(
+                    'pool_maxsize', DEFAULT_POOL_MAXSIZE),
+                pool_block=config.get('pool_block', DEFAULT_POOL_BLOCK),
+                connect_retries=config.get(
+                    'connect_retries', DEFAULT_CONNECT_RETRIES),
+                tcp_keepalive=config.get(
+                    'tcp_keepalive', DEFAULT_TCP_KEEPALIVE))
+        return _http_session
@@ -0,0 +1,170 @@
+# Copyright (C) 2015 Cisco, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Tracking of server deletions.
+
+Once nova has been asked to delete a server, the server is handed to the
+`DeletionTracker`, which confirms it is gone through the server poller:
+all the servers being deleted are checked together, with one throttled
+list call per tick, rather than each deletion polling on its own.
+
+The time each server took to go, from the delete request, is recorded
+along with its compute host, so slow hosts stand out in the report
+printed at exit.
+"""
+
+from __future__ import (
+    absolute_import,
+    print_function,
+    unicode_literals,
+    )
+
+str = None
+
+__metaclass__ = type
+__all__ = [
+    'Deletion',
+    'DeletionTracker',
+    'get_deletion_tracker',
+    ]
+
+import atexit
+from collections import namedtuple
+from concurrent import futures
+import sys
+import threading
+import time
+
+from testiny.config import CONF
+from testiny.poller import get_server_poller
+from testiny.utils import percentile
+
+# Defaults for the 'deletion' section of the config.
+DEFAULT_TIMEOUT = 300
+DEFAULT_REPORT_HOSTS = 5
+
+# Attribute of servers, as seen by the admin, naming their compute host.
+HOST_ATTRIBUTE = 'OS-EXT-SRV-ATTR:host'
+
+# A completed server deletion; elapsed is the time to deleted, in
+# seconds, from the delete request.
+Deletion = namedtuple('Deletion', ['server_id', 'name', 'host', 'elapsed'])
+
+
+class DeletionTracker:
+    """Confirms that deleted servers are gone.
+
+    :param poller: The `ServerPoller` to check the servers with.
+    :param timeout: Seconds after which a deletion is deemed to have
+        failed.
+    """
+
+    def __init__(self, poller, timeout=DEFAULT_TIMEOUT):
+        self.poller = poller
+        self.timeout = timeout
+        # Completed deletions, in order of completion.
+        self.deletions = []
+        self._lock = threading.Lock()
+
+    def track(self, server, started=None):
+        """Track the deletion of `server`, which was just requested.
+
+        :param started: When the deletion was requested, as from
+            time.time(); defaults to now.
+        :return: A Future of the `Deletion`.  It fails with
+            testiny.poller.WaitTimeout if the server isn't gone in time.
+        """
+        if started is None:
+            started = time.time()
+        hosts = []
+
+        def is_deleted(found):
+            if found is None:
+                return True
+            # Only the poller's admin view of the server has its host.
+            host = getattr(found, HOST_ATTRIBUTE, None)
+            if host is not None:
+                hosts.append(host)
+            return found.status == 'DELETED'
+
+        deleted = futures.Future()
+
+        def done(watched):
+            try:
+                _, when = watched.result()
+            except Exception as e:
+                deleted.set_exception(e)
+                return
+            deletion = Deletion(
+                server.id, getattr(server, 'name', None),
+                hosts[-1] if hosts else None, when - started)
+            with self._lock:
+                self.deletions.append(deletion)
+            deleted.set_result(deletion)
+
+        self.poller.watch(
+            server.id, is_deleted, timeout=self.timeout).add_done_callback(
+                done)
+        return deleted
+
+    def format_report(self, max_hosts=DEFAULT_REPORT_HOSTS):
+        """Describe the times to deleted, overall and by slowest host."""
+        with self._lock:
+            deletions = list(self.deletions)
+        if not deletions:
+            return "No server deleted"
+        elapsed = sorted(deletion.elapsed for deletion in deletions)
+        lines = [
+            "%d servers deleted in p50=%.2fs p90=%.2fs max=%.2fs" % (
+                len(elapsed), percentile(elapsed, 50),
+                percentile(elapsed, 90), elapsed[-1]),
+        ]
+        by_host = {}
+        for deletion in deletions:
+            if deletion.host is not None:
+                by_host.setdefault(deletion.host, []).append(
+                    deletion.elapsed)
+        slowest = sorted(
+            by_host.items(), key=lambda item: max(item[1]), reverse=True)
+        for host, times in slowest[:max_hosts]:
+            lines.append(
+                "  %s: %d deleted, mean %.2fs, max %.2fs" % (
+                    host, len(times), sum(times) / len(times), max(times)))
+        return "\n".join(lines)
+
+
+_tracker = None
+_tracker_lock = threading.Lock()
+
+
+def _report(tracker, stream=None):
+    if stream is None:
+        stream = sys.stderr
+    if tracker.deletions:
+        print(tracker.format_report(), file=stream)
+
+
+def get_deletion_tracker():
+    """Return the DeletionTracker shared by all the server fixtures."""
+    global _tracker
+
+    with _tracker_lock:
+        if _tracker is None:
+            config = CONF.get('deletion') or {}
+            _tracker = DeletionTracker(
+                get_server_poller(),
+                timeout=config.get('timeout', DEFAULT_TIMEOUT))
+            atexit.register(_report, _tracker)
+        return _tracker
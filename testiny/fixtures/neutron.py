@@ -26,49 +26,71 @@ str = None
 
 __metaclass__ = type
 __all__ = [
+    "InterfaceOperation",
     "NeutronNetworkFixture",
+    "NeutronNetworksFixture",
+    "PortsFixture",
     "RouterFixture",
     "SecurityGroupRuleFixture",
+    "SecurityGroupRulesFixture",
     ]
 
+from collections import namedtuple
+from concurrent import futures
 from copy import copy
+import threading
+import time
 
 import fixtures
+from testiny.async_clients import (
+    DEFAULT_MAX_WORKERS,
+    get_executor,
+    wait_all,
+)
+from testiny.cache import (
+    find_network,
+    lookup,
+)
 from testiny.clients import get_neutron_client
 from testiny.config import CONF
-from testiny.utils import synchronized
 from testiny.factory import factory
-from testiny.utils import wait_until
+from testiny.poller import (
+    get_port_poller,
+    get_router_poller,
+)
+from testiny.subnets import get_subnet_allocator
+from testiny.teardown import (
+    add_teardown,
+    TEARDOWN_NETWORK,
+    TEARDOWN_PORT,
+    TEARDOWN_SUBNET,
+)
+from testiny.utils import percentile
 from testtools.content import text_content
 
-SUBNET_ID_MIN = 11
-SUBNET_ID_MAX = 254
+# A router interface operation, as recorded by RouterFixture.
+# action is 'add' or 'remove'; api_time is the seconds the API call took
+# and port_time the seconds, from the start of the call, until the
+# interface's port was ACTIVE, or gone for a removal (None if not
+# waited for); error is the exception raised, if any.
+InterfaceOperation = namedtuple(
+    'InterfaceOperation',
+    ['action', 'subnet_id', 'port_id', 'api_time', 'port_time', 'error'])
 
 
 class NeutronNetworkFixture(fixtures.Fixture):
     """Test fixture that creates a randomly-named neutron network.
 
     The name is available as the 'name' property after creation.
+
+    The subnet's CIDR is allocated from the pool configured in the
+    'network' section of the config, see testiny.subnets.
     """
-    # A record of the available subnet ids.
-    available_subnet_ids = set(
-        range(SUBNET_ID_MAX, SUBNET_ID_MIN - 1, -1))
 
-    def __init__(self, project_fixture):
+    def __init__(self, project_fixture, ip_version=4):
         super(NeutronNetworkFixture, self).__init__()
         self.project_fixture = project_fixture
-
-    @classmethod
-    @synchronized
-    def get_subnet_id(cls):
-        """Get an available subnet id."""
-        return cls.available_subnet_ids.pop()
-
-    @classmethod
-    @synchronized
-    def release_subnet_id(cls, id):
-        """Release the given subnet id."""
-        cls.available_subnet_ids.add(id)
+        self.ip_version = ip_version
 
     def _setUp(self):
         super(NeutronNetworkFixture, self)._setUp()
@@ -76,31 +98,42 @@ class NeutronNetworkFixture(fixtures.Fixture):
             project_name=self.project_fixture.name,
             user_name=self.project_fixture.admin_user.name,
             password=self.project_fixture.admin_user_fixture.password)
-        self.subnet_id = self.get_subnet_id()
-        cidr = CONF.network['cidr'].format(subnet=self.subnet_id)
+        allocator = get_subnet_allocator(self.ip_version)
+        self.cidr = cidr = allocator.allocate()
         # TODO: handle clashes and retry.
         self.net_name = factory.make_obj_name("network")
         self.sub_name = factory.make_obj_name("subnet")
-        self.network = self.neutron.create_network(
-            {"network": dict(name=self.net_name)})
+        try:
+            self.network = self.neutron.create_network(
+                {"network": dict(name=self.net_name)})
+        except Exception:
+            allocator.release(cidr)
+            raise
+        add_teardown(self, TEARDOWN_NETWORK, self.delete_network)
         network_id = self.network["network"]["id"]
-        self.subnet = self.neutron.create_subnet(
-            {"subnet": dict(
-                name=self.sub_name, network_id=network_id, cidr=cidr,
-                ip_version=4)})
-        self.addCleanup(self.delete_network)
+        try:
+            self.subnet = self.neutron.create_subnet(
+                {"subnet": dict(
+                    name=self.sub_name, network_id=network_id, cidr=cidr,
+                    ip_version=self.ip_version)})
+        except Exception:
+            allocator.release(cidr)
+            raise
+        add_teardown(self, TEARDOWN_SUBNET, self.delete_subnet)
         self.addDetail(
             'NeutronNetworkFixture-network',
             text_content('Network %s created' % self.net_name))
         self.addDetail(
             'NeutronNetworkFixture-subnet',
-            text_content('Subnet %s created (cidr=%s)' % (
-                self.sub_name, cidr)))
+            text_content('Subnet %s created (cidr=%s); %s' % (
+                self.sub_name, cidr, allocator.format_usage())))
 
-    def delete_network(self):
+    def delete_subnet(self):
         self.neutron.delete_subnet(self.subnet["subnet"]["id"])
+        get_subnet_allocator(self.ip_version).release(self.cidr)
+
+    def delete_network(self):
         self.neutron.delete_network(self.network["network"]["id"])
-        self.release_subnet_id(self.subnet_id)
 
     def get_network(self, network_name):
         """Fetch network object given its network name.
@@ -109,27 +142,156 @@ class NeutronNetworkFixture(fixtures.Fixture):
         context of the project, e.g. external networks.
 
         Returns None if not found.
+
+        The external network is looked up through the lookup cache.
         """
+        if network_name == CONF.network['external_network']:
+            return find_network(self.neutron, network_name)
         networks = self.neutron.list_networks(name=network_name)['networks']
         return networks[0] if len(networks) == 1 else None
 
+    def get_external_network(self):
+        """Return the configured external network."""
+        return self.get_network(CONF.network['external_network'])
+
     def get_external_gateway_ip(self, subnet_index=0):
         """Return the gateway IP of a subnet in the public network."""
-        external_network = self.get_network(CONF.network['external_network'])
-        subnets = self.neutron.list_subnets(
-            network_id=external_network['id'])['subnets']
+        name = CONF.network['external_network']
+        subnets = lookup(
+            'external-subnets', name,
+            lambda: self.neutron.list_subnets(
+                network_id=self.get_external_network()['id'])['subnets'])
         return subnets[subnet_index]['gateway_ip']
 
 
+class NeutronNetworksFixture(fixtures.Fixture):
+    """Test fixture that creates many neutron networks at once.
+
+    All the networks are created with a single bulk create_network
+    request, then all their subnets with a single bulk create_subnet
+    request.  Neutron has no bulk delete, so they are deleted with
+    concurrent requests.
+
+    After creation, 'networks' and 'subnets' are lists of the network
+    and subnet dicts, in the same order: the subnet at index i is the
+    one of the network at index i.
+    """
+
+    def __init__(self, project_fixture, count, ip_version=4):
+        super(NeutronNetworksFixture, self).__init__()
+        self.project_fixture = project_fixture
+        self.count = count
+        self.ip_version = ip_version
+        self.networks = []
+        self.subnets = []
+
+    def _setUp(self):
+        super(NeutronNetworksFixture, self)._setUp()
+        self.neutron = get_neutron_client(
+            project_name=self.project_fixture.name,
+            user_name=self.project_fixture.admin_user.name,
+            password=self.project_fixture.admin_user_fixture.password)
+        allocator = get_subnet_allocator(self.ip_version)
+        self.cidrs = allocator.allocate_many(self.count)
+        try:
+            self.networks = self.neutron.create_network({"networks": [
+                dict(name=factory.make_obj_name("network"))
+                for _ in range(self.count)]})["networks"]
+        except Exception:
+            allocator.release(*self.cidrs)
+            raise
+        add_teardown(self, TEARDOWN_NETWORK, self.delete_networks)
+        try:
+            self.subnets = self.neutron.create_subnet({"subnets": [
+                dict(
+                    name=factory.make_obj_name("subnet"),
+                    network_id=network["id"], cidr=cidr,
+                    ip_version=self.ip_version)
+                for network, cidr in zip(self.networks, self.cidrs)]})[
+                    "subnets"]
+        except Exception:
+            allocator.release(*self.cidrs)
+            raise
+        add_teardown(self, TEARDOWN_SUBNET, self.delete_subnets)
+        self.addDetail(
+            'NeutronNetworksFixture',
+            text_content('%d networks created (cidrs=%s); %s' % (
+                self.count, ", ".join(self.cidrs),
+                allocator.format_usage())))
+
+    def _delete_all(self, delete, ids):
+        executor = get_executor()
+        wait_all(
+            executor.submit(delete, resource_id) for resource_id in ids)
+
+    def delete_subnets(self):
+        self._delete_all(
+            self.neutron.delete_subnet,
+            [subnet["id"] for subnet in self.subnets])
+        get_subnet_allocator(self.ip_version).release(*self.cidrs)
+
+    def delete_networks(self):
+        self._delete_all(
+            self.neutron.delete_network,
+            [network["id"] for network in self.networks])
+
+
+class PortsFixture(fixtures.Fixture):
+    """Test fixture that creates neutron ports on a network.
+
+    The ports are created with a single bulk create_port request, and
+    are available as the 'ports' property, a list of port dicts, after
+    creation.  Servers booted on them don't delete them, so they are
+    deleted, concurrently, on cleanup.
+    """
+
+    def __init__(self, project_fixture, network_id, count=1):
+        super(PortsFixture, self).__init__()
+        self.project_fixture = project_fixture
+        self.network_id = network_id
+        self.count = count
+        self.ports = []
+
+    def _setUp(self):
+        super(PortsFixture, self)._setUp()
+        self.neutron = get_neutron_client(
+            project_name=self.project_fixture.name,
+            user_name=self.project_fixture.admin_user.name,
+            password=self.project_fixture.admin_user_fixture.password)
+        self.ports = self.neutron.create_port({"ports": [
+            dict(
+                name=factory.make_obj_name("port"),
+                network_id=self.network_id, admin_state_up=True)
+            for _ in range(self.count)]})["ports"]
+        add_teardown(self, TEARDOWN_PORT, self.delete_ports)
+        self.addDetail(
+            'PortsFixture',
+            text_content('%d ports created' % len(self.ports)))
+
+    def delete_ports(self):
+        executor = get_executor()
+        wait_all(
+            executor.submit(self.neutron.delete_port, port["id"])
+            for port in self.ports)
+
+
 class RouterFixture(fixtures.Fixture):
     """Test fixture that creates a randomly-named neutron router.
 
     The name is available as the 'name' property after creation.
+
+    Each interface added or removed is recorded as an
+    `InterfaceOperation` in the 'operations' list, and a summary of
+    their latencies is added to the fixture's details.
     """
     def __init__(self, project_fixture):
         super(RouterFixture, self).__init__()
         self.project_fixture = project_fixture
         self.subnet_ids = []
+        # Maps the subnet ids in subnet_ids to their interface's port id.
+        self.port_ids = {}
+        self.operations = []
+        self._lock = threading.Lock()
 
     def setUp(self):
         super(RouterFixture, self).setUp()
@@ -141,14 +303,20 @@ class RouterFixture(fixtures.Fixture):
         self.name = factory.make_obj_name("router")
         self.router = self.neutron.create_router(
             {'router': {'name': self.name, 'admin_state_up': True}})
-        self.addCleanup(self.delete_router)
+        add_teardown(self, TEARDOWN_PORT, self.delete_router)
         self.addDetail(
             'RouterFixture-network',
             text_content('Router %s created' % self.name))
         self.wait_until_active()
 
-    def wait_until_active(self):
-        wait_until(lambda: self.refresh()['router']['status'] == 'ACTIVE')
+    def wait_until_active(self, timeout=60):
+        def is_active(router):
+            if router is None:
+                raise Exception("Router %s has disappeared" % self.name)
+            return router['status'] == 'ACTIVE'
+
+        self.router['router'] = get_router_poller().wait(
+            self.router['router']['id'], is_active, timeout=timeout)
 
     def refresh(self):
         """Refresh the self.router object."""
@@ -158,15 +326,132 @@ class RouterFixture(fixtures.Fixture):
             self.router['router'] = routers['routers'][0]
         return self.router
 
+    def _operate(self, action, subnet_id, wait, timeout):
+        start = time.time()
+        port_id = api_time = port_time = error = None
+        try:
+            if action == 'add':
+                port_id = self.neutron.add_interface_router(
+                    self.router["router"]["id"],
+                    {'subnet_id': subnet_id})['port_id']
+                with self._lock:
+                    self.subnet_ids.append(subnet_id)
+                    self.port_ids[subnet_id] = port_id
+            else:
+                self.neutron.remove_interface_router(
+                    self.router["router"]["id"], {'subnet_id': subnet_id})
+                with self._lock:
+                    self.subnet_ids.remove(subnet_id)
+                    port_id = self.port_ids.pop(subnet_id, None)
+            api_time = time.time() - start
+            if wait and port_id is not None:
+                if action == 'add':
+                    def predicate(port):
+                        if port is None:
+                            raise Exception(
+                                "Port %s has disappeared" % port_id)
+                        return port['status'] == 'ACTIVE'
+                else:
+                    def predicate(port):
+                        return port is None
+                _, changed = get_port_poller().wait_with_timestamp(
+                    port_id, predicate, timeout=timeout)
+                port_time = changed - start
+        except Exception as e:
+            error = e
+        operation = InterfaceOperation(
+            action, subnet_id, port_id, api_time, port_time, error)
+        with self._lock:
+            self.operations.append(operation)
+        return operation
+
+    def _operate_many(self, action, subnet_ids, max_workers, wait, timeout):
+        if max_workers is None:
+            max_workers = (CONF.get('concurrency') or {}).get(
+                'max_workers', DEFAULT_MAX_WORKERS)
+        subnet_ids = list(subnet_ids)
+        if not subnet_ids:
+            return []
+        executor = futures.ThreadPoolExecutor(
+            max_workers=min(max_workers, len(subnet_ids)))
+        try:
+            operations = [
+                future.result() for future in [
+                    executor.submit(
+                        self._operate, action, subnet_id, wait, timeout)
+                    for subnet_id in subnet_ids]]
+        finally:
+            executor.shutdown(wait=True)
+        for operation in operations:
+            if operation.error is not None:
+                raise operation.error
+        return operations
+
     def add_interface_router(self, subnet_id):
-        self.neutron.add_interface_router(
-            self.router["router"]["id"], {'subnet_id': subnet_id})
-        self.subnet_ids.append(subnet_id)
+        operation = self._operate('add', subnet_id, False, None)
+        if operation.error is not None:
+            raise operation.error
 
     def remove_interface_router(self, subnet_id):
-        self.neutron.remove_interface_router(
-            self.router["router"]["id"], {'subnet_id': subnet_id})
-        self.subnet_ids.remove(subnet_id)
+        operation = self._operate('remove', subnet_id, False, None)
+        if operation.error is not None:
+            raise operation.error
+
+    def add_interfaces_router(self, subnet_ids, max_workers=None,
+                              wait=True, timeout=60):
+        """Add interfaces on many subnets to the router at once.
+
+        :param max_workers: Maximum number of API calls in flight at
+            once, defaults to 'max_workers' in the 'concurrency' config
+            section.
+        :param wait: Wait for each interface's port to be ACTIVE.
+        :return: The list of `InterfaceOperation`, in the order of
+            `subnet_ids`.  If some failed, the first error is raised
+            once all are done; the operations are still recorded.
+        """
+        return self._operate_many(
+            'add', subnet_ids, max_workers, wait, timeout)
+
+    def remove_interfaces_router(self, subnet_ids, max_workers=None,
+                                 wait=True, timeout=60):
+        """Remove the interfaces on many subnets from the router at once.
+
+        See `add_interfaces_router`; with `wait`, waits for each
+        interface's port to be deleted.
+        """
+        return self._operate_many(
+            'remove', subnet_ids, max_workers, wait, timeout)
+
+    def format_operations(self):
+        """Return a summary of the latencies of the operations."""
+        lines = []
+        with self._lock:
+            operations = list(self.operations)
+        for action in ('add', 'remove'):
+            done = [
+                operation for operation in operations
+                if operation.action == action]
+            if not done:
+                continue
+            failed = sum(1 for operation in done if operation.error)
+            line = "%s: %d operations, %d failed" % (
+                action, len(done), failed)
+            for label, field in (('api', 'api_time'), ('port', 'port_time')):
+                times = sorted(
+                    getattr(operation, field) for operation in done
+                    if getattr(operation, field) is not None)
+                if times:
+                    line += "; %s s: p50=%.2f p90=%.2f max=%.2f" % (
+                        label, percentile(times, 50),
+                        percentile(times, 90), times[-1])
+            lines.append(line)
+        return "\n".join(lines)
+
+    def _add_operations_detail(self):
+        if self.operations:
+            self.addDetail(
+                'RouterFixture-interfaces',
+                text_content(self.format_operations()))
 
     def add_gateway_router(self, network_id):
         self.neutron.add_gateway_router(
@@ -177,18 +462,24 @@ class RouterFixture(fixtures.Fixture):
             self.router["router"]["id"])
 
     def delete_router(self):
-        # Delete interfaces first.
-        # Make a copy of the list since it's amended by
-        # remove_interface_router as the IDs become available again.
-        for subnet_id in copy(self.subnet_ids):
-            self.remove_interface_router(subnet_id)
-        # Clear gateway.
-        self.remove_gateway_router()
-        # Delete router.
-        self.neutron.delete_router(self.router["router"]["id"])
-        self.addDetail(
-            'RouterFixture-network',
-            text_content('Router %s deleted' % self.name))
+        try:
+            # Delete interfaces first.
+            # Make a copy of the list since it's amended by
+            # remove_interface_router as the IDs become available again.
+            for subnet_id in copy(self.subnet_ids):
+                self.remove_interface_router(subnet_id)
+            # Clear gateway.
+            self.remove_gateway_router()
+            # Delete router.
+            self.neutron.delete_router(self.router["router"]["id"])
+            self.addDetail(
+                'RouterFixture-network',
+                text_content('Router %s deleted' % self.name))
+        finally:
+            # Here rather than in a cleanup of its own, so that the
+            # removals are included even when this runs in the
+            # background teardown.
+            self._add_operations_detail()
 
 
 class SecurityGroupRuleFixture(fixtures.Fixture):
@@ -232,23 +523,14 @@ class SecurityGroupRuleFixture(fixtures.Fixture):
                     self.security_group_rule
                     ['security_group_rule']
                     ['security_group_id'])))
-        self.addCleanup(self.delete_security_group_rule)
+        add_teardown(self, TEARDOWN_PORT, self.delete_security_group_rule)
 
     def load_security_group(self):
-        sec_groups = (
-            self.neutron.list_security_groups()['security_groups']
-        )
-        sec_groups = [
-            group
-            for group in sec_groups
-            if group['tenant_id'] == self.project_fixture.project.id and
-            group['name'] == self.security_group_name
-        ]
-        if len(sec_groups) != 1:
-            raise Exception(
-                "Can't find security group named '%s'" %
-                self.security_group_name)
-        self.security_group = sec_groups[0]
+        self.security_group = {
+            'id': self.project_fixture.get_security_group_id(
+                self.security_group_name),
+            'name': self.security_group_name,
+        }
 
     def delete_security_group_rule(self):
         self.neutron.delete_security_group_rule(
@@ -258,3 +540,51 @@ class SecurityGroupRuleFixture(fixtures.Fixture):
             text_content(
                 'Security group rule %s deleted' %
                 self.security_group_rule))
+
+
+class SecurityGroupRulesFixture(fixtures.Fixture):
+    """Test fixture that creates many rules in a security group at once.
+
+    The rules are created with a single bulk request.  This assumes the
+    security group already exists.
+
+    :param rules: List of dicts of the rules' attributes, e.g.
+        {'direction': 'ingress', 'protocol': 'tcp',
+         'port_range_min': 22, 'port_range_max': 22}
+    """
+    def __init__(self, project_fixture, security_group_name, rules):
+        super(SecurityGroupRulesFixture, self).__init__()
+        self.project_fixture = project_fixture
+        self.security_group_name = security_group_name
+        self.rules = rules
+        self.security_group_rules = []
+
+    def _setUp(self):
+        super(SecurityGroupRulesFixture, self)._setUp()
+        self.neutron = get_neutron_client(
+            project_name=self.project_fixture.name,
+            user_name=self.project_fixture.admin_user.name,
+            password=self.project_fixture.admin_user_fixture.password)
+        security_group_id = self.project_fixture.get_security_group_id(
+            self.security_group_name)
+        rules = []
+        for rule in self.rules:
+            rule = dict(rule)
+            rule['security_group_id'] = security_group_id
+            rules.append(rule)
+        self.security_group_rules = self.neutron.create_security_group_rule(
+            {'security_group_rules': rules})['security_group_rules']
+        add_teardown(self, TEARDOWN_PORT, self.delete_security_group_rules)
+        self.addDetail(
+            'SecurityGroupRulesFixture',
+            text_content(
+                '%d rules created in security group %s' % (
+                    len(self.security_group_rules),
+                    self.security_group_name)))
+
+    def delete_security_group_rules(self):
+        executor = get_executor()
+        wait_all(
+            executor.submit(
+                self.neutron.delete_security_group_rule, rule['id'])
+            for rule in self.security_group_rules)
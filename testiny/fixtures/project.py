@@ -29,11 +29,22 @@ __all__ = [
     "ProjectFixture",
     ]
 
+import threading
+
 import fixtures
 import keystoneclient
-from testiny.clients import get_keystone_v3_client
+from testiny.cache import call_with_lookup
+from testiny.clients import (
+    forget_sessions,
+    get_keystone_v3_client,
+    get_neutron_client,
+)
 from testiny.config import CONF
 from testiny.factory import factory
+from testiny.teardown import (
+    add_teardown,
+    TEARDOWN_PROJECT,
+)
 from testiny.fixtures.user import UserFixture
 from testtools.content import text_content
 
@@ -43,13 +54,21 @@ class ProjectFixture(fixtures.Fixture):
 
     The name is available as the 'name' property after creation.
     """
+    def __init__(self):
+        super(ProjectFixture, self).__init__()
+        # Maps security group names to their ids.
+        self._security_group_ids = {}
+        self._security_group_lock = threading.Lock()
+
     def _setUp(self):
         super(ProjectFixture, self)._setUp()
         self.name = factory.make_obj_name('project')
         self.keystone = get_keystone_v3_client(project_name=CONF.admin_project)
         self.project = self.keystone.projects.create(
             name=self.name, domain='default')
-        self.addCleanup(self.delete_project)
+        # Any sessions for this project are useless once it's deleted.
+        self.addCleanup(forget_sessions, project_name=self.name)
+        add_teardown(self, TEARDOWN_PROJECT, self.delete_project)
         self.addDetail(
             'ProjectFixture', text_content('Project %s created' % self.name))
 
@@ -64,6 +83,27 @@ class ProjectFixture(fixtures.Fixture):
         """Delete this project."""
         self.keystone.projects.delete(project=self.project)
 
+    def get_security_group_id(self, name):
+        """Return the id of this project's security group named `name`.
+
+        The groups are looked up with server-side filters, fetching only
+        the ids, and the result is cached.
+        """
+        with self._security_group_lock:
+            if name not in self._security_group_ids:
+                neutron = get_neutron_client(
+                    project_name=self.name,
+                    user_name=self.admin_user.name,
+                    password=self.admin_user_fixture.password)
+                groups = neutron.list_security_groups(
+                    tenant_id=self.project.id, name=name,
+                    fields=['id'])['security_groups']
+                if len(groups) != 1:
+                    raise Exception(
+                        "Can't find security group named '%s'" % name)
+                self._security_group_ids[name] = groups[0]['id']
+            return self._security_group_ids[name]
+
     def add_user_to_role(self, user_or_user_fixture, role_name):
         """Give an existing user a role on this project.
 
@@ -74,10 +114,18 @@ class ProjectFixture(fixtures.Fixture):
             user = user_or_user_fixture.user
         else:
             user = user_or_user_fixture
-        role = self.keystone.roles.find(name=role_name)
-        self.keystone.roles.grant(
-            role, user=user, project=self.project)
-        self.addCleanup(self.delete_role_grant, user, role)
+
+        def grant(role):
+            self.keystone.roles.grant(role, user=user, project=self.project)
+            return role
+
+        # Roles are looked up through the lookup cache; a 404 on the
+        # grant means the cached role is stale.
+        role = call_with_lookup(
+            'role', role_name,
+            lambda: self.keystone.roles.find(name=role_name), grant)
+        add_teardown(
+            self, TEARDOWN_PROJECT, self.delete_role_grant, user, role)
 
     def delete_role_grant(self, user, role):
         # There seems to be a bug in testtools where the cleanups are
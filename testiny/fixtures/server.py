@@ -26,20 +26,36 @@ str = None
 
 __metaclass__ = type
 __all__ = [
+    "CommandResult",
     "KeypairFixture",
+    "ping_matrix",
+    "run_command_on_servers",
+    "run_commands",
     "ServerFixture",
+    "ServerGroupFixture",
+    "ServerGroupMemberFixture",
     "ServerStatusError",
     "TimeoutError",
     ]
 
-import datetime
-import os
-import subprocess
+from collections import namedtuple
+from concurrent import futures
+import threading
 import time
 
 import fixtures
 import novaclient
 import six
+from testiny import probe
+from testiny.async_clients import (
+    DEFAULT_MAX_WORKERS,
+    wait_all,
+)
+from testiny.cache import (
+    find_flavor,
+    find_image,
+    find_network,
+)
 from testiny.clients import (
     get_neutron_client,
     get_nova_v3_client,
@@ -49,26 +65,39 @@ from testiny.config import (
     INSTANCE_ACCESS_FLOATING_IP,
     INSTANCE_ACCESS_LOCAL_NETNS,
 )
+from testiny.deletions import get_deletion_tracker
 from testiny.factory import factory
-from testiny.fixtures.neutron import (
-    NeutronNetworkFixture,
-    RouterFixture,
-    SecurityGroupRuleFixture,
+from testiny.fixtures.neutron import PortsFixture
+from testiny.fixtures.tenant import (
+    add_tenant_tasks,
+    get_tenant_pool,
+    KeypairFixture,
+    LeasedTenantFixture,
+)
+from testiny.floatingips import get_floating_ip_pool
+from testiny.netns import (
+    get_namespace_watcher,
+    get_netns_agent,
+)
+from testiny.ping import PingMonitor
+from testiny.poller import (
+    get_server_poller,
+    WaitTimeout,
+)
+from testiny.ssh import (
+    communicate,
+    SSHConnectionPool,
+    TimeoutError,
 )
-from testiny.fixtures.project import ProjectFixture
-from testiny.fixtures.user import UserFixture
-from testiny.utils import (
-    check_network_namespace,
-    parse_ping_output,
-    retry,
+from testiny.taskgraph import FixtureGraph
+from testiny.teardown import (
+    add_teardown,
+    TEARDOWN_SERVER,
 )
+from testiny.utils import retry
 from testtools.content import text_content
 
 
-class TimeoutError(Exception):
-    """Raised when the timeout is exceeded for an ssh call."""
-
-
 class ServerStatusError(Exception):
     """Raised when a server moves into an error state."""
 
@@ -98,15 +127,50 @@ class ServerFixture(fixtures.Fixture):
 
     The name is available as the 'name' property after creation.
 
+    The server is booted on the network of network_fixture, letting
+    nova create its port, unless:
+        - port_id is given: the server is booted on that port, e.g. one
+          of the ports of a PortsFixture;
+        - precreate_port is True: the port is created beforehand, as
+          the 'port_fixture' property.
+
+    On cleanup, the deletion of the server is handed to the deletion
+    tracker (see testiny.deletions), and waited for unless
+    wait_for_deletion is False.  The tracker's future of the deletion
+    is the 'deletion' property.  Without waiting, the server may still
+    hold its port when the cleanups of the port, subnet and network
+    run: neutron refuses those with 409s, which are only retried by
+    the background teardown (see testiny.teardown).  So only pass
+    wait_for_deletion=False with background teardown enabled, or with
+    a network which outlives the test.
+
     Additional args are passed to nova.servers.create()
     """
     def __init__(self, project_fixture, user_fixture, network_fixture,
+                 port_id=None, precreate_port=False, wait_for_deletion=True,
                  **kwargs):
         super(ServerFixture, self).__init__()
         self.project_fixture = project_fixture
         self.user_fixture = user_fixture
         self.network_fixture = network_fixture
+        self.port_id = port_id
+        self.precreate_port = precreate_port
+        self.wait_for_deletion = wait_for_deletion
+        self.port_fixture = None
+        self.deletion = None
         self.instance_kwargs = kwargs
+        self.ssh_connections = SSHConnectionPool()
+        # Time at which the server was booted, and seconds it took for
+        # the server to be ACTIVE and SSH to be reachable after that.
+        self.boot_started = None
+        self.time_to_active = None
+        self.time_to_ssh_ready = None
+        # Whether the SSH probe run before commands timed out: commands
+        # then go straight to ssh rather than probing again each retry.
+        self.ssh_probe_failed = False
+        # The network namespace to access the server from, with the
+        # 'local_netns' access method, once looked up.
+        self._access_netns = None
         self._init_background_ping()
 
     def _setUp(self):
@@ -114,8 +178,11 @@ class ServerFixture(fixtures.Fixture):
         self.setup_prerequisites()
         # TODO: Catch errors and show sensible error messages.
         # TODO: Do retries.
+        self.boot_started = time.time()
         self.create_server()
-        self.addCleanup(self.delete_server)
+        add_teardown(self, TEARDOWN_SERVER, self.delete_server)
+        self.addCleanup(self.ssh_connections.close)
+        self.addCleanup(self._stop_background_pings)
 
         self.addDetail(
             'ServerFixture',
@@ -127,10 +194,17 @@ class ServerFixture(fixtures.Fixture):
             project_name=self.project_fixture.name,
             password=self.user_fixture.password)
         self.name = factory.make_obj_name('instance')
-        self.flavor = self.nova.flavors.find(
-            name=CONF.fast_image['flavor_name'])
-        self.image = self.nova.images.find(name=CONF.fast_image['image_name'])
-        self.nics = [{"net-id": self.network_fixture.network["network"]["id"]}]
+        self.flavor = find_flavor(self.nova, CONF.fast_image['flavor_name'])
+        self.image = find_image(self.nova, CONF.fast_image['image_name'])
+        network_id = self.network_fixture.network["network"]["id"]
+        if self.port_id is None and self.precreate_port:
+            self.port_fixture = self.useFixture(
+                PortsFixture(self.project_fixture, network_id))
+            self.port_id = self.port_fixture.ports[0]["id"]
+        if self.port_id is not None:
+            self.nics = [{"port-id": self.port_id}]
+        else:
+            self.nics = [{"net-id": network_id}]
 
     def create_server(self):
         """Create a new server instance.
@@ -142,17 +216,16 @@ class ServerFixture(fixtures.Fixture):
             **self.instance_kwargs)
 
     def delete_server(self):
+        started = time.time()
         self.nova.servers.delete(self.server)
-        while True:
-            try:
-                server = self.server.manager.get(self.server.id)
-            except novaclient.exceptions.NotFound:
-                break
-            if server is None or server.status != 'ACTIVE':
-                break
-        self.addDetail(
-            'ServerFixture',
-            text_content('Server instance named %s deleted' % self.name))
+        self.deletion = get_deletion_tracker().track(self.server, started)
+        if self.wait_for_deletion:
+            deletion = self.deletion.result()
+            self.addDetail(
+                'ServerFixture',
+                text_content(
+                    'Server instance named %s deleted in %.2fs' % (
+                        self.name, deletion.elapsed)))
 
     def get_ip_address(self, network_label=None, index=None, seconds=60):
         """Get a server's IP address.
@@ -168,16 +241,12 @@ class ServerFixture(fixtures.Fixture):
         Returns None in both cases if no IP address is found.
         """
         self.wait_for_status("ACTIVE", "ERROR")
-        start = datetime.datetime.utcnow()
-        finish = start + datetime.timedelta(seconds=seconds)
 
         # Poll until there is a network attached.
-        while datetime.datetime.utcnow() < finish:
-            server = self.server.manager.get(self.server.id)
-            if len(server.networks.keys()) > 0:
-                break
-            time.sleep(1)
-        if len(server.networks.keys()) == 0:
+        try:
+            server = get_server_poller().wait(
+                self.server.id, self._has_networks, timeout=seconds)
+        except WaitTimeout:
             return None
 
         # If the user requested a particular network, return its IP(s)
@@ -187,8 +256,9 @@ class ServerFixture(fixtures.Fixture):
                 return ips[index]
             return ips
 
-        # Return the first network's IP(s)
-        ip_item = server.networks.popitem()
+        # Return the first network's IP(s).  The server object may be
+        # shared with other waiters, so don't modify it.
+        ip_item = dict(server.networks).popitem()
         ips = ip_item[1]
         if index is not None:
             return ips[index]
@@ -200,6 +270,9 @@ class ServerFixture(fixtures.Fixture):
 
         Raises an exception if the server moves to one of the statuses
         in failure_statuses.
+
+        The server is polled along with all the other servers being
+        waited for, see testiny.poller.
         """
         # Convenience or death! Allow strings in place of iterables.
         if isinstance(success_statuses, six.string_types):
@@ -207,19 +280,37 @@ class ServerFixture(fixtures.Fixture):
         if isinstance(failure_statuses, six.string_types):
             failure_statuses = (failure_statuses,)
 
-        server = self.server.manager.get(self.server.id)
-
-        start = datetime.datetime.utcnow()
-        finish = start + datetime.timedelta(seconds=timeout)
-        while datetime.datetime.utcnow() < finish:
-            if server.status in success_statuses:
-                return server
+        def has_status(server):
+            if server is None:
+                raise ServerStatusError(
+                    "Server %s has disappeared" % self.name)
             if server.status in failure_statuses:
                 raise Exception("Server failed: %s" % server.status)
-            time.sleep(1)
-            server = server.manager.get(server.id)
-        raise ServerStatusError(
-            "Timed out waiting for server %s" % server.name)
+            return server.status in success_statuses
+
+        try:
+            server, changed = get_server_poller().wait_with_timestamp(
+                self.server.id, has_status, timeout=timeout)
+        except WaitTimeout:
+            raise ServerStatusError(
+                "Timed out waiting for server %s" % self.name)
+        if (server.status == 'ACTIVE' and self.time_to_active is None and
+                self.boot_started is not None):
+            self.time_to_active = changed - self.boot_started
+            self.addDetail(
+                'ServerFixture-boot-time',
+                text_content(
+                    'Server %s ACTIVE %.2fs after boot (booted with %s)' % (
+                        self.name, self.time_to_active,
+                        'port-id' if self.port_id is not None
+                        else 'net-id')))
+        return server
+
+    @staticmethod
+    def _has_networks(server):
+        if server is None:
+            raise ServerStatusError("Server has disappeared")
+        return len(server.networks.keys()) > 0
 
     def get_access_ip(self):
         """Return the IP address used to access this instance."""
@@ -236,13 +327,13 @@ class ServerFixture(fixtures.Fixture):
             raise Exception(
                 "Unknown instance access method: %s")
 
-    def _get_access_ssh_prefix_command(self):
-        """Return the command prefix used to access this instance.
+    def _get_access_netns(self):
+        """Return the network namespace used to access this instance.
 
-        If the access method is 'local_netns', return the prefix to SSH
-        to the instance throught the DHCP network namespace.
+        That is the DHCP namespace of the instance's network, looked up
+        once.
         """
-        if CONF.instance_access == INSTANCE_ACCESS_LOCAL_NETNS:
+        if self._access_netns is None:
             server = self.server.manager.get(self.server.id)
             network_name = server.networks.popitem()[0]
             neutron = get_neutron_client(
@@ -250,63 +341,127 @@ class ServerFixture(fixtures.Fixture):
                 user_name=self.project_fixture.admin_user.name,
                 password=self.project_fixture.admin_user_fixture.password)
             network = neutron.list_networks(name=network_name)['networks'][0]
-            netns = 'qdhcp-%s' % network['id']
-            check_network_namespace(netns)
-            return 'sudo ip netns exec %s' % netns
+            self._access_netns = 'qdhcp-%s' % network['id']
+        get_namespace_watcher().check(self._access_netns)
+        return self._access_netns
+
+    def _get_access_netns_agent(self):
+        """Return the agent used to access this instance, if any.
+
+        There is one with the 'local_netns' access method, unless
+        disabled in the config: see testiny.netns.
+        """
+        if CONF.instance_access != INSTANCE_ACCESS_LOCAL_NETNS:
+            return None
+        return get_netns_agent(self._get_access_netns())
+
+    def _get_access_ssh_prefix_command(self):
+        """Return the command prefix used to access this instance.
+
+        If the access method is 'local_netns' without a namespace agent,
+        return the prefix to SSH to the instance through the DHCP
+        network namespace.
+        """
+        if (CONF.instance_access == INSTANCE_ACCESS_LOCAL_NETNS and
+                self._get_access_netns_agent() is None):
+            return 'sudo ip netns exec %s' % self._get_access_netns()
         else:
             return ''
 
-    def _run_ssh_command(self, command, user_name, key_file_name):
+    def _get_access_ssh_options(self):
+        """Return the ssh options used to access this instance.
+
+        With a namespace agent, ssh connects through it.
+        """
+        agent = self._get_access_netns_agent()
+        if agent is None:
+            return []
+        return ['-o', 'ProxyCommand=%s' % agent.proxy_command()]
+
+    def get_ssh_connection(self, user_name, key_file_name):
+        """Return the persistent SSH connection to this instance.
+
+        Connections are kept open for the lifetime of the fixture.
+        """
+        return self.ssh_connections.get(
+            self.get_access_ip(), user_name, key_file_name,
+            prefix=self._get_access_ssh_prefix_command().split(),
+            options=self._get_access_ssh_options())
+
+    def _run_ssh_command(self, command, user_name, key_file_name,
+                         tty=False):
+        connection = self.get_ssh_connection(user_name, key_file_name)
+        return connection.popen(command, tty=tty)
+
+    def wait_for_ssh(self, timeout=None):
+        """Wait until the server accepts SSH connections.
+
+        The time it took since the server was booted is recorded in
+        `time_to_ssh_ready` and the fixture's details.
+
+        With the 'local_netns' access method, the access IP is probed
+        through the namespace agent; without one, it isn't reachable
+        from here and this does nothing.
+
+        :raise testiny.probe.ProbeTimeout: if SSH isn't reachable in time.
+        """
+        if self.time_to_ssh_ready is not None:
+            return
+        agent = self._get_access_netns_agent()
+        if CONF.instance_access != INSTANCE_ACCESS_FLOATING_IP and (
+                agent is None):
+            return
+        config = CONF.get('ssh_probe') or {}
+        if timeout is None:
+            timeout = config.get('timeout', probe.DEFAULT_TIMEOUT)
         ip = self.get_access_ip()
-        prefix = self._get_access_ssh_prefix_command()
-        ssh_command = prefix.split() + [
-            'ssh',
-            '-o', 'UserKnownHostsFile=/dev/null',
-            '-o', 'StrictHostKeyChecking=no',
-            '-i', key_file_name,
-            "%s@%s" % (user_name, ip),
-            command,
-        ]
-        ssh = subprocess.Popen(
-            ssh_command,
-            shell=False,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE)
-        return ssh
+        if self.boot_started is None:
+            self.boot_started = time.time()
+        options = dict(
+            timeout=timeout,
+            interval=config.get('interval', probe.DEFAULT_INTERVAL),
+            read_banner=config.get('read_banner', probe.DEFAULT_READ_BANNER))
+        if agent is None:
+            probe.wait_for_ssh([ip], **options)
+        else:
+            agent.wait_for_ssh(ip, **options)
+        self.time_to_ssh_ready = time.time() - self.boot_started
+        self.addDetail(
+            'ServerFixture-ssh-ready',
+            text_content(
+                'SSH ready on %s (%s) %.2fs after boot' % (
+                    self.name, ip, self.time_to_ssh_ready)))
 
     @retry(result_checker=should_retry_command, num_attempts=5, delay=5)
-    def run_command(self, command, user_name, key_file_name, timeout=60):
+    def run_command(self, command, user_name, key_file_name, timeout=60,
+                    on_output=None):
         """Use SSH to run the specified command on this server.
 
         :param command: The command and its args as a string.
         :param timeout: In seconds, the time before which this command must
             complete, else a fixtures.server.TimeoutError is raised.
+        :param on_output: If not None, called with ('stdout', line) or
+            ('stderr', line) as the command outputs each line.
         :return: (stdout, stderr, return_code) from the command's process.
             stdout and stderr are a list of lines as returned by readlines().
         """
+        if not self.ssh_probe_failed:
+            try:
+                self.wait_for_ssh()
+            except probe.ProbeTimeout:
+                # Let the command fail with a proper error from ssh.
+                self.ssh_probe_failed = True
         ssh = self._run_ssh_command(command, user_name, key_file_name)
-
-        # Python 3 has a timeout parameter for subprocess, but we want
-        # to remain compatible with Python 2 for now.
-        start = datetime.datetime.utcnow()
-        finish = start + datetime.timedelta(seconds=timeout)
-        while datetime.datetime.utcnow() < finish:
-            ssh.poll()
-            if ssh.returncode is not None:
-                return (
-                    ssh.stdout.readlines(), ssh.stderr.readlines(),
-                    ssh.returncode)
-
-        raise TimeoutError
+        return communicate(ssh, timeout=timeout, on_output=on_output)
 
     def _init_background_ping(self):
         self._background_ping = {}
 
-    def _set_background_ping(self, ip, ssh, user_name, key_file_name):
+    def _set_background_ping(self, ip, ssh, monitor, reader):
         self._background_ping[ip] = {
             'ssh': ssh,
-            'user_name': user_name,
-            'key_file_name': key_file_name,
+            'monitor': monitor,
+            'reader': reader,
         }
 
     def _has_background_ping(self, ip):
@@ -314,10 +469,7 @@ class ServerFixture(fixtures.Fixture):
 
     def _pop_background_ping(self, ip):
         ssh_dict = self._background_ping.pop(ip)
-        return (
-            ssh_dict['ssh'], ssh_dict['user_name'],
-            ssh_dict['key_file_name'],
-        )
+        return ssh_dict['ssh'], ssh_dict['monitor'], ssh_dict['reader']
 
     def start_background_ping(self, ip, user_name, key_file_name):
         """Ping continuously the given IP in the background.
@@ -327,34 +479,48 @@ class ServerFixture(fixtures.Fixture):
         This is meant to test the connectivity between the pinging
         machine and an other machine while some other action is
         being performed.
+        Each reply is recorded as it arrives, see testiny.ping.
         Use `stop_background_ping` to stop the pinging and get back
         the connectivity statistics.
         """
         if self._has_background_ping(ip):
             raise Exception(
                 "Existing background ping process for this ip (%s)" % ip)
-        command = 'ping -W 2 -q %s' % ip
-        ssh = self._run_ssh_command(command, user_name, key_file_name)
-        self._set_background_ping(ip, ssh, user_name, key_file_name)
+        command = 'ping -W 2 %s' % ip
+        # With a tty, the remote ping is hung up when ssh is stopped.
+        ssh = self._run_ssh_command(
+            command, user_name, key_file_name, tty=True)
+        monitor = PingMonitor()
+        reader = threading.Thread(
+            target=communicate, args=(ssh,),
+            kwargs={'on_output': lambda name, line: monitor.feed(line)})
+        reader.daemon = True
+        reader.start()
+        self._set_background_ping(ip, ssh, monitor, reader)
 
     def stop_background_ping(self, ip):
         """Stop the background ping for the given IP.
 
-        Return a tuple: (number of packets sent, percentage of
-        packet loss).
+        Return a testiny.ping.PingReport with the number of packets
+        sent and lost, the RTT percentiles and the outage windows.
+        The report is also added to the fixture's details.
         """
         if not self._has_background_ping(ip):
             raise Exception(
                 "No background ping process for ip (%s)" % ip)
-        command = (
-            "ps -ef | grep ping | grep %s | grep -v grep | "
-            "awk '{print $1}' | xargs kill -2"
-            % ip
-        )
-        ssh, user_name, key_file_name = self._pop_background_ping(ip)
-        self.run_command(command, user_name, key_file_name)
-        out, err = ssh.communicate()
-        return parse_ping_output(out)
+        ssh, monitor, reader = self._pop_background_ping(ip)
+        monitor.stop()
+        if ssh.poll() is None:
+            ssh.terminate()
+        reader.join(10)
+        report = monitor.report()
+        self.addDetail(
+            'ServerFixture-ping-%s' % ip, text_content(repr(report)))
+        return report
+
+    def _stop_background_pings(self):
+        for ip in list(self._background_ping):
+            self.stop_background_ping(ip)
 
 
 class IsolatedServerFixture(ServerFixture):
@@ -373,12 +539,26 @@ class IsolatedServerFixture(ServerFixture):
     This allows for one-liner server instances in tests, for
     convenience.
 
+    If the tenant pool is enabled in the config and none of the
+    project, user and network fixtures are given, all of the above but
+    the floating IP are leased from the pool instead.
+
+    With precreate_port=True, the server's port is created along with
+    the other dependent fixtures, and the floating IP is bound to it
+    before the server is booted.  Otherwise the floating IP is created
+    while the server boots.  With
+    wait_until_ssh_ready=True, set up also waits until the server
+    accepts SSH connections.  The time taken by each stage of the boot
+    is added to the fixture's details.
+
     Additional args are passed to nova.servers.create()
     """
     def __init__(self, **kwargs):
         project_fixture = kwargs.pop('project_fixture', None)
         user_fixture = kwargs.pop('user_fixture', None)
         network_fixture = kwargs.pop('network_fixture', None)
+        self.wait_until_ssh_ready = kwargs.pop('wait_until_ssh_ready', False)
+        self.floatingip_fixture = None
         super(IsolatedServerFixture, self).__init__(
             project_fixture=project_fixture,
             user_fixture=user_fixture,
@@ -389,121 +569,492 @@ class IsolatedServerFixture(ServerFixture):
         super(IsolatedServerFixture, self)._setUp()
 
     def setup_prerequisites(self):
-        if self.project_fixture is None:
-            self.project_fixture = self.useFixture(ProjectFixture())
-        if self.user_fixture is None:
-            self.user_fixture = self.useFixture(UserFixture())
-        self.project_fixture.add_user_to_role(self.user_fixture, 'Member')
-        if self.network_fixture is None:
-            self.network_fixture = self.useFixture(
-                NeutronNetworkFixture(project_fixture=self.project_fixture))
-        # Allow pings.
-        self.useFixture(SecurityGroupRuleFixture(
-            self.project_fixture, 'default', 'egress', 'icmp'))
-        # Allow ssh.
-        self.useFixture(SecurityGroupRuleFixture(
-            self.project_fixture, 'default', 'ingress', 'tcp',
-            port_range_min=22, port_range_max=22))
-        self.keypair_fixture = self.useFixture(
-            KeypairFixture(self.project_fixture, self.user_fixture))
-        # Attach a router with the public network as gateway to allow
-        # inbound connections to the server.
-        self.router_fixture = self.useFixture(
-            RouterFixture(self.project_fixture))
-        self.router_fixture.add_interface_router(
-            self.network_fixture.subnet["subnet"]["id"])
-        external_network_name = CONF.network['external_network']
-        external_network = self.network_fixture.get_network(
-            external_network_name)
-        self.router_fixture.add_gateway_router(external_network['id'])
+        """Set up all the dependent fixtures.
 
+        They are set up in parallel where their dependencies allow it.
+        The critical path, i.e. the chain of steps which bounded the
+        total setup time, is added to the fixture's details.
+        """
+        pool = get_tenant_pool()
+        if pool is not None and self.project_fixture is None and (
+                self.user_fixture is None and self.network_fixture is None):
+            self.setup_leased_prerequisites(pool)
+            return
+        graph = FixtureGraph()
+        results = graph.results
+        add_tenant_tasks(
+            graph, project_fixture=self.project_fixture,
+            user_fixture=self.user_fixture,
+            network_fixture=self.network_fixture)
+        prerequisites = ['role-grant', 'network']
+        if self.port_id is None and self.precreate_port:
+            # Create the port here rather than in ServerFixture, so it
+            # overlaps with the rest and is cleaned up before the
+            # network.
+            def make_port_fixture():
+                self.port_fixture = PortsFixture(
+                    results['project'],
+                    results['network'].network["network"]["id"])
+                return self.port_fixture
+
+            graph.add_fixture(
+                'port', make_port_fixture, depends_on=['network'])
+            prerequisites.append('port')
+        graph.add(
+            'server-prerequisites',
+            lambda: self._setup_server_prerequisites(results),
+            depends_on=prerequisites)
+        try:
+            graph.set_up(self)
+        finally:
+            self.addDetail(
+                'IsolatedServerFixture-critical-path',
+                text_content(graph.format_critical_path()))
+        self.keypair_fixture = results['keypair']
+        self.router_fixture = results['router']
+
+    def setup_leased_prerequisites(self, pool):
+        """Lease the dependent fixtures from the tenant pool."""
+        tenant = self.useFixture(LeasedTenantFixture(pool))
+        self.keypair_fixture = tenant.keypair_fixture
+        self.router_fixture = tenant.router_fixture
+        self._setup_server_prerequisites({
+            'project': tenant.project_fixture,
+            'user': tenant.user_fixture,
+            'network': tenant.network_fixture,
+        })
+
+    def _setup_server_prerequisites(self, results):
+        if self.port_fixture is not None:
+            self.port_id = self.port_fixture.ports[0]["id"]
+        self.project_fixture = results['project']
+        self.user_fixture = results['user']
+        self.network_fixture = results['network']
         super(IsolatedServerFixture, self).setup_prerequisites()
 
     def create_server(self):
         # Override base class method so we can inject the keypair and
         # add a floating IP.
+        # The boot is a pipeline of stages run as soon as what they
+        # depend on is done, so that the floating IP is created while
+        # the server boots.
+        external_network_name = CONF.network['external_network']
+        graph = FixtureGraph()
+        results = graph.results
+
+        def make_floatingip_fixture():
+            # If the port is known, bind the floating IP to it up front.
+            self.floatingip_fixture = FloatingIPFixture(
+                self.project_fixture, self.user_fixture,
+                external_network_name, port_id=self.port_id)
+            return self.floatingip_fixture
+
+        graph.add('boot', self._boot)
+        graph.add_fixture('floating-ip', make_floatingip_fixture)
+        if self.port_id is not None:
+            last_stage = 'floating-ip'
+        else:
+            # You have to wait for the internal IP to come up before
+            # associating the floating IP (Otherwise you get the error
+            # 'No nw_info cache associated with instance' from Nova).
+            graph.add(
+                'network-info', self.get_ip_address, depends_on=['boot'])
+            graph.add(
+                'associate',
+                lambda: self.server.add_floating_ip(
+                    results['floating-ip'].ip),
+                depends_on=['floating-ip', 'network-info'])
+            last_stage = 'associate'
+        if self.wait_until_ssh_ready:
+            graph.add(
+                'ssh-ready', self.wait_for_ssh,
+                depends_on=['boot', last_stage])
+        try:
+            graph.set_up(self)
+        finally:
+            self.addDetail(
+                'IsolatedServerFixture-boot-stages',
+                text_content('%s\nCritical path: %s' % (
+                    graph.format_timings(), graph.format_critical_path())))
+
+    def get_access_ip(self):
+        if (CONF.instance_access == INSTANCE_ACCESS_FLOATING_IP and
+                self.floatingip_fixture is not None):
+            # Nova may not know yet about a floating IP bound to the
+            # port.
+            return self.floatingip_fixture.ip
+        return super(IsolatedServerFixture, self).get_access_ip()
+
+    def _boot(self):
         self.server = self.nova.servers.create(
             self.name, self.image, self.flavor, nics=self.nics,
             key_name=self.keypair_fixture.name, **self.instance_kwargs)
 
-        # Create a floating IP and associate it with the instance. You
-        # have to wait for the internal IP to come up before this will
-        # work (Otherwise you get the error 'No nw_info cache associated
-        # with instance' from Nova).
-        self.get_ip_address()
-        external_network_name = CONF.network['external_network']
-        self.floatingip_fixture = self.useFixture(
-            FloatingIPFixture(
-                self.project_fixture, self.user_fixture,
-                external_network_name))
-        self.server.add_floating_ip(self.floatingip_fixture.ip)
 
+class FloatingIPFixture(fixtures.Fixture):
+    """Test fixture that creates a floating IP.
+
+    If port_id is given, the floating IP is bound to that port when
+    created, so it is ready as soon as a server is booted on the port.
 
-class KeypairFixture(fixtures.Fixture):
-    """Test fixture that creates a random keypair."""
+    If the floating IP pool is enabled in the config, the floating IP is
+    leased from the project's pool and returned to it on cleanup, see
+    testiny.floatingips.
 
-    def __init__(self, project_fixture, user_fixture):
-        super(KeypairFixture, self).__init__()
-        self.user_fixture = user_fixture
+    The IP is available as the 'ip' property after creation.
+    """
+    def __init__(self, project_fixture, user_fixture, network_name,
+                 port_id=None):
+        super(FloatingIPFixture, self).__init__()
         self.project_fixture = project_fixture
+        self.user_fixture = user_fixture
+        self.network_name = network_name
+        self.port_id = port_id
+        self.pool = None
 
     def _setUp(self):
-        super(KeypairFixture, self)._setUp()
-        self.nova = get_nova_v3_client(
+        super(FloatingIPFixture, self)._setUp()
+        self.pool = get_floating_ip_pool(
+            self.project_fixture, self.network_name)
+        if self.pool is not None:
+            self._lease_from_pool()
+        elif self.port_id is not None:
+            self._create_on_port()
+        else:
+            self.nova = get_nova_v3_client(
+                user_name=self.user_fixture.name,
+                project_name=self.project_fixture.name,
+                password=self.user_fixture.password)
+            self.floatingip = self.nova.floating_ips.create(self.network_name)
+            self.ip = self.floatingip.ip
+        add_teardown(self, TEARDOWN_SERVER, self.delete_floatingip)
+        self.addDetail(
+            'FloatingIPFixture',
+            text_content('Floating IP %s created' % self.ip))
+
+    def _lease_from_pool(self):
+        started = time.time()
+        self.floatingip = self.pool.lease()
+        self.ip = self.floatingip['floating_ip_address']
+        self.addDetail(
+            'FloatingIPFixture-pool-wait',
+            text_content('Waited %.2fs for floating IP %s' % (
+                time.time() - started, self.ip)))
+        if self.port_id is not None:
+            self.pool.associate(self.floatingip, self.port_id)
+
+    def _create_on_port(self):
+        # Nova's floating IP API can't bind to a port, use neutron's.
+        self.neutron = get_neutron_client(
             user_name=self.user_fixture.name,
             project_name=self.project_fixture.name,
             password=self.user_fixture.password)
-        self.name = factory.make_obj_name('keypair')
-        self.keypair = self.nova.keypairs.create(name=self.name)
-        self.addCleanup(self.delete_keypair)
+        network = find_network(self.neutron, self.network_name)
+        self.floatingip = self.neutron.create_floatingip({'floatingip': {
+            'floating_network_id': network['id'],
+            'port_id': self.port_id,
+        }})['floatingip']
+        self.ip = self.floatingip['floating_ip_address']
 
-        self.addDetail(
-            'KeypairFixture',
-            text_content('Keypair named %s created' % self.name))
+    def delete_floatingip(self):
+        if self.pool is not None:
+            self.pool.release(self.floatingip)
+        elif self.port_id is not None:
+            self.neutron.delete_floatingip(self.floatingip['id'])
+        else:
+            self.floatingip.delete()
 
-        tempdir = self.useFixture(fixtures.TempDir()).path
-        self.private_key_file = os.path.join(tempdir, 'test.rsa')
-        with open(self.private_key_file, 'wt') as f:
-            f.write(self.keypair.private_key)
-        # SSH is picky about permissions:
-        os.chmod(self.private_key_file, 0600)
 
-        self.addDetail(
-            'KeypairFixture-private-key-file',
-            text_content(
-                'Private key file %s created' % self.private_key_file))
+class ServerGroupMemberFixture(ServerFixture):
+    """One of the servers booted by a `ServerGroupFixture`.
 
-    def get(self):
-        """Return the private part of the key pair."""
-        return self.nova.keypairs.get(self.keypair.id)
+    Offers the same API as ServerFixture for that server, which is
+    deleted with the rest of the group.
+    """
+    def __init__(self, group_fixture, server):
+        super(ServerGroupMemberFixture, self).__init__(
+            project_fixture=group_fixture.project_fixture,
+            user_fixture=group_fixture.user_fixture,
+            network_fixture=group_fixture.network_fixture)
+        self.group_fixture = group_fixture
+        self.server = server
+        self.keypair_fixture = group_fixture.keypair_fixture
+        self.floatingip_fixture = None
 
-    def delete_keypair(self):
-        self.keypair.delete()
+    def setup_prerequisites(self):
+        self.nova = self.group_fixture.nova
+        self.name = self.server.name
 
+    def create_server(self):
+        # Already booted by the group.
+        self.boot_started = self.group_fixture.boot_started
 
-class FloatingIPFixture(fixtures.Fixture):
-    """Test fixture that creates a floating IP.
+    def delete_server(self):
+        # Deleted by the group.
+        pass
 
-    The IP is available as the 'ip' property after creation.
+
+class ServerGroupFixture(IsolatedServerFixture):
+    """Extension of IsolatedServerFixture that boots many servers at once.
+
+    The `count` servers are booted with a single request, using nova's
+    min_count and max_count, and their floating IPs created and
+    associated concurrently.  They are deleted concurrently too, and
+    wait_for_deletion is as for `ServerFixture`.
+
+    The servers are available as the 'members' property after creation:
+    a list of `ServerGroupMemberFixture`, one per server, sorted by
+    name.  Use them to run commands or get IPs; the group's own
+    methods apply to all the servers.
     """
-    def __init__(self, project_fixture, user_fixture, network_name):
-        super(FloatingIPFixture, self).__init__()
-        self.project_fixture = project_fixture
-        self.user_fixture = user_fixture
-        self.network_name = network_name
+    def __init__(self, count, **kwargs):
+        if kwargs.get('port_id') or kwargs.get('precreate_port'):
+            raise ValueError("Servers can't be booted in bulk on one port")
+        super(ServerGroupFixture, self).__init__(**kwargs)
+        self.count = count
+        self.members = []
 
-    def _setUp(self):
-        super(FloatingIPFixture, self)._setUp()
-        self.nova = get_nova_v3_client(
-            user_name=self.user_fixture.name,
-            project_name=self.project_fixture.name,
-            password=self.user_fixture.password)
-        self.floatingip = self.nova.floating_ips.create(self.network_name)
-        self.addCleanup(self.delete_floatingip)
-        self.ip = self.floatingip.ip
+    def create_server(self):
+        reservation_id = self.nova.servers.create(
+            self.name, self.image, self.flavor, nics=self.nics,
+            key_name=self.keypair_fixture.name, min_count=self.count,
+            max_count=self.count, reservation_id=True,
+            **self.instance_kwargs)
+        servers = self.nova.servers.list(
+            search_opts={'reservation_id': reservation_id})
+        for server in sorted(servers, key=lambda server: server.name):
+            self.members.append(
+                self.useFixture(ServerGroupMemberFixture(self, server)))
+        if len(self.members) != self.count:
+            raise ServerStatusError(
+                "Booted %d servers instead of %d" % (
+                    len(self.members), self.count))
+        if CONF.instance_access == INSTANCE_ACCESS_FLOATING_IP:
+            self._add_floating_ips()
+
+    def _add_floating_ips(self):
+        external_network_name = CONF.network['external_network']
+        graph = FixtureGraph()
+        results = graph.results
+        for index, member in enumerate(self.members):
+            graph.add_fixture(
+                'floating-ip-%d' % index,
+                lambda: FloatingIPFixture(
+                    self.project_fixture, self.user_fixture,
+                    external_network_name))
+            # The instance must have its internal IP before a floating
+            # IP can be associated.
+            graph.add(
+                'internal-ip-%d' % index, member.get_ip_address)
+            graph.add(
+                'associate-%d' % index,
+                lambda member=member, index=index: (
+                    member.server.add_floating_ip(
+                        results['floating-ip-%d' % index].ip)),
+                depends_on=[
+                    'floating-ip-%d' % index, 'internal-ip-%d' % index])
+        graph.set_up(self)
+        for index, member in enumerate(self.members):
+            member.floatingip_fixture = results['floating-ip-%d' % index]
+
+    def _for_each_member(self, func):
+        """Call `func(member)` for all the members at once.
+
+        Returns the list of results, in the order of the members; the
+        first exception raised, if any, is re-raised once all the calls
+        are done.
+        """
+        if not self.members:
+            return []
+        executor = futures.ThreadPoolExecutor(max_workers=len(self.members))
+        try:
+            running = [
+                executor.submit(func, member) for member in self.members]
+            futures.wait(running)
+            return [future.result() for future in running]
+        finally:
+            executor.shutdown(wait=True)
+
+    def wait_for_status(self, success_statuses, failure_statuses,
+                        timeout=60):
+        """Wait until all the servers have one of `success_statuses`.
+
+        See `ServerFixture.wait_for_status`.
+        """
+        return self._for_each_member(
+            lambda member: member.wait_for_status(
+                success_statuses, failure_statuses, timeout=timeout))
+
+    def get_ip_addresses(self, network_label=None, index=None, seconds=60):
+        """Return the IP addresses of all the servers.
+
+        See `ServerFixture.get_ip_address`.
+        """
+        return self._for_each_member(
+            lambda member: member.get_ip_address(
+                network_label=network_label, index=index, seconds=seconds))
+
+    def wait_for_ssh(self, timeout=None):
+        """Wait until all the servers accept SSH connections.
+
+        All the servers are probed at once; each member's
+        `time_to_ssh_ready` is set as they become ready.
+
+        :raise testiny.probe.ProbeTimeout: if some servers aren't
+            reachable in time.
+        """
+        if CONF.instance_access != INSTANCE_ACCESS_FLOATING_IP:
+            # Each server is probed through its namespace agent.
+            self._for_each_member(
+                lambda member: member.wait_for_ssh(timeout=timeout))
+            return
+        config = CONF.get('ssh_probe') or {}
+        if timeout is None:
+            timeout = config.get('timeout', probe.DEFAULT_TIMEOUT)
+        waiting = dict(
+            (member.get_access_ip(), member) for member in self.members
+            if member.time_to_ssh_ready is None)
+        probe_started = time.time()
+        ready = {}
+        try:
+            ready = probe.wait_for_ssh(
+                list(waiting), timeout=timeout,
+                interval=config.get('interval', probe.DEFAULT_INTERVAL),
+                read_banner=config.get(
+                    'read_banner', probe.DEFAULT_READ_BANNER))
+        except probe.ProbeTimeout as e:
+            ready = e.ready
+            raise
+        finally:
+            for ip, seconds in ready.items():
+                member = waiting[ip]
+                member.time_to_ssh_ready = (
+                    probe_started + seconds - member.boot_started)
         self.addDetail(
-            'FloatingIPFixture',
-            text_content('Floating IP %s created' % self.ip))
+            'ServerGroupFixture-ssh-ready',
+            text_content('SSH ready on %d servers %.2fs after boot' % (
+                len(self.members), max(
+                    member.time_to_ssh_ready for member in self.members))))
 
-    def delete_floatingip(self):
-        self.floatingip.delete()
+    def delete_server(self):
+        tracker = get_deletion_tracker()
+
+        def delete(member):
+            started = time.time()
+            try:
+                member.server.delete()
+            except novaclient.exceptions.NotFound:
+                return None
+            member.deletion = tracker.track(member.server, started)
+            return member.deletion
+
+        deletions = [
+            deletion for deletion in self._for_each_member(delete)
+            if deletion is not None]
+        if self.wait_for_deletion:
+            elapsed = [deletion.elapsed for deletion in wait_all(deletions)]
+            self.addDetail(
+                'ServerGroupFixture',
+                text_content(
+                    '%d server instances named %s deleted in %.2fs' % (
+                        len(self.members), self.name,
+                        max(elapsed) if elapsed else 0)))
+
+
+# Result of a command run by `run_commands`.
+CommandResult = namedtuple(
+    'CommandResult', ['stdout', 'stderr', 'returncode', 'elapsed'])
+
+
+def run_commands(commands, user_name=None, key_file_name=None, timeout=60,
+                 max_workers=None):
+    """Run commands on many servers at once.
+
+    :param commands: List of (server_fixture, command) tuples.  The same
+        server can appear several times.
+    :param user_name: User to log in as, defaults to the fast image's user.
+    :param key_file_name: Private key file, defaults to the one of each
+        server's `keypair_fixture`.
+    :param timeout: Timeout, in seconds, of each command.
+    :param max_workers: Maximum number of commands running at once,
+        defaults to 'max_workers' in the 'concurrency' config section.
+    :return: A list of `CommandResult`, in the order of `commands`.  If
+        running a command failed, e.g. timed out, its returncode is None
+        and its stderr holds the error.
+    """
+    if user_name is None:
+        user_name = CONF.fast_image['user_name']
+    if max_workers is None:
+        max_workers = (CONF.get('concurrency') or {}).get(
+            'max_workers', DEFAULT_MAX_WORKERS)
+
+    def run(server_fixture, command):
+        key = key_file_name
+        if key is None:
+            key = server_fixture.keypair_fixture.private_key_file
+        start = time.time()
+        try:
+            out, err, returncode = server_fixture.run_command(
+                command, user_name=user_name, key_file_name=key,
+                timeout=timeout)
+        except Exception as e:
+            out, err, returncode = [], ['%r' % (e,)], None
+        return CommandResult(out, err, returncode, time.time() - start)
+
+    if not commands:
+        return []
+    executor = futures.ThreadPoolExecutor(
+        max_workers=min(max_workers, len(commands)))
+    try:
+        running = [
+            executor.submit(run, server_fixture, command)
+            for server_fixture, command in commands]
+        return [future.result() for future in running]
+    finally:
+        executor.shutdown(wait=True)
+
+
+def run_command_on_servers(server_fixtures, command, **kwargs):
+    """Run a command on each of the given servers at once.
+
+    :param command: The command to run on every server, or a callable
+        returning the command to run given a server fixture.
+    :param kwargs: Passed to `run_commands`.
+    :return: A list of `CommandResult`, in the order of `server_fixtures`.
+    """
+    if not callable(command):
+        command = (lambda server_fixture, command=command: command)
+    return run_commands(
+        [(server_fixture, command(server_fixture))
+         for server_fixture in server_fixtures],
+        **kwargs)
+
+
+def ping_matrix(server_fixtures, network_label=None, count=1, deadline=60,
+                **kwargs):
+    """Ping every server from every other server, all at once.
+
+    :param network_label: Name of the network whose IPs are pinged,
+        defaults to each server's first network.
+    :param count: Number of ping responses to wait for.
+    :param deadline: Seconds after which ping gives up.
+    :param kwargs: Passed to `run_commands`.
+    :return: A dict mapping (source fixture, destination fixture) to
+        the `CommandResult` of the ping.
+    """
+    ips = [
+        server_fixture.get_ip_address(network_label, 0)
+        for server_fixture in server_fixtures]
+    pairs = [
+        (source, destination, ip)
+        for source in server_fixtures
+        for destination, ip in zip(server_fixtures, ips)
+        if destination is not source]
+    kwargs.setdefault('timeout', deadline + 10)
+    results = run_commands(
+        [(source, 'ping -c %d -w %d -q %s' % (count, deadline, ip))
+         for source, _, ip in pairs],
+        **kwargs)
+    return dict(
+        ((source, destination), result)
+        for (source, destination, _), result in zip(pairs, results))
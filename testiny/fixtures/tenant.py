@@ -0,0 +1,633 @@
+# Copyright (C) 2015 Cisco, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Fixtures for complete tenants, and a warm pool of them.
+
+A tenant is the bundle of objects an isolated server needs: a project,
+a member user, a network, a router connected to the external network,
+security group rules allowing ping and ssh, and a keypair.
+
+Creating a tenant takes some twenty API calls, so when enabled in the
+config a pool of ready-made tenants is kept.  Tests lease a tenant from
+the pool; when the test is done the tenant is scrubbed (servers,
+floating IPs, extra security group rules and keypairs deleted) and, if
+it is back to exactly the state it was created in, returned to the
+pool.  Tenants that can't be scrubbed clean, or that are too old or
+have been used too many times, are deleted and replaced in the
+background.
+"""
+
+from __future__ import (
+    absolute_import,
+    print_function,
+    unicode_literals,
+    )
+
+str = None
+
+__metaclass__ = type
+__all__ = [
+    "add_tenant_tasks",
+    "get_tenant_pool",
+    "KeypairFixture",
+    "LeasedTenantFixture",
+    "TenantFixture",
+    "TenantPool",
+    ]
+
+import atexit
+from concurrent import futures
+import threading
+import time
+
+import fixtures
+import neutronclient.common.exceptions
+import novaclient
+from testiny.cache import call_with_network
+from testiny.clients import (
+    get_keystone_v3_client,
+    get_neutron_client,
+    get_nova_v3_client,
+)
+from testiny.config import CONF
+from testiny.factory import factory
+from testiny.fixtures.neutron import (
+    NeutronNetworkFixture,
+    RouterFixture,
+    SecurityGroupRulesFixture,
+)
+from testiny.fixtures.project import ProjectFixture
+from testiny.fixtures.user import UserFixture
+from testiny.floatingips import peek_floating_ip_pool
+from testiny.keys import get_key_generator
+from testiny.poller import get_server_poller
+from testiny.taskgraph import FixtureGraph
+from testiny.teardown import (
+    add_teardown,
+    get_teardown_engine,
+    TEARDOWN_SERVER,
+)
+from testtools.content import text_content
+
+# Defaults for the 'tenant_pool' section of the config.
+DEFAULT_ENABLED = False
+DEFAULT_SIZE = 4
+DEFAULT_MAX_AGE = 3600
+DEFAULT_MAX_REUSE = 20
+DEFAULT_SCRUB_TIMEOUT = 120
+
+# Default for the 'keypair' section of the config.
+DEFAULT_SHARE_PER_USER = False
+
+# The attributes of the tenant's routers, networks and subnets which
+# tests rely on.  A pooled tenant in which a test changed them isn't
+# reused.
+ROUTER_SETTINGS = ('admin_state_up', 'external_gateway_info', 'routes')
+NETWORK_SETTINGS = (
+    'admin_state_up', 'mtu', 'port_security_enabled', 'shared')
+SUBNET_SETTINGS = (
+    'allocation_pools', 'cidr', 'dns_nameservers', 'enable_dhcp',
+    'gateway_ip', 'host_routes', 'ip_version')
+
+
+class KeypairFixture(fixtures.Fixture):
+    """Test fixture that creates a random keypair.
+
+    The key is generated locally and only its public part imported into
+    nova, see testiny.keys.  Its private key file is available as the
+    'private_key_file' property.
+
+    :param shared: Use a single keypair for all the fixtures of the same
+        user, deleted along with the user.  Defaults to the
+        'share_per_user' setting of the 'keypair' config section.
+    """
+
+    def __init__(self, project_fixture, user_fixture, shared=None):
+        super(KeypairFixture, self).__init__()
+        self.user_fixture = user_fixture
+        self.project_fixture = project_fixture
+        if shared is None:
+            config = CONF.get('keypair') or {}
+            shared = config.get('share_per_user', DEFAULT_SHARE_PER_USER)
+        self.shared = shared
+
+    def _setUp(self):
+        super(KeypairFixture, self)._setUp()
+        self.nova = get_nova_v3_client(
+            user_name=self.user_fixture.name,
+            project_name=self.project_fixture.name,
+            password=self.user_fixture.password)
+        if self.shared:
+            self.keypair, self.private_key_file = self._get_shared_keypair()
+            self.name = self.keypair.name
+        else:
+            self.keypair, self.private_key_file = self._import_keypair()
+            self.name = self.keypair.name
+            add_teardown(self, TEARDOWN_SERVER, self.delete_keypair)
+
+        self.addDetail(
+            'KeypairFixture',
+            text_content('Keypair named %s created' % self.name))
+        self.addDetail(
+            'KeypairFixture-private-key-file',
+            text_content(
+                'Private key file %s created' % self.private_key_file))
+
+    def _import_keypair(self):
+        key = get_key_generator().get()
+        keypair = self.nova.keypairs.create(
+            name=factory.make_obj_name('keypair'),
+            public_key=key.public_key)
+        return keypair, key.private_key_file
+
+    def _get_shared_keypair(self):
+        user_id = self.user_fixture.user.id
+        with _shared_keypairs_lock:
+            if user_id not in _shared_keypairs:
+                keypair, private_key_file = self._import_keypair()
+                _shared_keypairs[user_id] = (keypair, private_key_file)
+                # The keypair outlives this fixture, and goes with the
+                # user.
+                add_teardown(
+                    self.user_fixture, TEARDOWN_SERVER,
+                    _delete_shared_keypair, user_id)
+            return _shared_keypairs[user_id]
+
+    def get(self):
+        """Return the keypair from nova."""
+        return self.nova.keypairs.get(self.keypair.id)
+
+    def delete_keypair(self):
+        self.keypair.delete()
+
+
+# Maps the ids of users to their shared (keypair, private key file).
+_shared_keypairs = {}
+_shared_keypairs_lock = threading.Lock()
+
+
+def _delete_shared_keypair(user_id):
+    with _shared_keypairs_lock:
+        keypair, _ = _shared_keypairs.pop(user_id)
+    keypair.delete()
+
+
+def add_tenant_tasks(graph, project_fixture=None, user_fixture=None,
+                     network_fixture=None):
+    """Add the tasks setting up a tenant to a `FixtureGraph`.
+
+    The given fixtures are used as they are, the missing ones are
+    created.  Once the graph has run, its results hold the 'project',
+    'user', 'network', 'router' and 'keypair' fixtures.
+    """
+    results = graph.results
+    if project_fixture is None:
+        graph.add_fixture('project', ProjectFixture)
+    else:
+        graph.add('project', lambda: project_fixture)
+    if user_fixture is None:
+        graph.add_fixture('user', UserFixture)
+    else:
+        graph.add('user', lambda: user_fixture)
+    graph.add(
+        'role-grant',
+        lambda: results['project'].add_user_to_role(
+            results['user'], 'Member'),
+        depends_on=['project', 'user'])
+    if network_fixture is None:
+        graph.add_fixture(
+            'network',
+            lambda: NeutronNetworkFixture(
+                project_fixture=results['project']),
+            depends_on=['project'])
+    else:
+        graph.add('network', lambda: network_fixture)
+    # Allow pings and ssh.
+    graph.add_fixture(
+        'security-group-rules',
+        lambda: SecurityGroupRulesFixture(
+            results['project'], 'default', [
+                {'direction': 'egress', 'protocol': 'icmp'},
+                {'direction': 'ingress', 'protocol': 'tcp',
+                 'port_range_min': 22, 'port_range_max': 22},
+            ]),
+        depends_on=['project'])
+    # The keypair is created as the user, which needs its role first.
+    graph.add_fixture(
+        'keypair',
+        lambda: KeypairFixture(results['project'], results['user']),
+        depends_on=['role-grant'])
+    # Attach a router with the public network as gateway to allow
+    # inbound connections to the servers.
+    graph.add_fixture(
+        'router', lambda: RouterFixture(results['project']),
+        depends_on=['project'])
+    graph.add(
+        'router-interface',
+        lambda: results['router'].add_interface_router(
+            results['network'].subnet["subnet"]["id"]),
+        depends_on=['router', 'network'])
+    # The external network comes from the lookup cache; if it's stale
+    # the gateway can't be set and it's looked up again.
+    graph.add(
+        'router-gateway',
+        lambda: call_with_network(
+            results['network'].neutron, CONF.network['external_network'],
+            lambda network: results['router'].add_gateway_router(
+                network['id'])),
+        depends_on=['router', 'network'])
+
+
+class TenantFixture(fixtures.Fixture):
+    """Test fixture that creates a complete tenant.
+
+    The project, user, network, router and keypair fixtures are
+    available as the 'project_fixture', 'user_fixture',
+    'network_fixture', 'router_fixture' and 'keypair_fixture'
+    properties after creation.
+    """
+
+    def _setUp(self):
+        super(TenantFixture, self)._setUp()
+        graph = FixtureGraph()
+        add_tenant_tasks(graph)
+        try:
+            graph.set_up(self)
+        finally:
+            self.addDetail(
+                'TenantFixture-critical-path',
+                text_content(graph.format_critical_path()))
+        self.project_fixture = graph.results['project']
+        self.user_fixture = graph.results['user']
+        self.network_fixture = graph.results['network']
+        self.router_fixture = graph.results['router']
+        self.keypair_fixture = graph.results['keypair']
+        # Time of creation and number of leases, for the pool.
+        self.created = time.time()
+        self.uses = 0
+        self.baseline = self.snapshot()
+
+    @property
+    def project_id(self):
+        return self.project_fixture.project.id
+
+    def _get_clients(self):
+        keystone = get_keystone_v3_client(project_name=CONF.admin_project)
+        nova = get_nova_v3_client(project_name=CONF.admin_project)
+        neutron = get_neutron_client(project_name=CONF.admin_project)
+        # Keypairs are per user, only visible to the user.
+        user_nova = get_nova_v3_client(
+            user_name=self.user_fixture.name,
+            project_name=self.project_fixture.name,
+            password=self.user_fixture.password)
+        return keystone, nova, neutron, user_nova
+
+    def _pooled_floatingip_ids(self):
+        # The floating IPs of the project's pool are kept across leases
+        # of the tenant.  Call this after listing the floating IPs, so
+        # that those being allocated then are included.
+        pool = peek_floating_ip_pool(
+            self.project_id, CONF.network['external_network'])
+        return set() if pool is None else pool.owned_ids()
+
+    def _list_servers(self, nova):
+        return nova.servers.list(search_opts={
+            'all_tenants': True, 'tenant_id': self.project_id})
+
+    def snapshot(self):
+        """Return the ids of all the objects in the tenant, by type.
+
+        Routers, networks and subnets come with the attributes in
+        ROUTER_SETTINGS, NETWORK_SETTINGS and SUBNET_SETTINGS, and the
+        role assignments on the project as (actor id, role id) pairs.
+        """
+        keystone, nova, neutron, user_nova = self._get_clients()
+        project_id = self.project_id
+
+        def ids(resources, exclude=()):
+            return sorted(
+                resource['id'] for resource in resources
+                if resource['id'] not in exclude)
+
+        def settings(resources, keys):
+            return [
+                (resource['id'],
+                 dict((key, resource.get(key)) for key in keys))
+                for resource in sorted(
+                    resources, key=lambda resource: resource['id'])]
+
+        def actor_id(assignment):
+            # Roles are granted to users or groups.
+            actor = getattr(assignment, 'user', None)
+            if actor is None:
+                actor = assignment.group
+            return actor['id']
+
+        return {
+            'role_assignments': sorted(
+                (actor_id(assignment), assignment.role['id'])
+                for assignment in keystone.role_assignments.list(
+                    project=project_id)),
+            'servers': sorted(
+                server.id for server in self._list_servers(nova)),
+            'keypairs': sorted(
+                keypair.name for keypair in user_nova.keypairs.list()),
+            'floatingips': ids(
+                neutron.list_floatingips(tenant_id=project_id)['floatingips'],
+                exclude=self._pooled_floatingip_ids()),
+            'networks': settings(neutron.list_networks(
+                tenant_id=project_id)['networks'], NETWORK_SETTINGS),
+            'subnets': settings(neutron.list_subnets(
+                tenant_id=project_id)['subnets'], SUBNET_SETTINGS),
+            'ports': ids(neutron.list_ports(
+                tenant_id=project_id)['ports']),
+            'routers': settings(neutron.list_routers(
+                tenant_id=project_id)['routers'], ROUTER_SETTINGS),
+            'security_groups': ids(neutron.list_security_groups(
+                tenant_id=project_id)['security_groups']),
+            'security_group_rules': ids(neutron.list_security_group_rules(
+                tenant_id=project_id)['security_group_rules']),
+        }
+
+    def scrub(self, timeout=DEFAULT_SCRUB_TIMEOUT):
+        """Delete what a test left in the tenant.
+
+        Servers and floating IPs, but those of the project's floating
+        IP pool, are deleted, as well as the keypairs, security groups
+        and rules which weren't there when the tenant was created.
+
+        Returns True if the tenant is then back to the state it was
+        created in, i.e. it can be reused without leaking anything
+        from one test to the next.  Changes to the routers, networks,
+        subnets or role assignments aren't undone: the tenant then
+        can't be reused.
+        """
+        keystone, nova, neutron, user_nova = self._get_clients()
+        project_id = self.project_id
+        servers = self._list_servers(nova)
+        for server in servers:
+            try:
+                server.delete()
+            except novaclient.exceptions.NotFound:
+                pass
+        floatingips = neutron.list_floatingips(
+            tenant_id=project_id)['floatingips']
+        pooled = self._pooled_floatingip_ids()
+        for floatingip in floatingips:
+            if floatingip['id'] in pooled:
+                continue
+            try:
+                neutron.delete_floatingip(floatingip['id'])
+            except neutronclient.common.exceptions.NotFound:
+                pass
+        for keypair in user_nova.keypairs.list():
+            if keypair.name not in self.baseline['keypairs']:
+                keypair.delete()
+        for rule in neutron.list_security_group_rules(
+                tenant_id=project_id)['security_group_rules']:
+            if rule['id'] not in self.baseline['security_group_rules']:
+                neutron.delete_security_group_rule(rule['id'])
+        poller = get_server_poller()
+        deadline = time.time() + timeout
+        for server in servers:
+            poller.wait(
+                server.id,
+                lambda found: found is None or found.status == 'DELETED',
+                timeout=max(0, deadline - time.time()))
+        # Groups can only go once no port uses them.
+        for group in neutron.list_security_groups(
+                tenant_id=project_id)['security_groups']:
+            if group['id'] not in self.baseline['security_groups']:
+                neutron.delete_security_group(group['id'])
+        return self.snapshot() == self.baseline
+
+
+class TenantPool:
+    """A pool of ready-made tenants.
+
+    :param size: Number of idle tenants to keep ready.
+    :param max_age: Seconds after which a tenant isn't reused any more.
+    :param max_reuse: Number of tests after which a tenant isn't reused
+        any more.
+    :param make_tenant: Callable returning a new `TenantFixture`, not
+        yet set up.
+    """
+
+    def __init__(self, size=DEFAULT_SIZE, max_age=DEFAULT_MAX_AGE,
+                 max_reuse=DEFAULT_MAX_REUSE,
+                 scrub_timeout=DEFAULT_SCRUB_TIMEOUT,
+                 make_tenant=TenantFixture):
+        self.size = size
+        self.max_age = max_age
+        self.max_reuse = max_reuse
+        self.scrub_timeout = scrub_timeout
+        self.make_tenant = make_tenant
+        # Statistics: tenants created, leases of an idle tenant, leases
+        # which had to wait for a tenant to be created, and tenants
+        # deleted rather than reused.
+        self.created = 0
+        self.hits = 0
+        self.misses = 0
+        self.discarded = 0
+        self._idle = []
+        # Number of tenants being created or scrubbed.
+        self._pending = 0
+        self._jobs = set()
+        self._closed = False
+        # Re-entrant, as job callbacks run in the submitting thread
+        # when the job is already done.
+        self._lock = threading.RLock()
+        self._executor = futures.ThreadPoolExecutor(
+            max_workers=max(1, size))
+
+    def _is_reusable(self, tenant):
+        return (
+            time.time() - tenant.created < self.max_age and
+            tenant.uses < self.max_reuse)
+
+    def _submit(self, func, *args):
+        # Called with the lock held.
+        self._pending += 1
+        future = self._executor.submit(func, *args)
+        self._jobs.add(future)
+        future.add_done_callback(self._job_done)
+        return future
+
+    def _job_done(self, future):
+        with self._lock:
+            self._pending -= 1
+            self._jobs.discard(future)
+
+    def _replenish(self):
+        with self._lock:
+            if self._closed:
+                return
+            for _ in range(self.size - len(self._idle) - self._pending):
+                self._submit(self._add_new)
+
+    def _create(self):
+        tenant = self.make_tenant()
+        tenant.setUp()
+        with self._lock:
+            self.created += 1
+        return tenant
+
+    def _add_new(self):
+        tenant = self._create()
+        with self._lock:
+            if not self._closed:
+                self._idle.append(tenant)
+                return
+        self._discard(tenant)
+
+    def _discard(self, tenant):
+        with self._lock:
+            self.discarded += 1
+        tenant.cleanUp()
+
+    def lease(self):
+        """Return a tenant for the exclusive use of a test.
+
+        Give it back with `release` when done.
+        """
+        stale = []
+        tenant = None
+        with self._lock:
+            while self._idle and tenant is None:
+                candidate = self._idle.pop(0)
+                if self._is_reusable(candidate):
+                    tenant = candidate
+                else:
+                    stale.append(candidate)
+            if tenant is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        for candidate in stale:
+            self._discard(candidate)
+        if tenant is None:
+            tenant = self._create()
+        tenant.uses += 1
+        self._replenish()
+        return tenant
+
+    def release(self, tenant):
+        """Give back a tenant leased with `lease`.
+
+        It is scrubbed in the background, then either returned to the
+        pool or deleted.  Returns a Future which is done when that is.
+        """
+        with self._lock:
+            return self._submit(self._recycle, tenant)
+
+    def _recycle(self, tenant):
+        try:
+            clean = tenant.scrub(timeout=self.scrub_timeout)
+        except Exception:
+            clean = False
+        with self._lock:
+            if clean and self._is_reusable(tenant) and not self._closed:
+                self._idle.append(tenant)
+                tenant = None
+        if tenant is not None:
+            self._discard(tenant)
+        self._replenish()
+
+    def wait(self, timeout=None):
+        """Wait until no tenant is being created or scrubbed.
+
+        Returns False if some still are after `timeout` seconds.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            with self._lock:
+                jobs = list(self._jobs)
+            if not jobs:
+                return True
+            if deadline is not None and time.time() >= deadline:
+                return False
+            futures.wait(
+                jobs,
+                timeout=None if deadline is None else deadline - time.time())
+
+    def close(self):
+        """Delete all the tenants, once the pending jobs are done."""
+        with self._lock:
+            self._closed = True
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for tenant in idle:
+            self._discard(tenant)
+
+
+class LeasedTenantFixture(fixtures.Fixture):
+    """Test fixture that leases a tenant from a `TenantPool`.
+
+    The tenant's fixtures are available as properties, as with
+    `TenantFixture`.
+    """
+
+    def __init__(self, pool):
+        super(LeasedTenantFixture, self).__init__()
+        self.pool = pool
+
+    def _setUp(self):
+        super(LeasedTenantFixture, self)._setUp()
+        self.tenant = self.pool.lease()
+        self.addCleanup(self.pool.release, self.tenant)
+        self.project_fixture = self.tenant.project_fixture
+        self.user_fixture = self.tenant.user_fixture
+        self.network_fixture = self.tenant.network_fixture
+        self.router_fixture = self.tenant.router_fixture
+        self.keypair_fixture = self.tenant.keypair_fixture
+        self.addDetail(
+            'LeasedTenantFixture',
+            text_content('Leased tenant of project %s (use %d of %d)' % (
+                self.project_fixture.name, self.tenant.uses,
+                self.pool.max_reuse)))
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _close_pool(pool):
+    # Thread pools take no new work once the interpreter is exiting, so
+    # the background teardown runs the tenants' cleanups right here.
+    pool.close()
+    # Its own exit handler has already run.
+    engine = get_teardown_engine()
+    if engine is not None:
+        engine.report()
+
+
+def get_tenant_pool():
+    """Return the TenantPool, or None if not enabled in the config."""
+    global _pool
+
+    config = CONF.get('tenant_pool') or {}
+    if not config.get('enabled', DEFAULT_ENABLED):
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = TenantPool(
+                size=config.get('size', DEFAULT_SIZE),
+                max_age=config.get('max_age', DEFAULT_MAX_AGE),
+                max_reuse=config.get('max_reuse', DEFAULT_MAX_REUSE),
+                scrub_timeout=config.get(
+                    'scrub_timeout', DEFAULT_SCRUB_TIMEOUT))
+            atexit.register(_close_pool, _pool)
+        return _pool
@@ -28,9 +28,16 @@ __metaclass__ = type
 __all__ = []
 
 import fixtures
-from testiny.clients import get_keystone_v3_client
+from testiny.clients import (
+    forget_sessions,
+    get_keystone_v3_client,
+)
 from testiny.config import CONF
 from testiny.factory import factory
+from testiny.teardown import (
+    add_teardown,
+    TEARDOWN_PROJECT,
+)
 from testtools.content import text_content
 
 
@@ -48,7 +55,9 @@ class UserFixture(fixtures.Fixture):
             name=self.name, password=self.password, domain='default')
         self.addDetail(
             'UserFixture', text_content('User %s created' % self.name))
-        self.addCleanup(self.delete_user)
+        # Any sessions for this user are useless once it's deleted.
+        self.addCleanup(forget_sessions, user_name=self.name)
+        add_teardown(self, TEARDOWN_PROJECT, self.delete_user)
         return self.user
 
     def delete_user(self):
@@ -0,0 +1,326 @@
+# Copyright (C) 2015 Cisco, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Pools of pre-allocated floating IPs.
+
+Allocating a floating IP for every server is slow and churns the
+external network's addresses.  When enabled in the config, each project
+gets a pool of floating IPs allocated in the background.  Floating IPs
+are leased from it, and when released they are disassociated and kept
+for the next lease rather than deleted.  The pool is deleted along with
+its project, or when the process exits.
+
+The time each lease had to wait for a floating IP is recorded: if
+leases keep waiting, the pool is too small.
+"""
+
+from __future__ import (
+    absolute_import,
+    print_function,
+    unicode_literals,
+    )
+
+str = None
+
+__metaclass__ = type
+__all__ = [
+    'FloatingIPPool',
+    'format_wait_report',
+    'get_floating_ip_pool',
+    'peek_floating_ip_pool',
+    ]
+
+import atexit
+from concurrent import futures
+import sys
+import threading
+import time
+
+import neutronclient.common.exceptions
+from testiny.async_clients import get_executor
+from testiny.cache import find_network
+from testiny.clients import get_neutron_client
+from testiny.config import CONF
+from testiny.teardown import (
+    add_teardown,
+    TEARDOWN_SERVER,
+)
+from testiny.utils import percentile
+
+# Defaults for the 'floating_ip_pool' section of the config.
+DEFAULT_ENABLED = False
+DEFAULT_SIZE = 2
+DEFAULT_LEASE_TIMEOUT = 60
+
+
+class FloatingIPPool:
+    """Floating IPs of a project, allocated ahead of time.
+
+    :param neutron: Neutron client for the project.
+    :param network_name: Name of the network to allocate from.
+    :param size: Number of idle floating IPs to keep ready.
+    :param lease_timeout: Default number of seconds a lease waits for
+        the floating IPs being allocated.
+    """
+
+    def __init__(self, neutron, network_name, size=DEFAULT_SIZE,
+                 lease_timeout=DEFAULT_LEASE_TIMEOUT):
+        self.neutron = neutron
+        self.network_name = network_name
+        self.size = size
+        self.lease_timeout = lease_timeout
+        # Seconds each lease waited for a floating IP.
+        self.wait_times = []
+        # Number of floating IPs allocated on demand, because the pool
+        # had none idle or coming.
+        self.misses = 0
+        self._idle = []
+        # Maps the ids of leased floating IPs to them.
+        self._leased = {}
+        self._pending = 0
+        self._closed = False
+        # Futures of the background allocations.
+        self._fills = []
+        self._condition = threading.Condition()
+        self._replenish()
+
+    def _create(self):
+        network = find_network(self.neutron, self.network_name)
+        if network is None:
+            raise Exception(
+                "Can't find network named '%s'" % self.network_name)
+        return self.neutron.create_floatingip({'floatingip': {
+            'floating_network_id': network['id'],
+        }})['floatingip']
+
+    def _delete(self, floatingip):
+        try:
+            self.neutron.delete_floatingip(floatingip['id'])
+        except neutronclient.common.exceptions.NotFound:
+            pass
+
+    def _fill(self):
+        with self._condition:
+            if self._closed:
+                self._pending -= 1
+                self._condition.notify_all()
+                return
+        try:
+            floatingip = self._create()
+        except Exception:
+            floatingip = None
+            raise
+        finally:
+            with self._condition:
+                self._pending -= 1
+                closed = self._closed
+                if floatingip is not None and not closed:
+                    self._idle.append(floatingip)
+                self._condition.notify_all()
+        if closed:
+            self._delete(floatingip)
+
+    def _replenish(self):
+        with self._condition:
+            if self._closed:
+                return
+            missing = self.size - len(self._idle) - self._pending
+            if missing <= 0:
+                return
+            self._pending += missing
+        executor = get_executor()
+        fills = [executor.submit(self._fill) for _ in range(missing)]
+        with self._condition:
+            self._fills = [
+                fill for fill in self._fills if not fill.done()] + fills
+
+    def lease(self, timeout=None):
+        """Return an idle floating IP, as a dict from neutron.
+
+        Waits up to `timeout` seconds, by default `lease_timeout`, for
+        the floating IPs being allocated; if there are none, or they
+        failed, one is allocated on demand.
+        """
+        if timeout is None:
+            timeout = self.lease_timeout
+        started = time.time()
+        deadline = started + timeout
+        with self._condition:
+            while not self._idle and self._pending:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            floatingip = self._idle.pop(0) if self._idle else None
+        if floatingip is None:
+            floatingip = self._create()
+            missed = True
+        else:
+            missed = False
+        with self._condition:
+            self._leased[floatingip['id']] = floatingip
+            self.wait_times.append(time.time() - started)
+            if missed:
+                self.misses += 1
+        self._replenish()
+        return floatingip
+
+    def associate(self, floatingip, port_id):
+        """Bind a leased floating IP to a port."""
+        return self.neutron.update_floatingip(
+            floatingip['id'], {'floatingip': {'port_id': port_id}})
+
+    def release(self, floatingip):
+        """Return a leased floating IP to the pool.
+
+        It is disassociated from its port, if any, first.
+        """
+        try:
+            self.neutron.update_floatingip(
+                floatingip['id'], {'floatingip': {'port_id': None}})
+        except neutronclient.common.exceptions.NotFound:
+            # Deleted from under us, e.g. by a tenant scrub.
+            with self._condition:
+                self._leased.pop(floatingip['id'], None)
+            return
+        with self._condition:
+            self._leased.pop(floatingip['id'], None)
+            closed = self._closed
+            if not closed:
+                self._idle.append(floatingip)
+                self._condition.notify_all()
+        if closed:
+            self._delete(floatingip)
+
+    def idle_ids(self):
+        """Return the ids of the idle floating IPs."""
+        with self._condition:
+            return set(floatingip['id'] for floatingip in self._idle)
+
+    def owned_ids(self):
+        """Return the ids of all the floating IPs of the pool.
+
+        Those idle and leased, once the allocations in flight are done:
+        a floating IP listed in the project before this is called is
+        either one of them, or isn't the pool's.
+        """
+        with self._condition:
+            fills = self._fills
+        futures.wait(fills)
+        with self._condition:
+            return set(
+                floatingip['id'] for floatingip in
+                self._idle + list(self._leased.values()))
+
+    def close(self):
+        """Delete all the floating IPs of the pool.
+
+        Those being allocated are deleted when they're done, which this
+        waits for.
+        """
+        with self._condition:
+            self._closed = True
+            floatingips = self._idle + list(self._leased.values())
+            self._idle = []
+            self._leased = {}
+            fills = self._fills
+        for floatingip in floatingips:
+            self._delete(floatingip)
+        futures.wait(fills)
+
+    def format_report(self):
+        with self._condition:
+            return format_wait_report(self.wait_times, self.misses)
+
+
+def format_wait_report(wait_times, misses):
+    """Describe how long leases of floating IPs waited."""
+    if not wait_times:
+        return "No floating IP leased"
+    wait_times = sorted(wait_times)
+    return (
+        "%d floating IPs leased, waited p50=%.2fs p90=%.2fs max=%.2fs, "
+        "%d allocated on demand" % (
+            len(wait_times), percentile(wait_times, 50),
+            percentile(wait_times, 90), wait_times[-1], misses))
+
+
+# Maps (project id, network name) to the pool.
+_pools = {}
+_pools_lock = threading.Lock()
+# Wait times and misses of the pools closed so far, reported at exit.
+_closed_wait_times = []
+_closed_misses = [0]
+_registered = []
+
+
+def peek_floating_ip_pool(project_id, network_name):
+    """Return the project's pool, if it exists, else None."""
+    with _pools_lock:
+        return _pools.get((project_id, network_name))
+
+
+def get_floating_ip_pool(project_fixture, network_name):
+    """Return the pool of floating IPs of a project.
+
+    Returns None if not enabled in the config.  The pool is created on
+    first use, and deleted along with the project.
+    """
+    config = CONF.get('floating_ip_pool') or {}
+    if not config.get('enabled', DEFAULT_ENABLED):
+        return None
+    key = (project_fixture.project.id, network_name)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is not None:
+            return pool
+        if not _registered:
+            atexit.register(_close_pools)
+            _registered.append(True)
+        # The project's admin outlives the project's other users.
+        neutron = get_neutron_client(
+            project_name=project_fixture.name,
+            user_name=project_fixture.admin_user.name,
+            password=project_fixture.admin_user_fixture.password)
+        pool = _pools[key] = FloatingIPPool(
+            neutron, network_name, size=config.get('size', DEFAULT_SIZE),
+            lease_timeout=config.get(
+                'lease_timeout', DEFAULT_LEASE_TIMEOUT))
+    add_teardown(project_fixture, TEARDOWN_SERVER, _close_pool, key)
+    return pool
+
+
+def _close_pool(key):
+    with _pools_lock:
+        pool = _pools.pop(key, None)
+    if pool is None:
+        return
+    pool.close()
+    with _pools_lock:
+        _closed_wait_times.extend(pool.wait_times)
+        _closed_misses[0] += pool.misses
+
+
+def _close_pools(stream=None):
+    with _pools_lock:
+        keys = list(_pools)
+    for key in keys:
+        _close_pool(key)
+    if stream is None:
+        stream = sys.stderr
+    print(
+        "Floating IP pools: %s" % format_wait_report(
+            _closed_wait_times, _closed_misses[0]),
+        file=stream)
@@ -0,0 +1,132 @@
+# Copyright (C) 2015 Cisco, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Local generation of SSH keys.
+
+Having nova generate keypairs is slow on a busy API node.  Keys are
+generated locally with ssh-keygen instead, and only their public part is
+imported into nova.  The next key is always being generated in a
+background thread, so one is ready by the time it's needed.
+
+The private key files of a run live in a single temporary directory,
+removed when the process exits.
+"""
+
+from __future__ import (
+    absolute_import,
+    print_function,
+    unicode_literals,
+    )
+
+str = None
+
+__metaclass__ = type
+__all__ = [
+    'get_key_generator',
+    'KeyGenerator',
+    'SSHKey',
+    ]
+
+import atexit
+from collections import namedtuple
+from concurrent import futures
+import itertools
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+
+from testiny.config import CONF
+
+# Defaults for the 'keypair' section of the config.
+DEFAULT_KEY_TYPE = 'rsa'
+DEFAULT_BITS = 2048
+
+# A generated key: the path of the private key file and the public key,
+# in OpenSSH format.
+SSHKey = namedtuple('SSHKey', ['private_key_file', 'public_key'])
+
+
+class KeyGenerator:
+    """Generates SSH keys with ssh-keygen, one ahead of time.
+
+    :param key_type: Type of key, as for ssh-keygen -t, e.g. 'rsa' or
+        'ed25519'.
+    :param bits: Size of RSA keys.
+    :param directory: Where to write the keys, defaults to a new
+        temporary directory removed by `close`.
+    """
+
+    def __init__(self, key_type=DEFAULT_KEY_TYPE, bits=DEFAULT_BITS,
+                 directory=None):
+        self.key_type = key_type
+        self.bits = bits
+        if directory is None:
+            directory = tempfile.mkdtemp(prefix='testiny-keys-')
+            self._remove_directory = True
+        else:
+            self._remove_directory = False
+        self.directory = directory
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._executor = futures.ThreadPoolExecutor(max_workers=1)
+        self._next = self._executor.submit(self._generate)
+
+    def _generate(self):
+        with self._lock:
+            index = next(self._counter)
+        path = os.path.join(
+            self.directory, 'id_%s_%d' % (self.key_type, index))
+        command = [
+            'ssh-keygen', '-q', '-t', self.key_type, '-N', '',
+            '-C', 'testiny', '-f', path,
+        ]
+        if self.key_type == 'rsa':
+            command[4:4] = ['-b', '%d' % self.bits]
+        subprocess.check_call(command)
+        with open(path + '.pub') as f:
+            public_key = f.read().strip()
+        return SSHKey(path, public_key)
+
+    def get(self):
+        """Return a new `SSHKey`, and start generating the next one."""
+        with self._lock:
+            ready, self._next = (
+                self._next, self._executor.submit(self._generate))
+        return ready.result()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        if self._remove_directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+_generator = None
+_generator_lock = threading.Lock()
+
+
+def get_key_generator():
+    """Return the KeyGenerator configured by the 'keypair' section."""
+    global _generator
+
+    with _generator_lock:
+        if _generator is None:
+            config = CONF.get('keypair') or {}
+            _generator = KeyGenerator(
+                key_type=config.get('key_type', DEFAULT_KEY_TYPE),
+                bits=config.get('bits', DEFAULT_BITS))
+            atexit.register(_generator.close)
+        return _generator
@@ -0,0 +1,416 @@
+# Copyright (C) 2015 Cisco, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Access to instances through the local network namespaces.
+
+With the 'local_netns' instance access, instances are reached from the
+DHCP namespace of their network.  Rather than forking `sudo ip netns
+exec` for every ssh, one `NetnsAgent` per namespace is started with
+sudo: it enters the namespace once and, through a unix socket, makes
+TCP connections from there on behalf of all the servers on that
+network (see testiny.netns_agent).  ssh goes through it as its
+ProxyCommand.  If the agent can't be started, e.g. because sudo only
+allows running `ip`, ssh falls back on `sudo ip netns exec`.
+
+The namespaces present are tracked by a `NamespaceWatcher`, which
+watches /var/run/netns with inotify instead of running `ip netns list`.
+"""
+
+from __future__ import (
+    absolute_import,
+    print_function,
+    unicode_literals,
+    )
+
+str = None
+
+__metaclass__ = type
+__all__ = [
+    'get_namespace_watcher',
+    'get_netns_agent',
+    'NamespaceWatcher',
+    'NetnsAgent',
+    'NetnsAgentError',
+    ]
+
+import atexit
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import shutil
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import six
+from six.moves import shlex_quote
+from testiny import netns_agent
+from testiny.config import CONF
+from testiny.netns_agent import (
+    NETNS_RUN_DIR,
+    read_line,
+)
+from testiny.probe import (
+    DEFAULT_INTERVAL,
+    DEFAULT_READ_BANNER,
+    DEFAULT_TIMEOUT,
+    ProbeTimeout,
+)
+
+# Defaults for the 'netns_agent' section of the config.
+DEFAULT_ENABLED = True
+
+# Seconds allowed for a single connection attempt when probing SSH.
+ATTEMPT_TIMEOUT = 2
+
+# Seconds allowed for an agent to start serving, and to exit when
+# closed.
+START_TIMEOUT = 10
+STOP_TIMEOUT = 2
+
+# The agent script, run by path so that it needn't be importable by
+# the python run through sudo.
+AGENT_SCRIPT = os.path.splitext(netns_agent.__file__)[0] + '.py'
+
+# From sys/inotify.h.
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CLOEXEC = 0o2000000
+# The fixed part of a struct inotify_event: wd, mask, cookie, len.
+# struct wants native strings as formats.
+INOTIFY_EVENT = struct.Struct(b'iIII' if six.PY2 else 'iIII')
+
+
+class NetnsAgentError(Exception):
+    """Raised when an agent can't be started or fails a request."""
+
+
+class NetnsAgent:
+    """A process serving requests from inside a network namespace.
+
+    The agent runs as root, through sudo unless we're root already,
+    until `close` is called or this process exits.  sudo must let it
+    run without a password.
+
+    :param name: Name of the namespace, as in /var/run/netns.
+    :param start_timeout: Seconds allowed for the agent to start.
+    :raise NetnsAgentError: if the agent doesn't start in time.
+    """
+
+    def __init__(self, name, start_timeout=START_TIMEOUT):
+        self.name = name
+        self._directory = tempfile.mkdtemp(prefix='testiny-netns-')
+        self.socket_path = os.path.join(self._directory, 'agent')
+        command = [
+            sys.executable, AGENT_SCRIPT, 'serve', name, self.socket_path,
+            '%d' % os.getuid()]
+        if os.geteuid() != 0:
+            # Fail rather than prompt for a password.
+            command = ['sudo', '-n'] + command
+        self._process = subprocess.Popen(
+            command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        if self._read_ready(start_timeout) != b'ready\n':
+            self.close(timeout=0)
+            raise NetnsAgentError(
+                "Can't start agent in namespace %s" % name)
+
+    def _read_ready(self, timeout):
+        fd = self._process.stdout.fileno()
+        deadline = time.time() + timeout
+        line = b''
+        while not line.endswith(b'\n'):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            readable, _, _ = select.select([fd], [], [], remaining)
+            if not readable:
+                break
+            data = os.read(fd, 1)
+            if not data:
+                break
+            line += data
+        return line
+
+    @property
+    def is_alive(self):
+        return self._process.poll() is None
+
+    def _request(self, request, timeout=None):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(self.socket_path)
+            sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+            line = read_line(sock)
+        except Exception:
+            sock.close()
+            raise
+        if not line:
+            sock.close()
+            raise NetnsAgentError(
+                "No reply from agent in namespace %s" % self.name)
+        reply = json.loads(line.decode('utf-8'))
+        if 'error' in reply:
+            sock.close()
+            raise socket.error(reply.get('errno'), reply['error'])
+        return sock, reply
+
+    def connect(self, host, port, timeout=None):
+        """Return a socket connected to host:port from the namespace.
+
+        :raise socket.error: if the connection can't be made.
+        """
+        request_timeout = None if timeout is None else timeout + 1
+        sock, _ = self._request(
+            {'op': 'connect', 'host': host, 'port': port,
+             'timeout': timeout},
+            timeout=request_timeout)
+        sock.settimeout(None)
+        return sock
+
+    def proxy_command(self):
+        """Return the ssh ProxyCommand connecting through the agent."""
+        return ' '.join(
+            [shlex_quote(arg) for arg in (
+                sys.executable, AGENT_SCRIPT, 'connect', self.socket_path)] +
+            ['%h', '%p'])
+
+    def wait_for_ssh(self, address, port=22, timeout=DEFAULT_TIMEOUT,
+                     interval=DEFAULT_INTERVAL,
+                     read_banner=DEFAULT_READ_BANNER):
+        """Wait until `address` accepts SSH connections.
+
+        As testiny.probe.wait_for_ssh, for a single address reachable
+        from the namespace.
+        """
+        start = time.time()
+        deadline = start + timeout
+        while True:
+            attempted = time.time()
+            try:
+                sock = self.connect(address, port, timeout=ATTEMPT_TIMEOUT)
+            except socket.error:
+                sock = None
+            if sock is not None:
+                banner = b'' if read_banner else b'SSH-'
+                try:
+                    sock.settimeout(ATTEMPT_TIMEOUT)
+                    while len(banner) < 4:
+                        data = sock.recv(4 - len(banner))
+                        if not data:
+                            break
+                        banner += data
+                except socket.error:
+                    pass
+                finally:
+                    sock.close()
+                if banner == b'SSH-':
+                    return {address: time.time() - start}
+            wait = attempted + interval - time.time()
+            if time.time() + max(0, wait) >= deadline:
+                raise ProbeTimeout(
+                    "SSH not ready after %s seconds on %s" % (
+                        timeout, address), {})
+            if wait > 0:
+                time.sleep(wait)
+
+    def close(self, timeout=STOP_TIMEOUT):
+        """Stop the agent, killing it if not gone after `timeout`."""
+        if self._process.stdin is not None and not self._process.stdin.closed:
+            # The agent exits when its stdin is closed.
+            self._process.stdin.close()
+        deadline = time.time() + timeout
+        while self._process.poll() is None and time.time() < deadline:
+            time.sleep(0.05)
+        if self._process.poll() is None:
+            # Stuck, e.g. sudo waiting for a password.
+            self._process.kill()
+        self._process.wait()
+        self._process.stdout.close()
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+
+class NamespaceWatcher:
+    """The network namespaces present, kept up to date with inotify.
+
+    If the directory can't be watched, e.g. because no namespace was
+    ever created, it is listed again whenever a namespace isn't found.
+
+    :param directory: Where the namespaces are.
+    """
+
+    def __init__(self, directory=NETNS_RUN_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._names = self._list()
+        self._stopped = threading.Event()
+        self._fd = self._watch()
+        self._thread = None
+        if self._fd is not None:
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    @property
+    def watching(self):
+        return self._fd is not None
+
+    def _list(self):
+        try:
+            return set(os.listdir(self.directory))
+        except OSError:
+            return set()
+
+    def _watch(self):
+        libc_name = ctypes.util.find_library('c')
+        if libc_name is None:
+            return None
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        fd = libc.inotify_init1(IN_CLOEXEC)
+        if fd < 0:
+            return None
+        path = self.directory.encode(sys.getfilesystemencoding())
+        mask = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+        if libc.inotify_add_watch(fd, path, mask) < 0:
+            os.close(fd)
+            return None
+        # Namespaces added between the listing and the watch.
+        with self._lock:
+            self._names.update(self._list())
+        return fd
+
+    def _apply(self, data):
+        offset = 0
+        while offset + INOTIFY_EVENT.size <= len(data):
+            _, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0').decode(
+                sys.getfilesystemencoding())
+            offset += length
+            with self._lock:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self._names.add(name)
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    self._names.discard(name)
+
+    def _run(self):
+        try:
+            while not self._stopped.is_set():
+                readable, _, _ = select.select([self._fd], [], [], 1)
+                if readable:
+                    self._apply(os.read(self._fd, 65536))
+        finally:
+            os.close(self._fd)
+
+    def names(self):
+        """Return the set of namespace names."""
+        with self._lock:
+            return set(self._names)
+
+    def exists(self, name):
+        """Return True if the namespace `name` exists.
+
+        A namespace not seen is looked for in the directory, in case
+        its inotify event is still to come.
+        """
+        with self._lock:
+            if name in self._names:
+                return True
+        names = self._list()
+        with self._lock:
+            if not self.watching:
+                self._names = names
+            return name in names
+
+    def check(self, name):
+        """Raise an exception if the namespace `name` doesn't exist."""
+        if not self.exists(name):
+            raise Exception("Namespace %s not in machine namespaces." % name)
+
+    def close(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+_watcher = None
+_watcher_lock = threading.Lock()
+# Maps namespace names to their agent.
+_agents = {}
+# Namespaces whose agent couldn't be started.
+_failed = set()
+_agents_lock = threading.Lock()
+_registered = []
+
+
+def get_namespace_watcher():
+    """Return the watcher of the namespaces shared by all fixtures."""
+    global _watcher
+
+    with _watcher_lock:
+        if _watcher is None:
+            _watcher = NamespaceWatcher()
+        return _watcher
+
+
+def get_netns_agent(name):
+    """Return the agent of the namespace `name`.
+
+    Returns None if agents aren't enabled in the config, or if the
+    namespace's agent can't be started: callers then fall back on `sudo
+    ip netns exec`.  The agent is started on first use, and restarted
+    if it died.
+    """
+    config = CONF.get('netns_agent') or {}
+    if not config.get('enabled', DEFAULT_ENABLED):
+        return None
+    with _agents_lock:
+        if name in _failed:
+            return None
+        agent = _agents.get(name)
+        if agent is not None and agent.is_alive:
+            return agent
+        if agent is not None:
+            agent.close()
+        if not _registered:
+            atexit.register(_close_agents)
+            _registered.append(True)
+        try:
+            agent = NetnsAgent(name)
+        except (NetnsAgentError, OSError) as e:
+            _failed.add(name)
+            _agents.pop(name, None)
+            print(
+                "Using 'ip netns exec' for namespace %s: %s" % (name, e),
+                file=sys.stderr)
+            return None
+        _agents[name] = agent
+        return agent
+
+
+def _close_agents():
+    with _agents_lock:
+        agents = list(_agents.values())
+        _agents.clear()
+    for agent in agents:
+        agent.close()
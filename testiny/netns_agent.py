@@ -0,0 +1,259 @@
+# Copyright (C) 2015 Cisco, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Agent giving access to a network namespace over a unix socket.
+
+Run as root, as a script, by testiny.netns:
+
+    netns_agent.py serve <namespace> <socket path> [<owner uid>]
+
+enters the namespace once, with setns(2), and serves the socket: each
+connection to it sends one request line, a JSON object, and gets one
+reply line back:
+
+    {"op": "connect", "host": ..., "port": ..., "timeout": ...}
+        connects to the address from inside the namespace; once the
+        reply {"ok": true} is sent, bytes are relayed both ways.
+
+Failures are replied as {"error": message, "errno": number}.  The agent
+prints "ready" once serving, and exits when its stdin is closed, i.e.
+along with the process that started it.
+
+    netns_agent.py connect <socket path> <host> <port>
+
+relays stdin and stdout to the address through the agent serving the
+socket; it is meant as ssh's ProxyCommand.
+
+This only uses the standard library, so that it runs with whatever
+environment sudo leaves.
+"""
+
+from __future__ import (
+    absolute_import,
+    print_function,
+    unicode_literals,
+    )
+
+str = None
+
+__metaclass__ = type
+__all__ = [
+    'connect',
+    'enter_namespace',
+    'pump',
+    'read_line',
+    'serve',
+    ]
+
+import ctypes
+import ctypes.util
+import errno
+import json
+import os
+import socket
+import sys
+import threading
+
+# Where 'ip netns' keeps the namespaces.
+NETNS_RUN_DIR = '/var/run/netns'
+
+# From sched.h.
+CLONE_NEWNET = 0x40000000
+
+BUFFER_SIZE = 65536
+
+# Longest request or reply line accepted.
+MAX_LINE = 1 << 20
+
+# Seconds allowed to connect to an address, by default.
+DEFAULT_CONNECT_TIMEOUT = 10
+
+
+def enter_namespace(name):
+    """Move the calling thread into the network namespace `name`.
+
+    Threads and processes started afterwards by that thread are in the
+    namespace too.
+    """
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    fd = os.open(os.path.join(NETNS_RUN_DIR, name), os.O_RDONLY)
+    try:
+        if libc.setns(fd, CLONE_NEWNET) != 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+    finally:
+        os.close(fd)
+
+
+def read_line(sock):
+    """Read a line from `sock`, without reading past it."""
+    data = bytearray()
+    while not data.endswith(b'\n'):
+        if len(data) >= MAX_LINE:
+            raise ValueError("Line too long")
+        byte = sock.recv(1)
+        if not byte:
+            break
+        data += byte
+    return bytes(data)
+
+
+def _send(sock, **message):
+    sock.sendall(json.dumps(message).encode('utf-8') + b'\n')
+
+
+def pump(read_fd, write_fd, on_eof):
+    """Copy from `read_fd` to `write_fd` until EOF, then call on_eof()."""
+    try:
+        while True:
+            data = os.read(read_fd, BUFFER_SIZE)
+            if not data:
+                break
+            while data:
+                data = data[os.write(write_fd, data):]
+    except OSError:
+        pass
+    finally:
+        on_eof()
+
+
+def _shutdown(sock):
+    try:
+        sock.shutdown(socket.SHUT_WR)
+    except socket.error:
+        pass
+
+
+def _relay(client, target):
+    sending = threading.Thread(
+        target=pump,
+        args=(client.fileno(), target.fileno(), lambda: _shutdown(target)))
+    sending.daemon = True
+    sending.start()
+    pump(target.fileno(), client.fileno(), lambda: _shutdown(client))
+    sending.join()
+
+
+def _connect(client, request):
+    try:
+        target = socket.create_connection(
+            (request['host'], int(request['port'])),
+            request.get('timeout', DEFAULT_CONNECT_TIMEOUT))
+    except socket.timeout:
+        _send(client, error=os.strerror(errno.ETIMEDOUT),
+              errno=errno.ETIMEDOUT)
+        return
+    except socket.error as e:
+        _send(client, error=e.strerror or '%s' % e, errno=e.errno)
+        return
+    try:
+        target.settimeout(None)
+        _send(client, ok=True)
+        _relay(client, target)
+    finally:
+        target.close()
+
+
+_OPERATIONS = {
+    'connect': _connect,
+}
+
+
+def _handle(client):
+    try:
+        request = json.loads(read_line(client).decode('utf-8'))
+        operation = _OPERATIONS.get(request.get('op'))
+        if operation is None:
+            _send(client, error="Unknown request", errno=errno.EINVAL)
+        else:
+            operation(client, request)
+    except (ValueError, KeyError, TypeError) as e:
+        _send(client, error="Bad request: %s" % e, errno=errno.EINVAL)
+    except socket.error:
+        # The client went away.
+        pass
+    finally:
+        client.close()
+
+
+def _exit_on_eof(fd):
+    while os.read(fd, BUFFER_SIZE):
+        pass
+    os._exit(0)
+
+
+def serve(name, socket_path, owner=None):
+    """Serve requests on `socket_path` from the namespace `name`."""
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(socket_path)
+    if owner is not None:
+        os.chown(socket_path, owner, -1)
+    os.chmod(socket_path, 0o600)
+    listener.listen(128)
+    # Before starting any thread, so they're all in the namespace.
+    enter_namespace(name)
+    watchdog = threading.Thread(
+        target=_exit_on_eof, args=(sys.stdin.fileno(),))
+    watchdog.daemon = True
+    watchdog.start()
+    os.write(sys.stdout.fileno(), b'ready\n')
+    while True:
+        client, _ = listener.accept()
+        handler = threading.Thread(target=_handle, args=(client,))
+        handler.daemon = True
+        handler.start()
+
+
+def connect(socket_path, host, port):
+    """Relay stdin and stdout to host:port through an agent.
+
+    :return: The exit status: 0 once the connection is closed, 255 if
+        it couldn't be made, as for ssh.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        _send(sock, op='connect', host=host, port=port)
+        reply = json.loads(read_line(sock).decode('utf-8') or '{}')
+    except (socket.error, ValueError) as e:
+        reply = {'error': "%s" % e}
+    if not reply.get('ok'):
+        # Worded as ssh would, so that callers recognise the error.
+        print(
+            "ssh: connect to host %s port %s: %s" % (
+                host, port, reply.get('error', "No reply from agent")),
+            file=sys.stderr)
+        return 255
+    sending = threading.Thread(
+        target=pump,
+        args=(sys.stdin.fileno(), sock.fileno(), lambda: _shutdown(sock)))
+    sending.daemon = True
+    sending.start()
+    pump(sock.fileno(), sys.stdout.fileno(), lambda: None)
+    return 0
+
+
+def main(args):
+    if len(args) >= 3 and args[0] == 'serve':
+        serve(args[1], args[2], int(args[3]) if len(args) > 3 else None)
+        return 0
+    if len(args) == 4 and args[0] == 'connect':
+        return connect(args[1], args[2], int(args[3]))
+    print(__doc__, file=sys.stderr)
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,181 @@
+# Copyright (C) 2015 Cisco, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Per-packet ping telemetry.
+
+A PingMonitor is fed the output of a running ping, line by line, and
+records the time and round-trip time of every reply.  Its report gives
+the RTT percentiles and the outage windows: the periods during which
+no reply came back.
+"""
+
+from __future__ import (
+    absolute_import,
+    print_function,
+    unicode_literals,
+    )
+
+str = None
+
+__metaclass__ = type
+__all__ = [
+    'Outage',
+    'PingMonitor',
+    'PingReport',
+    ]
+
+from array import array
+from collections import namedtuple
+import re
+import threading
+import time
+
+import six
+from testiny.utils import percentile
+
+# A reply line from iputils ("icmp_seq=3") or busybox ("seq=3") ping.
+PING_REPLY_RE = re.compile(
+    r'(?P<seq_type>icmp_seq|seq)=(?P<seq>\d+) .*time=(?P<rtt>[\d.]+) ?ms')
+
+# A period with no ping replies.
+# start and end are times since the start of the ping, in seconds;
+# lost is the number of packets lost.
+Outage = namedtuple('Outage', ['start', 'end', 'duration', 'lost'])
+
+# array() wants native strings as type codes.
+_LONG = b'l' if six.PY2 else 'l'
+_DOUBLE = b'd' if six.PY2 else 'd'
+
+
+class PingReport:
+    """Summary of a ping run.
+
+    :ivar sent: Number of packets sent.
+    :ivar received: Number of replies received.
+    :ivar loss_percent: Percentage of packets lost.
+    :ivar percentiles: Dict mapping 50, 90, 99 and 100 to the
+        corresponding RTT percentile, in milliseconds.
+    :ivar outages: List of `Outage`.
+    :ivar started: Time at which the ping started, as from time.time().
+    :ivar duration: Duration of the ping, in seconds.
+    """
+
+    def __init__(self, sent, received, percentiles, outages, started,
+                 duration):
+        self.sent = sent
+        self.received = received
+        self.loss_percent = (
+            100.0 * (sent - received) / sent if sent else 0.0)
+        self.percentiles = percentiles
+        self.outages = outages
+        self.started = started
+        self.duration = duration
+
+    def __repr__(self):
+        lines = [
+            "%d packets sent, %d received, %.1f%% packet loss in %.1fs" % (
+                self.sent, self.received, self.loss_percent, self.duration),
+        ]
+        if self.percentiles:
+            lines.append("rtt ms: " + ", ".join(
+                "p%d=%.2f" % (percentile, self.percentiles[percentile])
+                for percentile in sorted(self.percentiles)))
+        for outage in self.outages:
+            lines.append(
+                "outage of %.2fs from %.2fs to %.2fs (%d packets lost)" % (
+                    outage.duration, outage.start, outage.end, outage.lost))
+        return "\n".join(lines)
+
+
+class PingMonitor:
+    """Records the replies of a running ping.
+
+    :param interval: Seconds between the packets sent by ping.
+    """
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.started = time.time()
+        self.stopped = None
+        # Sequence number, arrival time (since start) and RTT of each
+        # reply, in arrival order.
+        self.seqs = array(_LONG)
+        self.times = array(_DOUBLE)
+        self.rtts = array(_DOUBLE)
+        # Sequence number of the first packet sent.
+        self.first_seq = 0
+        self._lock = threading.Lock()
+
+    def feed(self, line, now=None):
+        """Record a line of ping output."""
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', 'replace')
+        match = PING_REPLY_RE.search(line)
+        if match is None or 'DUP!' in line:
+            return
+        if now is None:
+            now = time.time()
+        seq = int(match.group('seq'))
+        with self._lock:
+            if match.group('seq_type') == 'icmp_seq':
+                # iputils counts from 1, busybox from 0.
+                self.first_seq = 1
+            self.seqs.append(seq)
+            self.times.append(now - self.started)
+            self.rtts.append(float(match.group('rtt')))
+
+    def stop(self, now=None):
+        """Mark the end of the ping."""
+        self.stopped = time.time() if now is None else now
+
+    def report(self):
+        """Return a `PingReport` of the replies so far."""
+        with self._lock:
+            seqs = list(self.seqs)
+            times = list(self.times)
+            rtts = sorted(self.rtts)
+        end = (
+            self.stopped if self.stopped is not None else time.time()
+        ) - self.started
+        outages = []
+        # Replies are expected every interval; a gap in the sequence
+        # numbers between two replies, or before the first one, is an
+        # outage.
+        previous_seq, previous_time = self.first_seq - 1, 0.0
+        for seq, when in zip(seqs, times):
+            if seq <= previous_seq:
+                continue
+            if seq - previous_seq > 1:
+                outages.append(Outage(
+                    previous_time, when, when - previous_time,
+                    seq - previous_seq - 1))
+            previous_seq, previous_time = seq, when
+        # Packets sent since the last reply, allowing for one still in
+        # flight, are lost.
+        trailing = int((end - previous_time) / self.interval)
+        if seqs:
+            trailing -= 1
+        sent = previous_seq - self.first_seq + 1
+        if trailing > 0:
+            sent += trailing
+            outages.append(Outage(
+                previous_time, end, end - previous_time, trailing))
+        percentiles = {}
+        if rtts:
+            for percent in (50, 90, 99, 100):
+                percentiles[percent] = percentile(rtts, percent)
+        return PingReport(
+            sent=sent, received=len(set(seqs)), percentiles=percentiles,
+            outages=outages, started=self.started, duration=end)
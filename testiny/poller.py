@@ -0,0 +1,477 @@
+# Copyright (C) 2015 Cisco, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Batched polling of Openstack object states.
+
+Rather than each fixture polling its own objects, waits are registered
+with a poller per type of object.  A single background thread fetches
+the state of all the waited-for objects with one list call per tick
+and wakes up the waiters whose object reached the desired state.
+
+The polling interval backs off exponentially, with jitter, while
+nothing changes, and goes back to its minimum when a wait is added or
+completes.
+
+If a notification bus is configured (see testiny.notifications), the
+pollers are event-driven instead: the state of an object is fetched
+when a notification about it arrives, and the regular polling only
+happens every 'fallback_interval' seconds, in case a notification is
+missed.
+"""
+
+from __future__ import (
+    absolute_import,
+    print_function,
+    unicode_literals,
+    )
+
+str = None
+
+__metaclass__ = type
+__all__ = [
+    'BatchedPoller',
+    'get_poller',
+    'get_port_poller',
+    'get_router_poller',
+    'get_server_poller',
+    'WaitTimeout',
+    ]
+
+from concurrent import futures
+import datetime
+import random
+import threading
+import time
+
+import novaclient
+from testiny.clients import (
+    get_neutron_client,
+    get_nova_v3_client,
+)
+from testiny.config import CONF
+from testiny.notifications import get_notification_bus
+
+# Defaults for the 'polling' section of the config.
+DEFAULT_MIN_INTERVAL = 0.5
+DEFAULT_MAX_INTERVAL = 5
+DEFAULT_BACKOFF = 1.5
+DEFAULT_JITTER = 0.2
+DEFAULT_CLOCK_SKEW = 5
+DEFAULT_FALLBACK_INTERVAL = 30
+
+
+class WaitTimeout(Exception):
+    """Raised when an object doesn't reach the desired state in time."""
+
+
+class Waiter:
+    """A wait for an object to satisfy a predicate.
+
+    Its `future` is resolved when the wait is over, with a tuple of the
+    object and `timestamp`.
+
+    :param deadline: If not None, the time, as from time.time(), after
+        which the poller gives up with `WaitTimeout`.
+    """
+
+    def __init__(self, resource_id, predicate, deadline=None):
+        self.resource_id = resource_id
+        self.predicate = predicate
+        self.deadline = deadline
+        self.event = threading.Event()
+        self.future = futures.Future()
+        self.resource = None
+        self.error = None
+        # When the object reached the state satisfying the predicate, as
+        # from time.time().
+        self.timestamp = None
+
+    def check(self, resource, timestamp):
+        """Check `resource`, as it was at `timestamp`, against the predicate.
+
+        Returns True, and wakes up the waiting thread, if the wait is
+        over: either the predicate is satisfied or it raised.
+        """
+        try:
+            done = self.predicate(resource)
+        except Exception as e:
+            self.error = e
+            done = True
+        if done:
+            self.resource = resource
+            self.timestamp = timestamp
+            self.event.set()
+            if self.error is not None:
+                self.future.set_exception(self.error)
+            else:
+                self.future.set_result((resource, timestamp))
+        return done
+
+    def expire(self):
+        """Give up the wait."""
+        self.future.set_exception(
+            WaitTimeout("Timed out waiting for %s" % self.resource_id))
+
+
+class BatchedPoller:
+    """Polls the state of many objects of one type at once.
+
+    Subclasses implement `fetch`.
+
+    :param fallback_interval: If not None, the poller is event-driven:
+        objects are fetched when `notify` is called about them, and
+        polled every `fallback_interval` seconds otherwise.
+    :param bus: The testiny.notifications.Bus calling `notify`, if any:
+        while it isn't connected, the poller polls as if it weren't
+        event-driven.
+    """
+
+    def __init__(self, min_interval=DEFAULT_MIN_INTERVAL,
+                 max_interval=DEFAULT_MAX_INTERVAL, backoff=DEFAULT_BACKOFF,
+                 jitter=DEFAULT_JITTER, fallback_interval=None, bus=None):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.fallback_interval = fallback_interval
+        self.bus = bus
+        self.interval = min_interval
+        # Number of fetch calls made, for statistics.
+        self.fetches = 0
+        self._waiters = []
+        # Ids of the objects whose current state hasn't been fetched
+        # since they were first waited for, or since a notification
+        # about them.
+        self._new_ids = set()
+        # Maps the ids of objects to the time of the latest notification
+        # about them, until they are fetched.
+        self._event_times = {}
+        # Time of the start of the last tick.
+        self._last_tick = None
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def fetch(self, resource_ids, since):
+        """Return the current state of the given objects.
+
+        :param resource_ids: Set of ids of the objects to fetch.
+        :param since: If not None, the time (a UTC datetime) of the
+            previous fetch; only objects changed since then need to be
+            returned.
+        :return: A dict mapping ids to objects.  Objects that don't
+            exist any more map to None; objects missing from the dict are
+            considered unchanged.
+        """
+        raise NotImplementedError()
+
+    def wait(self, resource_id, predicate, timeout=60):
+        """Wait until `predicate(obj)` returns True.
+
+        `obj` is the latest state of the object with id `resource_id`,
+        or None if it doesn't exist.  If the predicate raises, the wait
+        is over and the exception is re-raised here.
+
+        :return: The object which satisfied the predicate.
+        :raise WaitTimeout: if the predicate wasn't satisfied in time.
+        """
+        resource, _ = self.wait_with_timestamp(
+            resource_id, predicate, timeout=timeout)
+        return resource
+
+    def wait_with_timestamp(self, resource_id, predicate, timeout=60):
+        """Like `wait`, also returning when the object got to that state.
+
+        :return: A tuple of the object and the time, as from time.time(),
+            the notification about it was received or, without one, of
+            the fetch which found the object in that state.
+        """
+        waiter = Waiter(resource_id, predicate)
+        self._add_waiter(waiter)
+        if not waiter.event.wait(timeout):
+            with self._condition:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+            if not waiter.event.is_set():
+                raise WaitTimeout(
+                    "Timed out waiting for %s" % resource_id)
+        if waiter.error is not None:
+            raise waiter.error
+        return waiter.resource, waiter.timestamp
+
+    def watch(self, resource_id, predicate, timeout=None):
+        """Wait in the background until `predicate(obj)` returns True.
+
+        See `wait_with_timestamp`.
+
+        :return: A Future of a tuple of the object and when it got to
+            that state.  It fails with `WaitTimeout` if the predicate
+            isn't satisfied within `timeout` seconds.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        waiter = Waiter(resource_id, predicate, deadline=deadline)
+        self._add_waiter(waiter)
+        return waiter.future
+
+    def _add_waiter(self, waiter):
+        with self._condition:
+            self._waiters.append(waiter)
+            self._new_ids.add(waiter.resource_id)
+            # Poll promptly for the new object.
+            self.interval = self.min_interval
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+            self._condition.notify()
+
+    def notify(self, resource_id, timestamp=None):
+        """Signal that the object with id `resource_id` changed.
+
+        It is fetched right away if it's being waited for.
+
+        :param timestamp: When the object changed, as from time.time()
+            on this host; defaults to now.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        with self._condition:
+            if not any(
+                    waiter.resource_id == resource_id
+                    for waiter in self._waiters):
+                return
+            self._new_ids.add(resource_id)
+            self._event_times[resource_id] = max(
+                timestamp, self._event_times.get(resource_id, 0))
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._waiters:
+                    # Stop the thread when idle, the next wait starts a
+                    # new one.
+                    self._thread = None
+                    return
+                new_ids = self._new_ids
+                self._new_ids = set()
+                event_times = self._event_times
+                self._event_times = {}
+                old_ids = set(
+                    waiter.resource_id for waiter in self._waiters
+                ).difference(new_ids)
+                since = self._last_tick
+            tick = datetime.datetime.utcnow()
+            tick_time = time.time()
+            changed = {}
+            try:
+                if new_ids:
+                    changed.update(self.fetch(new_ids, None))
+                    self.fetches += 1
+                if old_ids:
+                    changed.update(self.fetch(old_ids, since))
+                    self.fetches += 1
+            except Exception:
+                # Transient API errors shouldn't kill the poller, the
+                # waits time out eventually if they persist.  Fetch the
+                # same changes again next time.
+                with self._condition:
+                    self._new_ids.update(new_ids)
+                    for resource_id, timestamp in event_times.items():
+                        self._event_times.setdefault(resource_id, timestamp)
+            else:
+                with self._condition:
+                    self._last_tick = tick
+            with self._condition:
+                completed = [
+                    waiter for waiter in self._waiters
+                    if waiter.resource_id in changed and
+                    waiter.check(
+                        changed[waiter.resource_id],
+                        event_times.get(waiter.resource_id, tick_time))]
+                for waiter in completed:
+                    self._waiters.remove(waiter)
+                now = time.time()
+                expired = [
+                    waiter for waiter in self._waiters
+                    if waiter.deadline is not None and
+                    waiter.deadline <= now]
+                for waiter in expired:
+                    self._waiters.remove(waiter)
+                    waiter.expire()
+                if self._event_driven():
+                    # Changes are notified, no need to hurry.
+                    self.interval = self.fallback_interval
+                elif completed:
+                    self.interval = self.min_interval
+                else:
+                    self.interval = min(
+                        self.max_interval, self.interval * self.backoff)
+                delay = self.interval * random.uniform(
+                    1 - self.jitter, 1 + self.jitter)
+                deadlines = [
+                    waiter.deadline for waiter in self._waiters
+                    if waiter.deadline is not None]
+                if deadlines:
+                    delay = max(0, min([delay, min(deadlines) - now]))
+                if not self._new_ids:
+                    self._condition.wait(delay)
+
+    def _event_driven(self):
+        if self.fallback_interval is None:
+            return False
+        return self.bus is None or self.bus.connected
+
+
+class ServerPoller(BatchedPoller):
+    """Polls nova servers, as the admin user across all projects.
+
+    Uses the 'changes-since' filter so each tick only returns the
+    servers which changed.
+    """
+
+    def __init__(self, clock_skew=DEFAULT_CLOCK_SKEW, **kwargs):
+        super(ServerPoller, self).__init__(**kwargs)
+        # Seconds to allow for differences between our clock and nova's.
+        self.clock_skew = clock_skew
+
+    @property
+    def nova(self):
+        return get_nova_v3_client(project_name=CONF.admin_project)
+
+    def fetch(self, resource_ids, since):
+        if since is None:
+            servers = {}
+            for server_id in resource_ids:
+                try:
+                    servers[server_id] = self.nova.servers.get(server_id)
+                except novaclient.exceptions.NotFound:
+                    servers[server_id] = None
+            return servers
+        since = since - datetime.timedelta(seconds=self.clock_skew)
+        servers = self.nova.servers.list(search_opts={
+            'all_tenants': True,
+            'changes-since': since.strftime('%Y-%m-%dT%H:%M:%SZ'),
+        })
+        return dict(
+            (server.id, server) for server in servers
+            if server.id in resource_ids)
+
+
+class NeutronPoller(BatchedPoller):
+    """Polls neutron objects, as the admin user across all projects.
+
+    Subclasses set `collection` to the name of the objects, e.g.
+    'routers'.
+    """
+
+    collection = None
+
+    @property
+    def neutron(self):
+        return get_neutron_client(project_name=CONF.admin_project)
+
+    def fetch(self, resource_ids, since):
+        list_resources = getattr(self.neutron, 'list_%s' % self.collection)
+        resources = list_resources(id=list(resource_ids))[self.collection]
+        found = dict((resource['id'], resource) for resource in resources)
+        return dict(
+            (resource_id, found.get(resource_id))
+            for resource_id in resource_ids)
+
+
+class RouterPoller(NeutronPoller):
+    """Polls neutron routers."""
+
+    collection = 'routers'
+
+
+class PortPoller(NeutronPoller):
+    """Polls neutron ports."""
+
+    collection = 'ports'
+
+
+# Maps the types of objects in notifications to their poller.
+POLLER_CLASSES = {
+    'server': ServerPoller,
+    'router': RouterPoller,
+    'port': PortPoller,
+}
+
+
+def _make_poller(cls, bus):
+    config = CONF.get('polling') or {}
+    kwargs = dict(
+        min_interval=config.get('min_interval', DEFAULT_MIN_INTERVAL),
+        max_interval=config.get('max_interval', DEFAULT_MAX_INTERVAL),
+        backoff=config.get('backoff', DEFAULT_BACKOFF),
+        jitter=config.get('jitter', DEFAULT_JITTER))
+    if bus is not None:
+        kwargs['fallback_interval'] = config.get(
+            'fallback_interval', DEFAULT_FALLBACK_INTERVAL)
+        kwargs['bus'] = bus
+    if cls is ServerPoller:
+        kwargs['clock_skew'] = config.get('clock_skew', DEFAULT_CLOCK_SKEW)
+    return cls(**kwargs)
+
+
+_pollers = {}
+_pollers_lock = threading.Lock()
+_subscribed = []
+
+
+def _on_notification(notification):
+    cls = POLLER_CLASSES.get(notification.resource_type)
+    with _pollers_lock:
+        poller = _pollers.get(cls)
+    # Without a poller, nothing is being waited for.  The change is
+    # timed on receipt, by our clock: the notification's timestamp is
+    # by the controller's, which may not agree with ours.
+    if poller is not None:
+        poller.notify(notification.resource_id)
+
+
+def _get_poller(cls):
+    bus = get_notification_bus()
+    with _pollers_lock:
+        if bus is not None and not _subscribed:
+            bus.subscribe(_on_notification)
+            _subscribed.append(bus)
+        if cls not in _pollers:
+            _pollers[cls] = _make_poller(cls, bus)
+        return _pollers[cls]
+
+
+def get_poller(resource_type):
+    """Return the poller shared by all the waits on `resource_type`.
+
+    :param resource_type: One of the keys of `POLLER_CLASSES`.
+    """
+    return _get_poller(POLLER_CLASSES[resource_type])
+
+
+def get_server_poller():
+    """Return the poller shared by all the waits on nova servers."""
+    return get_poller('server')
+
+
+def get_router_poller():
+    """Return the poller shared by all the waits on neutron routers."""
+    return get_poller('router')
+
+
+def get_port_poller():
+    """Return the poller shared by all the waits on neutron ports."""
+    return get_poller('port')
@@ -0,0 +1,169 @@
+# Copyright (C) 2015 Cisco, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Detect when instances accept SSH connections.
+
+Many addresses are probed at once from a single thread using
+non-blocking sockets: each address is repeatedly connected to on the
+SSH port, at sub-second intervals, until the connection succeeds and,
+optionally, the SSH server sends its banner.
+"""
+
+from __future__ import (
+    absolute_import,
+    print_function,
+    unicode_literals,
+    )
+
+str = None
+
+__metaclass__ = type
+__all__ = [
+    'ProbeTimeout',
+    'wait_for_ssh',
+    ]
+
+import errno
+import select
+import socket
+import time
+
+# Defaults for the 'ssh_probe' section of the config.
+DEFAULT_INTERVAL = 0.5
+DEFAULT_TIMEOUT = 300
+DEFAULT_READ_BANNER = True
+
+# Seconds allowed for a single connection attempt.
+ATTEMPT_TIMEOUT = 2
+
+
+class ProbeTimeout(Exception):
+    """Raised when addresses don't accept SSH connections in time.
+
+    The `ready` attribute holds the addresses that did become ready,
+    mapped to the seconds it took.
+    """
+
+    def __init__(self, message, ready):
+        super(ProbeTimeout, self).__init__(message)
+        self.ready = ready
+
+
+class _Attempt:
+    """A connection attempt to an address."""
+
+    def __init__(self, address, port):
+        self.address = address
+        self.started = time.time()
+        self.connected = False
+        self.banner = b''
+        self.sock = socket.socket(
+            socket.AF_INET6 if ':' in address else socket.AF_INET,
+            socket.SOCK_STREAM)
+        self.sock.setblocking(0)
+        error = self.sock.connect_ex((address, port))
+        if error not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            self.sock.close()
+            raise socket.error(error, "Can't connect to %s" % address)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def close(self):
+        self.sock.close()
+
+
+def wait_for_ssh(addresses, port=22, timeout=DEFAULT_TIMEOUT,
+                 interval=DEFAULT_INTERVAL, read_banner=DEFAULT_READ_BANNER):
+    """Wait until all the addresses accept SSH connections.
+
+    :param addresses: IP addresses to probe.
+    :param interval: Seconds between connection attempts to an address.
+    :param read_banner: If True, an address is only ready once the SSH
+        server has sent its banner, not just accepted the connection.
+    :return: A dict mapping each address to the number of seconds it
+        took to become ready.
+    :raise ProbeTimeout: if some addresses weren't ready in time.
+    """
+    start = time.time()
+    deadline = start + timeout
+    ready = {}
+    # Time of the next attempt for the addresses not being connected to.
+    next_attempt = dict((address, start) for address in addresses)
+    attempts = {}
+    try:
+        while next_attempt or attempts:
+            now = time.time()
+            if now >= deadline:
+                raise ProbeTimeout(
+                    "SSH not ready after %s seconds on %s" % (
+                        timeout, ", ".join(
+                            sorted(set(addresses).difference(ready)))),
+                    ready)
+            for address, when in list(next_attempt.items()):
+                if when <= now:
+                    del next_attempt[address]
+                    try:
+                        attempts[address] = _Attempt(address, port)
+                    except socket.error:
+                        next_attempt[address] = now + interval
+            connecting = [a for a in attempts.values() if not a.connected]
+            reading = [a for a in attempts.values() if a.connected]
+            wakeups = [deadline] + list(next_attempt.values()) + [
+                a.started + ATTEMPT_TIMEOUT for a in attempts.values()]
+            wait = max(0, min(wakeups) - time.time())
+            readable, writable, _ = select.select(
+                reading, connecting, [], wait)
+            now = time.time()
+            failed = []
+            for attempt in writable:
+                error = attempt.sock.getsockopt(
+                    socket.SOL_SOCKET, socket.SO_ERROR)
+                if error != 0:
+                    failed.append(attempt)
+                elif read_banner:
+                    attempt.connected = True
+                else:
+                    ready[attempt.address] = now - start
+                    del attempts[attempt.address]
+                    attempt.close()
+            for attempt in readable:
+                try:
+                    data = attempt.sock.recv(256)
+                except socket.error:
+                    data = b''
+                if not data:
+                    failed.append(attempt)
+                    continue
+                attempt.banner += data
+                if attempt.banner.startswith(b'SSH-'):
+                    ready[attempt.address] = now - start
+                    del attempts[attempt.address]
+                    attempt.close()
+                elif len(attempt.banner) >= 4:
+                    failed.append(attempt)
+            failed.extend(
+                attempt for attempt in attempts.values()
+                if attempt not in failed and
+                now - attempt.started >= ATTEMPT_TIMEOUT)
+            for attempt in failed:
+                del attempts[attempt.address]
+                attempt.close()
+                next_attempt[attempt.address] = max(
+                    now, attempt.started + interval)
+    finally:
+        for attempt in attempts.values():
+            attempt.close()
+    return ready
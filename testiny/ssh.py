@@ -0,0 +1,256 @@
+# Copyright (C) 2015 Cisco, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Persistent SSH connections to instances.
+
+Uses OpenSSH connection multiplexing: a master connection is opened
+once per (host, user, key) and kept open, then each command runs as a
+new channel over it, saving a TCP connection and SSH handshake per
+command.  If the master connection can't be opened, commands fall back
+to making their own connection.
+"""
+
+from __future__ import (
+    absolute_import,
+    print_function,
+    unicode_literals,
+    )
+
+str = None
+
+__metaclass__ = type
+__all__ = [
+    'communicate',
+    'SSHConnection',
+    'SSHConnectionPool',
+    'TimeoutError',
+    ]
+
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+# Options used for all the SSH connections to instances.
+SSH_OPTIONS = (
+    '-o', 'UserKnownHostsFile=/dev/null',
+    '-o', 'StrictHostKeyChecking=no',
+    '-o', 'LogLevel=ERROR',
+)
+
+# Seconds allowed to open a master connection.
+MASTER_TIMEOUT = 30
+
+# Seconds between checks that a process with a timeout has exited.
+WAIT_INTERVAL = 0.05
+
+
+class TimeoutError(Exception):
+    """Raised when the timeout is exceeded for an ssh call."""
+
+
+def communicate(process, timeout=None, on_output=None):
+    """Wait for `process` to exit, collecting its output.
+
+    The output is read as it is produced, by one thread per stream, so
+    no CPU is used while waiting.  Once the output is closed, or if the
+    process has none, the process is polled until it exits, so that
+    the timeout holds either way.
+
+    :param timeout: Seconds after which the process is killed and
+        TimeoutError raised.
+    :param on_output: If not None, called with ('stdout', line) or
+        ('stderr', line) for each line of output as it arrives.
+    :return: (stdout, stderr, return_code) where stdout and stderr are
+        lists of lines, as returned by readlines().
+    """
+    output = {'stdout': [], 'stderr': []}
+
+    def read(name, stream):
+        for line in iter(stream.readline, b''):
+            output[name].append(line)
+            if on_output is not None:
+                on_output(name, line)
+        stream.close()
+
+    readers = [
+        threading.Thread(target=read, args=(name, getattr(process, name)))
+        for name in ('stdout', 'stderr')
+        if getattr(process, name) is not None
+    ]
+    for reader in readers:
+        reader.daemon = True
+        reader.start()
+    deadline = None if timeout is None else time.time() + timeout
+    for reader in readers:
+        reader.join(None if deadline is None else max(
+            0, deadline - time.time()))
+        if reader.is_alive():
+            _kill(process, timeout)
+    if deadline is not None:
+        # The process may have no output to read, or have closed it
+        # without exiting.
+        while process.poll() is None:
+            if time.time() >= deadline:
+                _kill(process, timeout)
+            time.sleep(WAIT_INTERVAL)
+    return output['stdout'], output['stderr'], process.wait()
+
+
+def _kill(process, timeout):
+    process.kill()
+    process.wait()
+    raise TimeoutError("Command timed out after %s seconds" % timeout)
+
+
+class SSHConnection:
+    """A multiplexed SSH connection to a host.
+
+    :param prefix: List of arguments to prefix the ssh command with,
+        e.g. to run it in a network namespace.
+    :param options: List of additional ssh options, e.g. a
+        ProxyCommand.
+    :param control_path: Path of the master connection's control socket.
+    """
+
+    def __init__(self, host, user_name, key_file_name, control_path,
+                 prefix=(), options=()):
+        self.host = host
+        self.user_name = user_name
+        self.key_file_name = key_file_name
+        self.control_path = control_path
+        self.prefix = list(prefix)
+        self.options = list(options)
+        self._lock = threading.Lock()
+
+    def _ssh_args(self, *options):
+        options = list(SSH_OPTIONS) + self.options + list(options)
+        return self.prefix + ['ssh'] + options + [
+            '-i', self.key_file_name,
+            '-o', 'ControlPath=%s' % self.control_path,
+            "%s@%s" % (self.user_name, self.host),
+        ]
+
+    @property
+    def is_open(self):
+        return os.path.exists(self.control_path)
+
+    def open(self):
+        """Open the master connection, unless already open.
+
+        Returns True if it is open.  Failing to open it isn't an error:
+        commands then connect by themselves.
+        """
+        with self._lock:
+            if self.is_open:
+                return True
+            with open(os.devnull, 'wb') as devnull:
+                master = subprocess.Popen(
+                    self._ssh_args(
+                        '-o', 'ControlMaster=yes',
+                        '-o', 'ControlPersist=yes',
+                        '-o', 'ConnectTimeout=%d' % MASTER_TIMEOUT,
+                        '-N', '-f'),
+                    stdin=devnull, stdout=devnull, stderr=devnull)
+            # With -f, ssh goes to the background once connected.
+            try:
+                communicate(master, timeout=MASTER_TIMEOUT)
+            except TimeoutError:
+                return False
+            return self.is_open
+
+    def popen(self, command, tty=False):
+        """Start running `command` on the host, returning a Popen.
+
+        :param tty: Force a tty allocation, so that the remote command
+            gets a SIGHUP if the connection is closed.
+        """
+        self.open()
+        options = ['-o', 'ControlMaster=no']
+        if tty:
+            options.append('-tt')
+        return subprocess.Popen(
+            self._ssh_args(*options) + [command],
+            shell=False,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE)
+
+    def run(self, command, timeout=None, on_output=None):
+        """Run `command` on the host.
+
+        See `communicate` for the arguments and return value.
+        """
+        return communicate(
+            self.popen(command), timeout=timeout, on_output=on_output)
+
+    def close(self):
+        """Close the master connection."""
+        with self._lock:
+            if not self.is_open:
+                return
+            with open(os.devnull, 'wb') as devnull:
+                subprocess.call(
+                    self._ssh_args('-O', 'exit'),
+                    stdout=devnull, stderr=devnull)
+
+
+class SSHConnectionPool:
+    """SSH connections keyed on (host, user, key, prefix, options).
+
+    Intended to live as long as the fixture owning it; call `close` to
+    close all the connections.
+    """
+
+    def __init__(self):
+        self._connections = {}
+        self._lock = threading.Lock()
+        self._control_dir = None
+
+    def get(self, host, user_name, key_file_name, prefix=(), options=()):
+        """Return the connection for the given parameters.
+
+        The master connection is opened lazily, when running the first
+        command.
+        """
+        key = (
+            host, user_name, key_file_name, tuple(prefix), tuple(options))
+        with self._lock:
+            connection = self._connections.get(key)
+            if connection is None:
+                if self._control_dir is None:
+                    # Keep the path short, unix sockets paths are
+                    # limited to about 100 characters.
+                    self._control_dir = tempfile.mkdtemp(
+                        prefix='testiny-ssh-')
+                connection = SSHConnection(
+                    host, user_name, key_file_name,
+                    os.path.join(
+                        self._control_dir, '%d' % len(self._connections)),
+                    prefix=prefix, options=options)
+                self._connections[key] = connection
+            return connection
+
+    def close(self):
+        """Close all the connections."""
+        with self._lock:
+            connections = list(self._connections.values())
+            self._connections = {}
+            control_dir, self._control_dir = self._control_dir, None
+        for connection in connections:
+            connection.close()
+        if control_dir is not None:
+            shutil.rmtree(control_dir, ignore_errors=True)
@@ -0,0 +1,264 @@
+# Copyright (C) 2015 Cisco, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Allocation of subnet CIDRs, shared by all the processes on a host.
+
+Subnets are carved out of a pool, e.g. /24s out of a /12 or /64s out of
+an IPv6 /48.  The allocations of each pool are recorded in a state file,
+guarded by a file lock, so that parallel test runner processes never
+hand out the same CIDR.  Each allocation records the pid of the process
+which made it; the allocations of processes which are no longer running
+are reclaimed, so a crashed worker doesn't leak subnets.
+"""
+
+from __future__ import (
+    absolute_import,
+    print_function,
+    unicode_literals,
+    )
+
+str = None
+
+__metaclass__ = type
+__all__ = [
+    'get_subnet_allocator',
+    'PoolExhausted',
+    'SubnetAllocator',
+    ]
+
+from contextlib import contextmanager
+import errno
+import fcntl
+import json
+import os
+import re
+import tempfile
+import threading
+
+from netaddr import (
+    IPAddress,
+    IPNetwork,
+)
+from testiny.config import CONF
+
+# Defaults for the subnet pools in the 'network' section of the config.
+DEFAULT_SUBNET_PREFIXLEN = 24
+DEFAULT_IPV6_SUBNET_POOL = 'fd00:7e57::/48'
+DEFAULT_IPV6_SUBNET_PREFIXLEN = 64
+
+# Subnet numbers handed out when the pool is given by the old 'cidr'
+# template, e.g. 10.1.{subnet}.0/24.
+LEGACY_SUBNET_ID_MIN = 11
+LEGACY_SUBNET_ID_MAX = 254
+
+
+class PoolExhausted(Exception):
+    """Raised when all the subnets of a pool are allocated."""
+
+
+def _pid_is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+class SubnetAllocator:
+    """Allocates the subnets of a pool, across processes.
+
+    :param pool: CIDR of the pool, e.g. '10.128.0.0/12'.
+    :param prefixlen: Prefix length of the allocated subnets.
+    :param state_dir: Directory holding the state and lock files, shared
+        by all the processes using the pool.
+    :param first: Index of the first subnet of the pool to hand out.
+    :param last: Index of the last subnet of the pool to hand out,
+        defaults to the last one.
+    """
+
+    def __init__(self, pool, prefixlen, state_dir=None, first=0, last=None):
+        self.pool = IPNetwork(pool)
+        self.prefixlen = prefixlen
+        if prefixlen < self.pool.prefixlen:
+            raise ValueError(
+                "Can't allocate /%d subnets from %s" % (prefixlen, pool))
+        if state_dir is None:
+            state_dir = os.path.join(tempfile.gettempdir(), 'testiny-subnets')
+        if not os.path.isdir(state_dir):
+            try:
+                os.makedirs(state_dir)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        name = re.sub(r'[^0-9a-fA-F]', '_', '%s_%d' % (self.pool, prefixlen))
+        self.state_file = os.path.join(state_dir, name + '.json')
+        self.lock_file = os.path.join(state_dir, name + '.lock')
+        self.first = first
+        self.last = self.capacity - 1 if last is None else last
+
+    @property
+    def capacity(self):
+        """Number of subnets in the pool."""
+        return 2 ** (self.prefixlen - self.pool.prefixlen)
+
+    @property
+    def size(self):
+        """Number of subnets handed out by this allocator."""
+        return self.last - self.first + 1
+
+    def cidr(self, index):
+        """Return the CIDR of the subnet at `index` in the pool."""
+        host_bits = (
+            128 if self.pool.version == 6 else 32) - self.prefixlen
+        network = IPAddress(
+            self.pool.first + (index << host_bits), self.pool.version)
+        return '%s/%d' % (network, self.prefixlen)
+
+    def index(self, cidr):
+        """Return the index in the pool of the subnet `cidr`."""
+        host_bits = (
+            128 if self.pool.version == 6 else 32) - self.prefixlen
+        return (IPNetwork(cidr).first - self.pool.first) >> host_bits
+
+    @contextmanager
+    def _locked_state(self):
+        # Each call opens the lock file anew, so flock() excludes the
+        # other threads of this process as well as other processes.
+        with open(self.lock_file, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                state = self._read_state()
+                yield state
+                self._write_state(state)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read_state(self):
+        try:
+            with open(self.state_file) as f:
+                allocated = json.load(f)['allocated']
+        except (IOError, OSError, ValueError, KeyError):
+            allocated = {}
+        # JSON keys are strings.
+        return dict(
+            (int(index), pid) for index, pid in allocated.items())
+
+    def _write_state(self, state):
+        # Written to a temporary file then renamed, so the state file is
+        # never left half-written.
+        temp_file = '%s.%d' % (self.state_file, os.getpid())
+        with open(temp_file, 'w') as f:
+            json.dump({'allocated': dict(
+                ('%d' % index, pid) for index, pid in state.items())}, f)
+        os.rename(temp_file, self.state_file)
+
+    @staticmethod
+    def _reclaim(state):
+        pids = set(state.values())
+        dead = set(pid for pid in pids if not _pid_is_running(pid))
+        for index, pid in list(state.items()):
+            if pid in dead:
+                del state[index]
+
+    def allocate(self):
+        """Allocate a subnet, returning its CIDR.
+
+        :raise PoolExhausted: if all the subnets are in use.
+        """
+        [cidr] = self.allocate_many(1)
+        return cidr
+
+    def allocate_many(self, count):
+        """Allocate `count` subnets at once, returning their CIDRs.
+
+        :raise PoolExhausted: if there aren't enough free subnets, in
+            which case none is allocated.
+        """
+        indexes = []
+        with self._locked_state() as state:
+            self._reclaim(state)
+            index = self.first
+            while len(indexes) < count and index <= self.last:
+                if index not in state:
+                    indexes.append(index)
+                index += 1
+            if len(indexes) < count:
+                raise PoolExhausted(
+                    "Not enough free subnets of %s for %d more: %d of %d "
+                    "in use" % (self.pool, count, len(state), self.size))
+            pid = os.getpid()
+            for index in indexes:
+                state[index] = pid
+        return [self.cidr(index) for index in indexes]
+
+    def release(self, *cidrs):
+        """Release subnets allocated with `allocate`."""
+        with self._locked_state() as state:
+            for cidr in cidrs:
+                state.pop(self.index(cidr), None)
+
+    def usage(self):
+        """Return the utilisation of the pool.
+
+        Returns a dict with the number of subnets 'used' and 'total', and
+        the number used by each process in 'by_pid'.
+        """
+        by_pid = {}
+        with self._locked_state() as state:
+            self._reclaim(state)
+            for pid in state.values():
+                by_pid[pid] = by_pid.get(pid, 0) + 1
+        return {'used': len(state), 'total': self.size, 'by_pid': by_pid}
+
+    def format_usage(self):
+        usage = self.usage()
+        return "%d of %d subnets of %s in use (%.1f%%)" % (
+            usage['used'], usage['total'], self.pool,
+            100.0 * usage['used'] / usage['total'])
+
+
+def _make_allocator(ip_version):
+    config = CONF.network
+    state_dir = config.get('subnet_state_dir')
+    if ip_version == 6:
+        return SubnetAllocator(
+            config.get('ipv6_subnet_pool', DEFAULT_IPV6_SUBNET_POOL),
+            config.get(
+                'ipv6_subnet_prefixlen', DEFAULT_IPV6_SUBNET_PREFIXLEN),
+            state_dir=state_dir)
+    if 'subnet_pool' in config:
+        return SubnetAllocator(
+            config['subnet_pool'],
+            config.get('subnet_prefixlen', DEFAULT_SUBNET_PREFIXLEN),
+            state_dir=state_dir)
+    # The old 'cidr' template substitutes the subnet number in the
+    # octet just above the prefix.
+    template = IPNetwork(config['cidr'].format(subnet=0))
+    return SubnetAllocator(
+        template.supernet(template.prefixlen - 8)[0], template.prefixlen,
+        state_dir=state_dir, first=LEGACY_SUBNET_ID_MIN,
+        last=LEGACY_SUBNET_ID_MAX)
+
+
+_allocators = {}
+_allocators_lock = threading.Lock()
+
+
+def get_subnet_allocator(ip_version=4):
+    """Return the allocator for the configured pool of `ip_version`."""
+    with _allocators_lock:
+        if ip_version not in _allocators:
+            _allocators[ip_version] = _make_allocator(ip_version)
+        return _allocators[ip_version]
@@ -0,0 +1,227 @@
+# Copyright (C) 2015 Cisco, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Run interdependent tasks with as much parallelism as possible.
+
+Tasks are added to a graph along with the names of the tasks they
+depend on.  Running the graph starts every task as soon as all its
+dependencies have completed, and records when each task ran so that
+the critical path (the chain of tasks that bounded the total run time)
+can be reported.
+"""
+
+from __future__ import (
+    absolute_import,
+    print_function,
+    unicode_literals,
+    )
+
+str = None
+
+__metaclass__ = type
+__all__ = [
+    'FixtureGraph',
+    'TaskGraph',
+    ]
+
+from collections import OrderedDict
+from concurrent import futures
+import time
+
+from testiny.async_clients import DEFAULT_MAX_WORKERS
+from testiny.config import CONF
+
+
+class TaskGraph:
+    """A set of tasks and their dependencies."""
+
+    def __init__(self, max_workers=None):
+        if max_workers is None:
+            config = CONF.get('concurrency') or {}
+            max_workers = config.get('max_workers', DEFAULT_MAX_WORKERS)
+        self.max_workers = max_workers
+        self.tasks = OrderedDict()
+        self.results = {}
+        self.timings = {}
+        # Names of the tasks that succeeded, in the order they
+        # completed.  This is always a topological order.
+        self.completed = []
+
+    def __contains__(self, name):
+        return name in self.tasks
+
+    def add(self, name, func, depends_on=()):
+        """Add a task.
+
+        :param name: Unique name of the task.
+        :param func: Callable run, with no arguments, to perform the task.
+            Its return value ends up in `results`.
+        :param depends_on: Names of the tasks, already added, which must
+            complete before this one starts.
+        """
+        if name in self.tasks:
+            raise ValueError("Task %s already in the graph" % name)
+        for dependency in depends_on:
+            if dependency not in self.tasks:
+                raise ValueError(
+                    "Task %s depends on unknown task %s" % (name, dependency))
+        # Since dependencies must already be present, the graph can't
+        # have cycles.
+        self.tasks[name] = (func, tuple(depends_on))
+
+    def run(self):
+        """Run all the tasks, returning the `results` dict.
+
+        If a task fails, no new task is started, the running ones are
+        waited for and the first failure is re-raised.
+        """
+        pending = OrderedDict(self.tasks)
+        running = {}
+        failure = None
+        executor = futures.ThreadPoolExecutor(
+            max_workers=max(1, min(self.max_workers, len(self.tasks))))
+        try:
+            while pending or running:
+                if failure is None:
+                    for name, (func, depends_on) in list(pending.items()):
+                        if all(dep in self.results for dep in depends_on):
+                            del pending[name]
+                            running[executor.submit(
+                                self._run_task, name, func)] = name
+                if not running:
+                    break
+                done, _ = futures.wait(
+                    running, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        self.results[name] = future.result()
+                    except Exception as e:
+                        if failure is None:
+                            failure = e
+                    else:
+                        self.completed.append(name)
+        finally:
+            executor.shutdown(wait=True)
+        if failure is not None:
+            raise failure
+        return self.results
+
+    def _run_task(self, name, func):
+        start = time.time()
+        try:
+            return func()
+        finally:
+            self.timings[name] = (start, time.time())
+
+    def critical_path(self):
+        """Return the names of the tasks on the critical path, in order.
+
+        Starting from the last task to finish, walk back through the
+        dependency of each task that finished last: that is the one
+        which held it back.
+        """
+        finished = [name for name in self.completed if name in self.timings]
+        if not finished:
+            return []
+        path = [max(finished, key=lambda name: self.timings[name][1])]
+        while True:
+            depends_on = self.tasks[path[-1]][1]
+            if not depends_on:
+                break
+            path.append(
+                max(depends_on, key=lambda name: self.timings[name][1]))
+        path.reverse()
+        return path
+
+    def format_critical_path(self):
+        """Return a readable description of the critical path."""
+        path = self.critical_path()
+        if not path:
+            return "No task completed"
+        total = self.timings[path[-1]][1] - min(
+            start for start, _ in self.timings.values())
+        return "%s (total %.2fs)" % (
+            " -> ".join(
+                "%s (%.2fs)" % (name, end - start)
+                for name in path
+                for start, end in [self.timings[name]]),
+            total)
+
+    def format_timings(self):
+        """Return a readable description of when each task ran.
+
+        Tasks are listed in the order they were added, with their start
+        time relative to the start of the first task, and duration.
+        """
+        if not self.timings:
+            return "No task ran"
+        started = min(start for start, _ in self.timings.values())
+        return "\n".join(
+            "%s: started at +%.2fs, took %.2fs" % (
+                name, start - started, end - start)
+            for name in self.tasks if name in self.timings
+            for start, end in [self.timings[name]])
+
+
+class FixtureGraph(TaskGraph):
+    """A TaskGraph whose tasks set up fixtures.
+
+    Use `set_up` rather than `run`: it registers the cleanups of the
+    fixtures that were set up on a parent fixture, as `useFixture`
+    would have done.  They are registered in the order the fixtures
+    were added to the graph, so they run in the reverse order: add the
+    fixtures in the order they would be set up serially.
+    """
+
+    def __init__(self, max_workers=None):
+        super(FixtureGraph, self).__init__(max_workers=max_workers)
+        self.fixture_tasks = set()
+
+    def add_fixture(self, name, make_fixture, depends_on=()):
+        """Add a task setting up a fixture.
+
+        :param make_fixture: Callable returning the fixture to set up.
+            It is only called once the dependencies are set up, so it can
+            refer to their results.
+        """
+        def set_up_fixture():
+            fixture = make_fixture()
+            fixture.setUp()
+            return fixture
+
+        self.add(name, set_up_fixture, depends_on=depends_on)
+        self.fixture_tasks.add(name)
+
+    def set_up(self, parent):
+        """Run the graph, making the fixtures used by `parent`.
+
+        Cleanups are registered even if a task fails, so that the
+        fixtures already set up are cleaned up with `parent`.
+        """
+        try:
+            return self.run()
+        finally:
+            for name in self.tasks:
+                if name not in self.fixture_tasks:
+                    continue
+                if name not in self.completed:
+                    continue
+                fixture = self.results[name]
+                parent.addCleanup(fixture.cleanUp)
+                # As done by useFixture, so that the parent's details
+                # include the child's.
+                if getattr(parent, '_detail_sources', None) is not None:
+                    parent._detail_sources.append(fixture)
@@ -0,0 +1,213 @@
+# Copyright (C) 2015 Cisco, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Background teardown of the Openstack objects created by fixtures.
+
+When enabled in the config, fixture cleanups that delete Openstack
+objects are handed off to a pool of worker threads instead of running
+in the test's thread, so the test result is reported without waiting
+for the deletions.
+
+Each cleanup has a rank, in the order the objects must be deleted:
+servers before ports, before subnets, before networks, before
+projects.  A cleanup doesn't start until all the cleanups of a lower
+rank scheduled before it are done.
+
+All pending cleanups are waited for when the process exits, and the
+ones which failed are reported.
+"""
+
+from __future__ import (
+    absolute_import,
+    print_function,
+    unicode_literals,
+    )
+
+str = None
+
+__metaclass__ = type
+__all__ = [
+    'add_teardown',
+    'get_teardown_engine',
+    'TEARDOWN_NETWORK',
+    'TEARDOWN_PORT',
+    'TEARDOWN_PROJECT',
+    'TEARDOWN_SERVER',
+    'TEARDOWN_SUBNET',
+    'TeardownEngine',
+    ]
+
+import atexit
+from concurrent import futures
+import sys
+import threading
+import time
+
+from testiny.config import CONF
+
+# Teardown ranks.
+TEARDOWN_SERVER = 0
+TEARDOWN_PORT = 1
+TEARDOWN_SUBNET = 2
+TEARDOWN_NETWORK = 3
+TEARDOWN_PROJECT = 4
+
+# Defaults for the 'teardown' section of the config.
+DEFAULT_BACKGROUND = False
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_CONFLICT_RETRIES = 5
+DEFAULT_CONFLICT_DELAY = 2
+
+
+def is_conflict(error):
+    """Return True if `error` is an HTTP 409 Conflict from an API client.
+
+    The keystone, nova and neutron clients don't agree on where to put
+    the status code.
+    """
+    for attribute in ('status_code', 'http_status', 'code'):
+        if getattr(error, attribute, None) == 409:
+            return True
+    return False
+
+
+class TeardownEngine:
+    """Runs cleanups on a pool of worker threads, in rank order."""
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS,
+                 conflict_retries=DEFAULT_CONFLICT_RETRIES,
+                 conflict_delay=DEFAULT_CONFLICT_DELAY):
+        self.conflict_retries = conflict_retries
+        self.conflict_delay = conflict_delay
+        self.executor = futures.ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.Lock()
+        # (rank, description, future) of the cleanups not yet
+        # reported by barrier().
+        self._scheduled = []
+
+    def schedule(self, rank, func, *args, **kwargs):
+        """Schedule `func(*args, **kwargs)` to run in the background.
+
+        Returns a Future for its result.  Once the interpreter is
+        shutting down, e.g. from an atexit handler, the worker pool
+        doesn't take new work: `func` then runs right away, in the
+        calling thread.
+        """
+        description = getattr(func, '__name__', repr(func))
+        owner = getattr(func, '__self__', None)
+        if owner is not None:
+            description = "%s.%s" % (type(owner).__name__, description)
+        inline = False
+        with self._lock:
+            # Workers pick up cleanups in the order they are scheduled,
+            # so the ones waited for here are already running or done.
+            depends_on = [
+                future for other_rank, _, future in self._scheduled
+                if other_rank < rank and not future.done()]
+            try:
+                future = self.executor.submit(
+                    self._run, depends_on, func, args, kwargs)
+            except RuntimeError:
+                future = futures.Future()
+                inline = True
+            self._scheduled.append((rank, description, future))
+        if inline:
+            try:
+                future.set_result(self._run(depends_on, func, args, kwargs))
+            except Exception as e:
+                future.set_exception(e)
+        return future
+
+    def _run(self, depends_on, func, args, kwargs):
+        futures.wait(depends_on)
+        attempt = 0
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                if not is_conflict(e) or attempt >= self.conflict_retries:
+                    raise
+                # Something still uses the object, e.g. a port on a
+                # subnet that is being deleted; give it time to go away.
+                time.sleep(self.conflict_delay * 2 ** attempt)
+                attempt += 1
+
+    def barrier(self, timeout=None):
+        """Wait for all the scheduled cleanups to be done.
+
+        Returns a list of (description, exception) for the cleanups
+        which failed since the last call.
+        """
+        with self._lock:
+            scheduled, self._scheduled = self._scheduled, []
+        futures.wait(
+            [future for _, _, future in scheduled], timeout=timeout)
+        failures = []
+        for _, description, future in scheduled:
+            if not future.done():
+                failures.append(
+                    (description, futures.TimeoutError("Still running")))
+            elif future.exception() is not None:
+                failures.append((description, future.exception()))
+        return failures
+
+    def report(self, stream=None):
+        """Wait for all the scheduled cleanups, reporting the failures."""
+        if stream is None:
+            stream = sys.stderr
+        failures = self.barrier()
+        for description, error in failures:
+            print(
+                "Teardown %s failed: %s" % (description, error), file=stream)
+        return failures
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_teardown_engine():
+    """Return the TeardownEngine, or None if not enabled in the config."""
+    global _engine
+
+    config = CONF.get('teardown') or {}
+    if not config.get('background', DEFAULT_BACKGROUND):
+        return None
+    with _engine_lock:
+        if _engine is None:
+            _engine = TeardownEngine(
+                max_workers=config.get('max_workers', DEFAULT_MAX_WORKERS),
+                conflict_retries=config.get(
+                    'conflict_retries', DEFAULT_CONFLICT_RETRIES),
+                conflict_delay=config.get(
+                    'conflict_delay', DEFAULT_CONFLICT_DELAY))
+            # The run-end barrier.
+            atexit.register(_engine.report)
+        return _engine
+
+
+def add_teardown(fixture, rank, func, *args, **kwargs):
+    """Add a cleanup to `fixture` which deletes an Openstack object.
+
+    The cleanup runs in the background if enabled in the config,
+    otherwise it is a regular cleanup.
+
+    :param rank: One of the TEARDOWN_* constants.
+    """
+    engine = get_teardown_engine()
+    if engine is None:
+        fixture.addCleanup(func, *args, **kwargs)
+    else:
+        fixture.addCleanup(engine.schedule, rank, func, *args, **kwargs)
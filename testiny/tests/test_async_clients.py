@@ -0,0 +1,77 @@
+# Copyright (C) 2015 Cisco, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Tests for the shared worker pool."""
+
+from __future__ import (
+    absolute_import,
+    print_function,
+    unicode_literals,
+    )
+
+str = None
+
+__metaclass__ = type
+__all__ = []
+
+from concurrent import futures
+import threading
+import time
+
+from testiny.async_clients import wait_all
+from testiny.testcase import TestinyTestCase
+
+
+class TestWaitAll(TestinyTestCase):
+
+    def make_executor(self):
+        executor = futures.ThreadPoolExecutor(max_workers=4)
+        self.addCleanup(executor.shutdown)
+        return executor
+
+    def test_returns_results_in_order(self):
+        executor = self.make_executor()
+        fs = [
+            executor.submit(time.sleep, 0.1),
+            executor.submit(lambda: 'second'),
+        ]
+        self.assertEqual([None, 'second'], wait_all(fs))
+
+    def test_raises_first_exception_once_all_done(self):
+        executor = self.make_executor()
+        release = threading.Event()
+
+        def fail(message, wait=False):
+            if wait:
+                release.wait(5)
+            raise ValueError(message)
+
+        slow = executor.submit(fail, 'first', wait=True)
+        fast = executor.submit(fail, 'second')
+        straggler = executor.submit(time.sleep, 0.2)
+        threading.Timer(0.1, release.set).start()
+        error = self.assertRaises(
+            ValueError, wait_all, [slow, fast, straggler])
+        self.assertEqual('first', '%s' % error)
+        self.assertTrue(straggler.done())
+
+    def test_times_out(self):
+        executor = self.make_executor()
+        release = threading.Event()
+        self.addCleanup(release.set)
+        pending = executor.submit(release.wait, 5)
+        done = executor.submit(lambda: None)
+        self.assertRaises(
+            futures.TimeoutError, wait_all, [done, pending], timeout=0.1)
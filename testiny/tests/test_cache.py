@@ -0,0 +1,139 @@
+# Copyright (C) 2015 Cisco, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Tests for the lookup cache."""
+
+from __future__ import (
+    absolute_import,
+    print_function,
+    unicode_literals,
+    )
+
+str = None
+
+__metaclass__ = type
+__all__ = []
+
+from concurrent import futures
+import threading
+
+import mock
+from testiny import cache
+from testiny.cache import (
+    call_with_lookup,
+    find_network,
+    lookup,
+    TTLCache,
+)
+from testiny.testcase import TestinyTestCase
+
+
+class NotFound(Exception):
+    http_status = 404
+
+
+class TestTTLCache(TestinyTestCase):
+
+    def test_caches_until_expiry(self):
+        ttl_cache = TTLCache(ttl=60)
+        time = mock.Mock(return_value=1000)
+        self.patch(cache.time, 'time', time)
+        create = mock.Mock(side_effect=['old', 'new'])
+        self.assertEqual('old', ttl_cache.get('key', create))
+        time.return_value = 1059
+        self.assertEqual('old', ttl_cache.get('key', create))
+        time.return_value = 1060
+        self.assertEqual('new', ttl_cache.get('key', create))
+        self.assertEqual((1, 2), (ttl_cache.hits, ttl_cache.misses))
+
+    def test_does_not_cache_exceptions(self):
+        ttl_cache = TTLCache()
+        create = mock.Mock(side_effect=[NotFound(), 'value'])
+        self.assertRaises(NotFound, ttl_cache.get, 'key', create)
+        self.assertEqual('value', ttl_cache.get('key', create))
+
+    def test_concurrent_misses_look_up_once(self):
+        ttl_cache = TTLCache()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def create():
+            calls.append(None)
+            started.set()
+            release.wait(10)
+            return 'value'
+
+        with futures.ThreadPoolExecutor(4) as executor:
+            first = executor.submit(ttl_cache.get, 'key', create)
+            started.wait(10)
+            others = [
+                executor.submit(ttl_cache.get, 'key', create)
+                for _ in range(3)]
+            release.set()
+            results = [f.result() for f in [first] + others]
+        self.assertEqual(['value'] * 4, results)
+        self.assertEqual(1, len(calls))
+
+    def test_invalidate(self):
+        ttl_cache = TTLCache()
+        create = mock.Mock(side_effect=['old', 'new'])
+        ttl_cache.get('key', create)
+        ttl_cache.invalidate('key')
+        self.assertEqual('new', ttl_cache.get('key', create))
+
+
+class TestLookup(TestinyTestCase):
+
+    def setUp(self):
+        super(TestLookup, self).setUp()
+        self.patch(cache, '_cache', TTLCache())
+
+    def test_keyed_by_endpoint(self):
+        conf = mock.Mock()
+        self.patch(cache, 'CONF', conf)
+        conf.auth_url = 'http://one:5000/v3'
+        self.assertEqual('a', lookup('flavor', 'm1.tiny', lambda: 'a'))
+        self.assertEqual('a', lookup('flavor', 'm1.tiny', lambda: 'b'))
+        conf.auth_url = 'http://two:5000/v3'
+        self.assertEqual('b', lookup('flavor', 'm1.tiny', lambda: 'b'))
+
+    def test_call_with_lookup_retries_on_404(self):
+        find = mock.Mock(side_effect=['stale', 'fresh'])
+        func = mock.Mock(side_effect=[NotFound(), 'done'])
+        self.assertEqual(
+            'done', call_with_lookup('role', 'Member', find, func))
+        self.assertEqual(
+            [mock.call('stale'), mock.call('fresh')], func.call_args_list)
+        self.assertEqual(
+            'fresh', lookup('role', 'Member', mock.Mock()))
+
+    def test_call_with_lookup_raises_other_errors(self):
+        func = mock.Mock(side_effect=ValueError())
+        self.assertRaises(
+            ValueError, call_with_lookup, 'role', 'Member',
+            lambda: 'role', func)
+        self.assertEqual(1, func.call_count)
+
+    def test_find_network_not_found_is_not_cached(self):
+        neutron = mock.Mock()
+        neutron.list_networks.side_effect = [
+            {'networks': []}, {'networks': [{'id': 'public-id'}]}]
+        self.assertIsNone(find_network(neutron, 'public'))
+        self.assertEqual(
+            {'id': 'public-id'}, find_network(neutron, 'public'))
+        self.assertEqual(
+            {'id': 'public-id'}, find_network(neutron, 'public'))
+        self.assertEqual(2, neutron.list_networks.call_count)
@@ -0,0 +1,109 @@
+# Copyright (C) 2015 Cisco, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Tests for the Openstack API client helpers."""
+
+from __future__ import (
+    absolute_import,
+    print_function,
+    unicode_literals,
+    )
+
+str = None
+
+__metaclass__ = type
+__all__ = []
+
+import mock
+from testiny.clients import (
+    ClientRegistry,
+    SessionCache,
+)
+from testiny.testcase import TestinyTestCase
+
+
+def make_session(expiring=False):
+    sess = mock.Mock()
+    sess.auth.auth_ref.will_expire_soon.return_value = expiring
+    return sess
+
+
+class TestSessionCache(TestinyTestCase):
+
+    def test_caches_sessions(self):
+        cache = SessionCache()
+        sess = make_session()
+        self.assertIs(sess, cache.get_or_create('key', lambda: sess))
+        self.assertIs(sess, cache.get_or_create('key', make_session))
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(1, cache.misses)
+
+    def test_evicts_least_recently_used(self):
+        cache = SessionCache(maxsize=2)
+        evicted = []
+        cache.add_eviction_listener(evicted.append)
+        first = cache.get_or_create('first', make_session)
+        cache.get_or_create('second', make_session)
+        # Using 'first' makes 'second' the least recently used.
+        cache.get_or_create('first', make_session)
+        cache.get_or_create('third', make_session)
+        self.assertEqual(2, len(cache))
+        self.assertEqual(1, cache.evictions)
+        self.assertIs(first, cache.get_or_create('first', make_session))
+        self.assertEqual(1, len(evicted))
+
+    def test_invalidates_expiring_sessions(self):
+        cache = SessionCache(expiry_margin=60)
+        sess = cache.get_or_create('key', lambda: make_session(True))
+        cache.get_or_create('key', make_session)
+        sess.auth.auth_ref.will_expire_soon.assert_called_once_with(
+            stale_duration=60)
+        sess.auth.invalidate.assert_called_once_with()
+        self.assertEqual(1, cache.expired)
+
+    def test_discard_drops_matching_sessions(self):
+        cache = SessionCache()
+        cache.get_or_create(('user', 'project'), make_session)
+        cache.get_or_create(('other', 'project2'), make_session)
+        self.assertEqual(1, cache.discard(lambda key: key[0] == 'user'))
+        self.assertEqual(
+            {'size': 1, 'hits': 0, 'misses': 2, 'expired': 0,
+             'evictions': 0},
+            cache.stats())
+
+
+class TestClientRegistry(TestinyTestCase):
+
+    def test_returns_same_client_for_same_session(self):
+        registry = ClientRegistry()
+        sess = make_session()
+        nova = registry.get_or_create(sess, 'nova', '2', mock.Mock)
+        self.assertIs(
+            nova, registry.get_or_create(sess, 'nova', '2', mock.Mock))
+        self.assertIsNot(
+            nova, registry.get_or_create(sess, 'neutron', '2.0', mock.Mock))
+        self.assertIsNot(
+            nova, registry.get_or_create(
+                make_session(), 'nova', '2', mock.Mock))
+
+    def test_session_eviction_invalidates_clients(self):
+        cache = SessionCache(maxsize=1)
+        registry = ClientRegistry()
+        cache.add_eviction_listener(registry.invalidate)
+        sess = cache.get_or_create('first', make_session)
+        nova = registry.get_or_create(sess, 'nova', '2', mock.Mock)
+        cache.get_or_create('second', make_session)
+        self.assertIsNot(
+            nova, registry.get_or_create(sess, 'nova', '2', mock.Mock))
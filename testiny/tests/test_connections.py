@@ -0,0 +1,114 @@
+# Copyright (C) 2015 Cisco, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Tests for the shared HTTP connection pool.
+
+The counting pools hook into urllib3 internals, so they are checked
+against a real local HTTP server.
+"""
+
+from __future__ import (
+    absolute_import,
+    print_function,
+    unicode_literals,
+    )
+
+str = None
+
+__metaclass__ = type
+__all__ = []
+
+import threading
+import time
+
+from six.moves import (
+    BaseHTTPServer,
+    socketserver,
+)
+from testiny import connections
+from testiny.connections import (
+    make_http_session,
+    PoolStats,
+)
+from testiny.testcase import TestinyTestCase
+
+
+class KeepAliveHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path == '/slow':
+            time.sleep(0.2)
+        body = b'ok'
+        self.send_response(200)
+        self.send_header('Content-Length', '%d' % len(body))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingHTTPServer(
+        socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+
+class TestSharedHTTPAdapter(TestinyTestCase):
+
+    def setUp(self):
+        super(TestSharedHTTPAdapter, self).setUp()
+        self.stats = PoolStats()
+        self.patch(connections, 'pool_stats', self.stats)
+        server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.url = 'http://127.0.0.1:%d' % server.server_address[1]
+
+    def make_session(self, **kwargs):
+        session = make_http_session(**kwargs)
+        self.addCleanup(session.close)
+        return session
+
+    def test_reuses_kept_alive_connection(self):
+        session = self.make_session()
+        for _ in range(3):
+            self.assertEqual(b'ok', session.get(self.url + '/').content)
+        stats = self.stats.as_dict()
+        self.assertEqual(1, stats['opened'])
+        self.assertEqual(2, stats['reused'])
+        self.assertEqual(0, stats['waited'])
+
+    def test_waits_for_connection_of_full_pool(self):
+        session = self.make_session(pool_maxsize=1, pool_block=True)
+        # Open the pool's only connection.
+        session.get(self.url + '/')
+        threads = [
+            threading.Thread(target=session.get, args=(self.url + '/slow',))
+            for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        stats = self.stats.as_dict()
+        self.assertEqual(1, stats['opened'])
+        self.assertEqual(2, stats['reused'])
+        self.assertEqual(1, stats['waited'])
+        self.assertGreater(stats['wait_time'], 0.1)
@@ -0,0 +1,108 @@
+# Copyright (C) 2015 Cisco, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Tests for the server deletion tracker."""
+
+from __future__ import (
+    absolute_import,
+    print_function,
+    unicode_literals,
+    )
+
+str = None
+
+__metaclass__ = type
+__all__ = []
+
+import time
+
+import mock
+from testiny.deletions import (
+    Deletion,
+    DeletionTracker,
+    HOST_ATTRIBUTE,
+)
+from testiny.poller import (
+    BatchedPoller,
+    WaitTimeout,
+)
+from testiny.testcase import TestinyTestCase
+
+
+class FakeServerPoller(BatchedPoller):
+    """Returns the servers in `self.servers`, None once deleted."""
+
+    def __init__(self, servers):
+        super(FakeServerPoller, self).__init__(
+            min_interval=0.01, max_interval=0.05)
+        self.servers = servers
+        self.fetched = []
+
+    def fetch(self, resource_ids, since):
+        self.fetched.append(sorted(resource_ids))
+        return dict(
+            (resource_id, self.servers.get(resource_id))
+            for resource_id in resource_ids)
+
+
+def make_server(server_id, host, status='ACTIVE'):
+    server = mock.Mock(id=server_id, status=status)
+    server.name = server_id
+    setattr(server, HOST_ATTRIBUTE, host)
+    return server
+
+
+class TestDeletionTracker(TestinyTestCase):
+
+    def test_tracks_until_gone(self):
+        servers = {
+            'a': make_server('a', 'compute-1', status='DELETING'),
+            'b': make_server('b', 'compute-2', status='DELETING'),
+        }
+        tracker = DeletionTracker(FakeServerPoller(servers))
+        started = time.time()
+        deletions = [
+            tracker.track(servers[server_id], started)
+            for server_id in sorted(servers)]
+        while ['a', 'b'] not in tracker.poller.fetched:
+            time.sleep(0.01)
+        del servers['a']
+        servers['b'].status = 'DELETED'
+        first, second = [deletion.result(5) for deletion in deletions]
+        self.assertEqual(('a', 'a', 'compute-1'), first[:3])
+        self.assertEqual(('b', 'b', 'compute-2'), second[:3])
+        self.assertGreaterEqual(first.elapsed, 0)
+        self.assertEqual(2, len(tracker.deletions))
+
+    def test_times_out(self):
+        server = make_server('a', 'compute-1')
+        tracker = DeletionTracker(
+            FakeServerPoller({'a': server}), timeout=0.1)
+        deletion = tracker.track(server)
+        self.assertRaises(WaitTimeout, deletion.result, 5)
+        self.assertEqual([], tracker.deletions)
+
+    def test_format_report_lists_slowest_hosts(self):
+        tracker = DeletionTracker(mock.Mock())
+        tracker.deletions = [
+            Deletion('a', 'a', 'compute-1', 2.0),
+            Deletion('b', 'b', 'compute-2', 10.0),
+            Deletion('c', 'c', 'compute-1', 4.0),
+        ]
+        self.assertEqual(
+            "3 servers deleted in p50=4.00s p90=10.00s max=10.00s\n"
+            "  compute-2: 1 deleted, mean 10.00s, max 10.00s\n"
+            "  compute-1: 2 deleted, mean 3.00s, max 4.00s",
+            tracker.format_report())
@@ -0,0 +1,137 @@
+# Copyright (C) 2015 Cisco, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Tests for the floating IP pools."""
+
+from __future__ import (
+    absolute_import,
+    print_function,
+    unicode_literals,
+    )
+
+str = None
+
+__metaclass__ = type
+__all__ = []
+
+import itertools
+import threading
+
+import mock
+import neutronclient.common.exceptions
+from testiny import floatingips
+from testiny.floatingips import FloatingIPPool
+from testiny.testcase import TestinyTestCase
+
+
+class FakeNeutron:
+
+    def __init__(self):
+        self.ids = itertools.count()
+        self.deleted = []
+        self.updates = []
+        self.gone = set()
+        # Cleared to hold allocations.
+        self.allocating = threading.Event()
+        self.allocating.set()
+
+    def create_floatingip(self, body):
+        self.allocating.wait(5)
+        index = next(self.ids)
+        return {'floatingip': {
+            'id': 'fip-%d' % index,
+            'floating_ip_address': '172.24.4.%d' % index,
+        }}
+
+    def update_floatingip(self, floatingip_id, body):
+        if floatingip_id in self.gone:
+            raise neutronclient.common.exceptions.NotFound()
+        self.updates.append((floatingip_id, body['floatingip']['port_id']))
+
+    def delete_floatingip(self, floatingip_id):
+        if floatingip_id in self.gone:
+            raise neutronclient.common.exceptions.NotFound()
+        self.gone.add(floatingip_id)
+        self.deleted.append(floatingip_id)
+
+
+class TestFloatingIPPool(TestinyTestCase):
+
+    def make_pool(self, size=2, neutron=None, **kwargs):
+        self.patch(
+            floatingips, 'find_network',
+            mock.Mock(return_value={'id': 'public-id'}))
+        if neutron is None:
+            neutron = FakeNeutron()
+        pool = FloatingIPPool(neutron, 'public', size=size, **kwargs)
+        self.addCleanup(pool.close)
+        return neutron, pool
+
+    def test_preallocates_and_replenishes(self):
+        neutron, pool = self.make_pool(size=2)
+        first = pool.lease()
+        second = pool.lease()
+        self.assertNotEqual(first['id'], second['id'])
+        self.assertEqual(0, pool.misses)
+        pool.lease()
+        self.assertEqual(3, len(pool.wait_times))
+
+    def test_release_disassociates_and_reuses(self):
+        neutron, pool = self.make_pool(size=1)
+        floatingip = pool.lease()
+        pool.associate(floatingip, 'port-id')
+        pool.release(floatingip)
+        self.assertEqual(
+            [(floatingip['id'], 'port-id'), (floatingip['id'], None)],
+            neutron.updates)
+        self.assertIn(floatingip['id'], pool.idle_ids())
+        self.assertEqual([], neutron.deleted)
+
+    def test_release_of_deleted_floating_ip_drops_it(self):
+        neutron, pool = self.make_pool(size=1)
+        floatingip = pool.lease()
+        neutron.gone.add(floatingip['id'])
+        pool.release(floatingip)
+        self.assertNotIn(floatingip['id'], pool.idle_ids())
+
+    def test_owned_ids_include_leased_and_allocating(self):
+        neutron = FakeNeutron()
+        neutron.allocating.clear()
+        neutron, pool = self.make_pool(size=1, neutron=neutron)
+        timer = threading.Timer(0.1, neutron.allocating.set)
+        timer.start()
+        self.addCleanup(timer.join)
+        self.assertEqual({'fip-0'}, pool.owned_ids())
+        pool.lease()
+        self.assertEqual({'fip-0', 'fip-1'}, pool.owned_ids())
+
+    def test_allocates_on_demand_when_empty(self):
+        neutron, pool = self.make_pool(size=0)
+        self.assertEqual('fip-0', pool.lease()['id'])
+        self.assertEqual(1, pool.misses)
+
+    def test_close_deletes_leased(self):
+        neutron, pool = self.make_pool(size=0)
+        leased = pool.lease()
+        pool.close()
+        self.assertEqual([leased['id']], neutron.deleted)
+        pool.release(leased)
+        self.assertEqual([leased['id']], neutron.deleted)
+
+    def test_format_wait_report(self):
+        self.assertEqual(
+            "3 floating IPs leased, waited p50=0.20s p90=1.00s max=1.00s, "
+            "1 allocated on demand",
+            floatingips.format_wait_report([1.0, 0.0, 0.2], 1))
@@ -0,0 +1,64 @@
+# Copyright (C) 2015 Cisco, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Tests for the local SSH key generation."""
+
+from __future__ import (
+    absolute_import,
+    print_function,
+    unicode_literals,
+    )
+
+str = None
+
+__metaclass__ = type
+__all__ = []
+
+import os
+import stat
+
+from testiny.keys import KeyGenerator
+from testiny.testcase import TestinyTestCase
+
+
+class TestKeyGenerator(TestinyTestCase):
+
+    def make_generator(self, **kwargs):
+        generator = KeyGenerator(directory=self.make_dir(), **kwargs)
+        self.addCleanup(generator.close)
+        return generator
+
+    def test_generates_rsa_keys(self):
+        generator = self.make_generator(bits=1024)
+        key = generator.get()
+        self.assertTrue(key.public_key.startswith('ssh-rsa '))
+        mode = os.stat(key.private_key_file).st_mode
+        self.assertEqual(0, mode & (stat.S_IRWXG | stat.S_IRWXO))
+
+    def test_generates_ed25519_keys(self):
+        generator = self.make_generator(key_type='ed25519')
+        self.assertTrue(generator.get().public_key.startswith('ssh-ed25519 '))
+
+    def test_keys_are_distinct(self):
+        generator = self.make_generator(key_type='ed25519')
+        first, second = generator.get(), generator.get()
+        self.assertNotEqual(first.private_key_file, second.private_key_file)
+        self.assertNotEqual(first.public_key, second.public_key)
+
+    def test_close_removes_temporary_directory(self):
+        generator = KeyGenerator(key_type='ed25519')
+        generator.get()
+        generator.close()
+        self.assertFalse(os.path.exists(generator.directory))
@@ -0,0 +1,244 @@
+# Copyright (C) 2015 Cisco, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Tests for the network namespace agents and watcher.
+
+The agent tests create network namespaces, so they are skipped unless
+run as root on a host with `ip`.
+"""
+
+from __future__ import (
+    absolute_import,
+    print_function,
+    unicode_literals,
+    )
+
+str = None
+
+__metaclass__ = type
+__all__ = []
+
+import errno
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import mock
+from testiny import netns
+from testiny.netns import (
+    get_netns_agent,
+    NamespaceWatcher,
+    NetnsAgent,
+    NetnsAgentError,
+)
+from testiny.probe import ProbeTimeout
+from testiny.testcase import TestinyTestCase
+
+# Run in a namespace: sends an SSH banner to each connection, then
+# echoes what it receives.
+ECHO_SERVER = """
+import socket, sys, threading
+server = socket.socket()
+server.bind(('127.0.0.1', 0))
+server.listen(5)
+sys.stdout.write('%d\\n' % server.getsockname()[1])
+sys.stdout.flush()
+def echo(conn):
+    conn.sendall(b'SSH-2.0-test\\r\\n')
+    while True:
+        data = conn.recv(4096)
+        if not data:
+            break
+        conn.sendall(data)
+    conn.close()
+while True:
+    conn, _ = server.accept()
+    thread = threading.Thread(target=echo, args=(conn,))
+    thread.daemon = True
+    thread.start()
+"""
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while not predicate():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def receive(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+class TestNamespaceWatcher(TestinyTestCase):
+
+    def make_watcher(self, directory):
+        watcher = NamespaceWatcher(directory)
+        self.addCleanup(watcher.close)
+        return watcher
+
+    def test_lists_existing_namespaces(self):
+        directory = self.make_dir()
+        open(os.path.join(directory, 'qdhcp-1'), 'w').close()
+        watcher = self.make_watcher(directory)
+        self.assertEqual(set(['qdhcp-1']), watcher.names())
+
+    def test_follows_changes(self):
+        directory = self.make_dir()
+        watcher = self.make_watcher(directory)
+        self.assertTrue(watcher.watching)
+        path = os.path.join(directory, 'qdhcp-2')
+        open(path, 'w').close()
+        self.assertTrue(
+            wait_until(lambda: 'qdhcp-2' in watcher.names()))
+        os.unlink(path)
+        self.assertTrue(
+            wait_until(lambda: 'qdhcp-2' not in watcher.names()))
+
+    def test_lists_again_when_not_watching(self):
+        directory = os.path.join(self.make_dir(), 'netns')
+        watcher = self.make_watcher(directory)
+        self.assertFalse(watcher.watching)
+        self.assertFalse(watcher.exists('qdhcp-3'))
+        os.mkdir(directory)
+        open(os.path.join(directory, 'qdhcp-3'), 'w').close()
+        self.assertTrue(watcher.exists('qdhcp-3'))
+        self.assertRaises(Exception, watcher.check, 'qdhcp-4')
+
+
+class TestGetNetnsAgent(TestinyTestCase):
+
+    def test_gives_up_on_agent_that_does_not_start(self):
+        script = os.path.join(self.make_dir(), 'agent.py')
+        with open(script, 'w') as agent_script:
+            agent_script.write('import time\ntime.sleep(10)\n')
+        self.patch(netns, 'AGENT_SCRIPT', script)
+        started = time.time()
+        self.assertRaises(
+            NetnsAgentError, NetnsAgent, 'qdhcp-1', start_timeout=0.2)
+        self.assertLess(time.time() - started, 5)
+
+    def test_falls_back_when_agent_fails(self):
+        self.patch(netns, '_agents', {})
+        self.patch(netns, '_failed', set())
+        self.patch(netns, '_registered', [True])
+        self.patch(netns.sys, 'stderr', mock.Mock())
+        agent = mock.Mock(side_effect=NetnsAgentError("sudo said no"))
+        self.patch(netns, 'NetnsAgent', agent)
+        self.assertIsNone(get_netns_agent('qdhcp-1'))
+        self.assertIsNone(get_netns_agent('qdhcp-1'))
+        self.assertEqual(1, agent.call_count)
+
+
+class TestNetnsAgent(TestinyTestCase):
+
+    def make_namespace(self):
+        if os.geteuid() != 0:
+            self.skipTest("Creating network namespaces needs root")
+        name = self.factory.make_string('testiny-test-')
+        try:
+            subprocess.check_call(['ip', 'netns', 'add', name])
+        except (OSError, subprocess.CalledProcessError):
+            self.skipTest("Can't create network namespaces")
+        self.addCleanup(subprocess.call, ['ip', 'netns', 'delete', name])
+        subprocess.check_call(
+            ['ip', 'netns', 'exec', name, 'ip', 'link', 'set', 'lo', 'up'])
+        return name
+
+    def start_echo_server(self, name):
+        server = subprocess.Popen(
+            ['ip', 'netns', 'exec', name, sys.executable, '-c',
+             ECHO_SERVER], stdout=subprocess.PIPE)
+        self.addCleanup(server.wait)
+        self.addCleanup(server.kill)
+        self.addCleanup(server.stdout.close)
+        return int(server.stdout.readline())
+
+    def make_agent(self):
+        name = self.make_namespace()
+        agent = NetnsAgent(name)
+        self.addCleanup(agent.close)
+        return agent
+
+    def test_connects_from_namespace(self):
+        agent = self.make_agent()
+        port = self.start_echo_server(agent.name)
+        sock = agent.connect('127.0.0.1', port, timeout=5)
+        self.addCleanup(sock.close)
+        self.assertEqual(b'SSH-2.0-test\r\n', receive(sock, 14))
+        sock.sendall(b'hello')
+        self.assertEqual(b'hello', receive(sock, 5))
+
+    def test_does_not_reach_outside_namespace(self):
+        agent = self.make_agent()
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        self.addCleanup(listener.close)
+        error = self.assertRaises(
+            socket.error, agent.connect, '127.0.0.1',
+            listener.getsockname()[1], timeout=5)
+        self.assertEqual(errno.ECONNREFUSED, error.errno)
+
+    def test_proxy_command_relays(self):
+        agent = self.make_agent()
+        port = self.start_echo_server(agent.name)
+        command = agent.proxy_command().replace('%h', '127.0.0.1').replace(
+            '%p', '%d' % port)
+        proxy = subprocess.Popen(
+            command, shell=True, stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE)
+        output, _ = proxy.communicate(b'hello')
+        self.assertEqual(b'SSH-2.0-test\r\nhello', output)
+        self.assertEqual(0, proxy.returncode)
+
+    def test_proxy_command_reports_errors_as_ssh(self):
+        agent = self.make_agent()
+        command = agent.proxy_command().replace('%h', '127.0.0.1').replace(
+            '%p', '1')
+        proxy = subprocess.Popen(
+            command, shell=True, stdin=subprocess.PIPE,
+            stderr=subprocess.PIPE)
+        _, error = proxy.communicate(b'')
+        self.assertEqual(255, proxy.returncode)
+        self.assertIn(b'Connection refused', error)
+
+    def test_wait_for_ssh(self):
+        agent = self.make_agent()
+        port = self.start_echo_server(agent.name)
+        ready = agent.wait_for_ssh('127.0.0.1', port=port, timeout=5)
+        self.assertEqual(['127.0.0.1'], list(ready))
+
+    def test_wait_for_ssh_times_out(self):
+        agent = self.make_agent()
+        self.assertRaises(
+            ProbeTimeout, agent.wait_for_ssh, '127.0.0.1', port=1,
+            timeout=0.3, interval=0.1)
+
+    def test_close_stops_agent(self):
+        agent = self.make_agent()
+        agent.close()
+        self.assertFalse(agent.is_alive)
+        self.assertFalse(os.path.exists(agent.socket_path))
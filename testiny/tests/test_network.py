@@ -27,6 +27,7 @@ str = None
 __metaclass__ = type
 __all__ = []
 
+import bisect
 import time
 
 from netaddr import (
@@ -36,16 +37,18 @@ from netaddr import (
 from testiny.config import CONF
 from testiny.fixtures.neutron import (
     NeutronNetworkFixture,
+    NeutronNetworksFixture,
+    RouterFixture,
     SecurityGroupRuleFixture,
 )
 from testiny.fixtures.project import ProjectFixture
 from testiny.fixtures.server import (
     IsolatedServerFixture,
-    RouterFixture,
     ServerFixture,
 )
 from testiny.fixtures.user import UserFixture
 from testiny.testcase import TestinyTestCase
+from testtools.content import text_content
 
 
 class TestBringUpInstances(TestinyTestCase):
@@ -84,6 +87,33 @@ class TestBringUpInstances(TestinyTestCase):
             "Failed to read file on server: (%s)" % ''.join(err))
         self.assertEqual(''.join(out), random_content)
 
+    def test_boot_with_precreated_port(self):
+        # A server booted on a pre-created port, with its floating IP
+        # bound up front, is reachable like one booted on its network.
+        # The boot times of both modes are recorded for comparison.
+        project_fixture = self.useFixture(ProjectFixture())
+        user_fixture = self.useFixture(UserFixture())
+        boot_times = {}
+        for precreate_port in (False, True):
+            server_fixture = self.useFixture(IsolatedServerFixture(
+                project_fixture=project_fixture, user_fixture=user_fixture,
+                precreate_port=precreate_port))
+            server_fixture.wait_for_status("ACTIVE", "ERROR")
+            out, err, retcode = server_fixture.run_command(
+                'true', user_name=CONF.fast_image['user_name'],
+                key_file_name=server_fixture.keypair_fixture.private_key_file)
+            self.assertEqual(
+                0, retcode, "Can't SSH to server (%s)" % ''.join(err))
+            boot_times[precreate_port] = (
+                server_fixture.time_to_active,
+                server_fixture.time_to_ssh_ready)
+        self.addDetail(
+            'boot-times',
+            text_content(
+                'net-id: ACTIVE after %ss, SSH ready after %ss\n'
+                'port-id: ACTIVE after %ss, SSH ready after %ss' % (
+                    boot_times[False] + boot_times[True])))
+
 
 class TestPingInstances(TestinyTestCase):
 
@@ -182,27 +212,31 @@ class TestPingInstances(TestinyTestCase):
         num_networks = 5
         iterations = 10
 
-        network_fixtures = [
-            self.useFixture(
-                NeutronNetworkFixture(project_fixture=project_fixture))
-            for _ in range(num_networks)
-        ]
+        networks_fixture = self.useFixture(
+            NeutronNetworksFixture(project_fixture, num_networks))
+
+        subnet_ids = [subnet["id"] for subnet in networks_fixture.subnets]
 
         router_fixture = self.useFixture(RouterFixture(project_fixture))
+        # Time at which each iteration started, to tell when outages
+        # happened.
+        iteration_starts = []
         for _ in range(iterations):
-            for network_fixture in network_fixtures:
-                router_fixture.add_interface_router(
-                    network_fixture.subnet["subnet"]["id"])
+            iteration_starts.append(time.time())
+            router_fixture.add_interfaces_router(subnet_ids)
             time.sleep(sleep_time)
-            for network_fixture in network_fixtures:
-                router_fixture.remove_interface_router(
-                    network_fixture.subnet["subnet"]["id"])
+            router_fixture.remove_interfaces_router(subnet_ids)
             time.sleep(sleep_time)
 
-        packets, percent_packet_loss = server_fixture.stop_background_ping(
-            ip=external_gateway)
+        report = server_fixture.stop_background_ping(ip=external_gateway)
+        outages = [
+            "%.1fs outage at iteration %d" % (
+                outage.duration,
+                bisect.bisect(
+                    iteration_starts, report.started + outage.start))
+            for outage in report.outages]
         self.assertEqual(
-            0, int(percent_packet_loss),
-            "Packet loss while pinging external gateway: %s%% "
-            "(out of %s packets)" % (
-                percent_packet_loss, packets))
+            0, report.sent - report.received,
+            "Packet loss while pinging external gateway: %.1f%% "
+            "(out of %s packets): %s" % (
+                report.loss_percent, report.sent, ", ".join(outages)))
@@ -0,0 +1,191 @@
+# Copyright (C) 2015 Cisco, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Tests for the neutron fixtures that don't need an Openstack."""
+
+from __future__ import (
+    absolute_import,
+    print_function,
+    unicode_literals,
+    )
+
+str = None
+
+__metaclass__ = type
+__all__ = []
+
+import threading
+import time
+
+import mock
+from testiny import teardown
+from testiny.fixtures import (
+    neutron,
+    project,
+)
+from testiny.fixtures.neutron import (
+    RouterFixture,
+    SecurityGroupRulesFixture,
+)
+from testiny.fixtures.project import ProjectFixture
+from testiny.testcase import TestinyTestCase
+
+
+class TestRouterInterfaces(TestinyTestCase):
+
+    def make_router_fixture(self):
+        router_fixture = RouterFixture(mock.Mock())
+        router_fixture.router = {'router': {'id': 'router-id'}}
+        router_fixture.neutron = mock.Mock()
+        router_fixture.neutron.add_interface_router.side_effect = (
+            lambda router_id, body: {'port_id': 'port-%s' % body['subnet_id']})
+        self.poller = mock.Mock()
+        self.poller.wait_with_timestamp.side_effect = (
+            lambda port_id, predicate, timeout: (None, time.time()))
+        self.patch(neutron, 'get_port_poller', lambda: self.poller)
+        return router_fixture
+
+    def test_add_interfaces_waits_for_ports(self):
+        router_fixture = self.make_router_fixture()
+        operations = router_fixture.add_interfaces_router(
+            ['a', 'b', 'c'], max_workers=2)
+        self.assertEqual(
+            ['port-a', 'port-b', 'port-c'],
+            [operation.port_id for operation in operations])
+        self.assertEqual(
+            {'a': 'port-a', 'b': 'port-b', 'c': 'port-c'},
+            router_fixture.port_ids)
+        self.assertEqual(3, self.poller.wait_with_timestamp.call_count)
+        for operation in operations:
+            self.assertIsNotNone(operation.api_time)
+            self.assertIsNotNone(operation.port_time)
+
+    def test_remove_interfaces(self):
+        router_fixture = self.make_router_fixture()
+        router_fixture.add_interfaces_router(['a', 'b'], wait=False)
+        operations = router_fixture.remove_interfaces_router(['a', 'b'])
+        self.assertEqual([], router_fixture.subnet_ids)
+        self.assertEqual(
+            ['remove', 'remove'],
+            [operation.action for operation in operations])
+        self.assertEqual(2, self.poller.wait_with_timestamp.call_count)
+        predicate = self.poller.wait_with_timestamp.call_args[0][1]
+        self.assertTrue(predicate(None))
+        self.assertEqual(4, len(router_fixture.operations))
+
+    def test_records_errors_and_raises(self):
+        router_fixture = self.make_router_fixture()
+        error = Exception("Conflict")
+        router_fixture.neutron.add_interface_router.side_effect = error
+        self.assertRaises(
+            Exception, router_fixture.add_interfaces_router, ['a'])
+        [operation] = router_fixture.operations
+        self.assertIs(error, operation.error)
+        self.assertIn(
+            "add: 1 operations, 1 failed", router_fixture.format_operations())
+
+    def set_up_router_fixture(self):
+        neutron_client = mock.Mock()
+        neutron_client.create_router.return_value = {
+            'router': {'id': 'router-id'}}
+        neutron_client.add_interface_router.side_effect = (
+            lambda router_id, body: {'port_id': 'port-%s' % body['subnet_id']})
+        self.patch(
+            neutron, 'get_neutron_client', lambda **kwargs: neutron_client)
+        router_poller = mock.Mock()
+        router_poller.wait.return_value = {'id': 'router-id'}
+        self.patch(neutron, 'get_router_poller', lambda: router_poller)
+        self.patch(neutron, 'get_port_poller', mock.Mock())
+        router_fixture = RouterFixture(mock.Mock())
+        router_fixture.setUp()
+        router_fixture.add_interfaces_router(['a'], wait=False)
+        # The number of operations when the detail is added.
+        self.recorded = []
+        router_fixture.format_operations = (
+            lambda: self.recorded.append(len(router_fixture.operations)) or '')
+        return router_fixture
+
+    def test_operations_detail_includes_teardown(self):
+        self.patch(teardown, 'get_teardown_engine', lambda: None)
+        router_fixture = self.set_up_router_fixture()
+        router_fixture.cleanUp()
+        self.assertEqual([2], self.recorded)
+
+    def test_operations_detail_includes_background_teardown(self):
+        engine = teardown.TeardownEngine()
+        self.addCleanup(engine.executor.shutdown)
+        self.patch(teardown, 'get_teardown_engine', lambda: engine)
+        router_fixture = self.set_up_router_fixture()
+        # Hold the removal until the fixture's cleanups have returned.
+        released = threading.Event()
+        router_fixture.neutron.remove_interface_router.side_effect = (
+            lambda router_id, body: released.wait(5))
+        router_fixture.cleanUp()
+        released.set()
+        self.assertEqual([], engine.barrier())
+        self.assertEqual([2], self.recorded)
+
+
+class TestSecurityGroups(TestinyTestCase):
+
+    def setUp(self):
+        super(TestSecurityGroups, self).setUp()
+        self.neutron_client = mock.Mock()
+        self.neutron_client.list_security_groups.return_value = {
+            'security_groups': [{'id': 'group-id'}]}
+        self.patch(project, 'get_neutron_client', self.get_neutron_client)
+        self.patch(neutron, 'get_neutron_client', self.get_neutron_client)
+
+    def get_neutron_client(self, **kwargs):
+        return self.neutron_client
+
+    def make_project_fixture(self):
+        project_fixture = ProjectFixture()
+        project_fixture.name = 'project'
+        project_fixture.project = mock.Mock(id='project-id')
+        project_fixture.admin_user = mock.Mock()
+        project_fixture.admin_user_fixture = mock.Mock()
+        return project_fixture
+
+    def test_security_group_lookup_is_filtered_and_cached(self):
+        project_fixture = self.make_project_fixture()
+        self.assertEqual(
+            'group-id', project_fixture.get_security_group_id('default'))
+        self.assertEqual(
+            'group-id', project_fixture.get_security_group_id('default'))
+        self.neutron_client.list_security_groups.assert_called_once_with(
+            tenant_id='project-id', name='default', fields=['id'])
+
+    def test_rules_created_in_one_request(self):
+        create = self.neutron_client.create_security_group_rule
+        create.return_value = {
+            'security_group_rules': [{'id': 'rule-1'}, {'id': 'rule-2'}]}
+        fixture = SecurityGroupRulesFixture(
+            self.make_project_fixture(), 'default', [
+                {'direction': 'egress', 'protocol': 'icmp'},
+                {'direction': 'ingress', 'protocol': 'tcp'},
+            ])
+        with fixture:
+            create.assert_called_once_with({'security_group_rules': [
+                {'direction': 'egress', 'protocol': 'icmp',
+                 'security_group_id': 'group-id'},
+                {'direction': 'ingress', 'protocol': 'tcp',
+                 'security_group_id': 'group-id'},
+            ]})
+        self.assertEqual(
+            ['rule-1', 'rule-2'],
+            sorted(
+                call[0][0] for call in
+                self.neutron_client.delete_security_group_rule.call_args_list))
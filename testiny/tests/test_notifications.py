@@ -0,0 +1,100 @@
+# Copyright (C) 2015 Cisco, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Tests for the notifications from the message bus."""
+
+from __future__ import (
+    absolute_import,
+    print_function,
+    unicode_literals,
+    )
+
+str = None
+
+__metaclass__ = type
+__all__ = []
+
+import json
+
+from six.moves import queue
+from testiny.notifications import (
+    LocalBus,
+    Notification,
+    parse_notification,
+)
+from testiny.testcase import TestinyTestCase
+
+NOVA_UPDATE = {
+    'event_type': 'instance.update',
+    'timestamp': '2016-03-01 12:00:01.250000',
+    'payload': {
+        'nova_object.name': 'InstanceUpdatePayload',
+        'nova_object.data': {'uuid': 'server-id', 'state': 'active'},
+    },
+}
+
+
+class TestParseNotification(TestinyTestCase):
+
+    def test_nova_versioned(self):
+        self.assertEqual(
+            Notification(
+                'instance.update', 'server', 'server-id', 1456833601.25),
+            parse_notification(NOVA_UPDATE))
+
+    def test_oslo_envelope(self):
+        body = {
+            'oslo.version': '2.0',
+            'oslo.message': json.dumps(NOVA_UPDATE),
+        }
+        self.assertEqual(
+            'server-id', parse_notification(json.dumps(body)).resource_id)
+
+    def test_neutron_update(self):
+        notification = parse_notification({
+            'event_type': 'port.update.end',
+            'timestamp': '2016-03-01T12:00:01Z',
+            'payload': {'port': {'id': 'port-id', 'status': 'ACTIVE'}},
+        })
+        self.assertEqual(
+            ('port', 'port-id', 1456833601.0),
+            notification[1:])
+
+    def test_neutron_delete(self):
+        notification = parse_notification({
+            'event_type': 'router.delete.end',
+            'timestamp': '2016-03-01 12:00:01',
+            'payload': {'router_id': 'router-id'},
+        })
+        self.assertEqual('router-id', notification.resource_id)
+
+    def test_ignores_other_objects(self):
+        self.assertIsNone(parse_notification({
+            'event_type': 'network.create.end',
+            'timestamp': '2016-03-01 12:00:01',
+            'payload': {'network': {'id': 'network-id'}},
+        }))
+
+
+class TestLocalBus(TestinyTestCase):
+
+    def test_delivers_to_subscribers(self):
+        bus = LocalBus()
+        self.addCleanup(bus.close)
+        received = queue.Queue()
+        bus.subscribe(received.put)
+        bus.publish('not json')
+        bus.publish(NOVA_UPDATE)
+        self.assertEqual('server-id', received.get(timeout=5).resource_id)
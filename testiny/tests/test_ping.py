@@ -0,0 +1,96 @@
+# Copyright (C) 2015 Cisco, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Tests for the ping telemetry."""
+
+from __future__ import (
+    absolute_import,
+    print_function,
+    unicode_literals,
+    )
+
+str = None
+
+__metaclass__ = type
+__all__ = []
+
+from testiny.ping import (
+    Outage,
+    PingMonitor,
+)
+from testiny.testcase import TestinyTestCase
+
+
+def busybox_reply(seq, rtt=1.0):
+    return (
+        b'64 bytes from 10.0.0.1: seq=%d ttl=64 time=%.3f ms\r\n' % (
+            seq, rtt))
+
+
+class TestPingMonitor(TestinyTestCase):
+
+    def feed(self, monitor, seqs, rtt=1.0):
+        for seq in seqs:
+            monitor.feed(
+                busybox_reply(seq, rtt), now=monitor.started + seq + 0.01)
+
+    def test_no_loss(self):
+        monitor = PingMonitor()
+        self.feed(monitor, range(10))
+        monitor.stop(now=monitor.started + 10)
+        report = monitor.report()
+        self.assertEqual((10, 10, 0.0), (
+            report.sent, report.received, report.loss_percent))
+        self.assertEqual([], report.outages)
+
+    def test_outage_window(self):
+        monitor = PingMonitor()
+        self.feed(monitor, [0, 1, 2, 6, 7])
+        monitor.stop(now=monitor.started + 8)
+        report = monitor.report()
+        self.assertEqual((8, 5), (report.sent, report.received))
+        [outage] = report.outages
+        self.assertEqual(3, outage.lost)
+        self.assertAlmostEqual(2.01, outage.start)
+        self.assertAlmostEqual(4.0, outage.duration)
+
+    def test_trailing_outage(self):
+        monitor = PingMonitor()
+        self.feed(monitor, [0, 1])
+        monitor.stop(now=monitor.started + 6.5)
+        report = monitor.report()
+        self.assertEqual(
+            [Outage(1.01, 6.5, 5.49, 4)],
+            [Outage(*(round(field, 2) for field in outage))
+             for outage in report.outages])
+
+    def test_iputils_output_and_percentiles(self):
+        monitor = PingMonitor()
+        for seq in range(1, 101):
+            monitor.feed(
+                '64 bytes from 10.0.0.1: icmp_seq=%d ttl=64 time=%d ms' % (
+                    seq, seq),
+                now=monitor.started + seq - 1)
+        monitor.stop(now=monitor.started + 100)
+        report = monitor.report()
+        self.assertEqual(100, report.sent)
+        self.assertEqual(
+            {50: 50, 90: 90, 99: 99, 100: 100}, report.percentiles)
+
+    def test_ignores_other_lines(self):
+        monitor = PingMonitor()
+        monitor.feed(b'PING 10.0.0.1 (10.0.0.1): 56 data bytes\n')
+        monitor.feed(busybox_reply(0) + b' DUP!')
+        self.assertEqual(0, len(monitor.seqs))
@@ -0,0 +1,141 @@
+# Copyright (C) 2015 Cisco, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Tests for the batched status poller."""
+
+from __future__ import (
+    absolute_import,
+    print_function,
+    unicode_literals,
+    )
+
+str = None
+
+__metaclass__ = type
+__all__ = []
+
+from concurrent import futures
+import time
+
+import mock
+from testiny import poller as poller_module
+from testiny.notifications import (
+    Bus,
+    Notification,
+)
+from testiny.poller import (
+    BatchedPoller,
+    WaitTimeout,
+)
+from testiny.testcase import TestinyTestCase
+
+
+class FakePoller(BatchedPoller):
+    """Returns the states in `self.states`, recording the fetches."""
+
+    def __init__(self, states, **kwargs):
+        kwargs.setdefault('min_interval', 0.01)
+        kwargs.setdefault('max_interval', 0.05)
+        super(FakePoller, self).__init__(**kwargs)
+        self.states = states
+        self.fetched = []
+
+    def fetch(self, resource_ids, since):
+        self.fetched.append((sorted(resource_ids), since is None))
+        return dict(
+            (resource_id, self.states.get(resource_id))
+            for resource_id in resource_ids)
+
+
+class TestBatchedPoller(TestinyTestCase):
+
+    def test_returns_object_satisfying_predicate(self):
+        poller = FakePoller({'a': 'ACTIVE'})
+        self.assertEqual(
+            'ACTIVE', poller.wait('a', lambda state: state == 'ACTIVE'))
+
+    def test_fetches_all_waited_objects_at_once(self):
+        states = {'a': 'BUILD', 'b': 'BUILD'}
+        poller = FakePoller(states)
+        executor = futures.ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(executor.shutdown)
+        waits = [
+            executor.submit(
+                poller.wait, resource_id, lambda state: state == 'ACTIVE', 5)
+            for resource_id in ('a', 'b')]
+        # Wait for both objects to have been fetched once.
+        while (['a', 'b'], False) not in poller.fetched:
+            futures.wait(waits, timeout=0.01)
+        states.update(a='ACTIVE', b='ACTIVE')
+        self.assertEqual(
+            ['ACTIVE', 'ACTIVE'], [wait.result() for wait in waits])
+
+    def test_reraises_predicate_errors(self):
+        def predicate(state):
+            raise ValueError(state)
+
+        poller = FakePoller({'a': 'ERROR'})
+        self.assertRaises(ValueError, poller.wait, 'a', predicate)
+
+    def test_times_out(self):
+        poller = FakePoller({'a': 'BUILD'})
+        self.assertRaises(
+            WaitTimeout, poller.wait, 'a', lambda state: False, 0.1)
+
+    def test_backs_off_while_nothing_changes(self):
+        poller = FakePoller({'a': 'BUILD'}, max_interval=10)
+        self.assertRaises(
+            WaitTimeout, poller.wait, 'a', lambda state: False, 0.2)
+        self.assertGreater(poller.interval, poller.min_interval)
+
+    def test_event_driven_fetches_on_notify(self):
+        states = {'a': 'BUILD'}
+        poller = FakePoller(states, fallback_interval=60)
+        executor = futures.ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(executor.shutdown)
+        wait = executor.submit(
+            poller.wait_with_timestamp, 'a',
+            lambda state: state == 'ACTIVE', 5)
+        while (['a'], True) not in poller.fetched:
+            futures.wait([wait], timeout=0.01)
+        states['a'] = 'ACTIVE'
+        poller.notify('a', 1234.5)
+        self.assertEqual(('ACTIVE', 1234.5), wait.result())
+        # Only the first fetch and the notified one.
+        self.assertEqual(2, poller.fetches)
+
+    def test_notify_ignores_objects_not_waited_for(self):
+        poller = FakePoller({})
+        poller.notify('a')
+        self.assertEqual(set(), poller._new_ids)
+
+    def test_backs_off_normally_while_bus_disconnected(self):
+        bus = Bus()
+        bus.connected = False
+        poller = FakePoller(
+            {'a': 'BUILD'}, fallback_interval=60, max_interval=10, bus=bus)
+        self.assertRaises(
+            WaitTimeout, poller.wait, 'a', lambda state: False, 0.2)
+        self.assertLess(poller.interval, 60)
+        self.assertGreater(poller.interval, poller.min_interval)
+
+    def test_notifications_are_timed_on_receipt(self):
+        # The notification's timestamp is by the controller's clock.
+        poller = mock.Mock()
+        self.patch(
+            poller_module, '_pollers', {poller_module.ServerPoller: poller})
+        poller_module._on_notification(Notification(
+            'instance.update', 'server', 'server-id', time.time() - 3600))
+        poller.notify.assert_called_once_with('server-id')
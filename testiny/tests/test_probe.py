@@ -0,0 +1,90 @@
+# Copyright (C) 2015 Cisco, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Tests for the SSH readiness prober."""
+
+from __future__ import (
+    absolute_import,
+    print_function,
+    unicode_literals,
+    )
+
+str = None
+
+__metaclass__ = type
+__all__ = []
+
+import socket
+import threading
+
+from testiny.probe import (
+    ProbeTimeout,
+    wait_for_ssh,
+)
+from testiny.testcase import TestinyTestCase
+
+
+class TestWaitForSSH(TestinyTestCase):
+
+    def listen(self, banner):
+        """Listen on a local port, sending `banner` to connections."""
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('127.0.0.1', 0))
+        server.listen(5)
+        self.addCleanup(server.close)
+
+        def serve():
+            while True:
+                try:
+                    conn, _ = server.accept()
+                except socket.error:
+                    return
+                conn.sendall(banner)
+                conn.close()
+
+        thread = threading.Thread(target=serve)
+        thread.daemon = True
+        thread.start()
+        return server.getsockname()[1]
+
+    def unused_port(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        return port
+
+    def test_ready_when_banner_received(self):
+        port = self.listen(b'SSH-2.0-dropbear\r\n')
+        ready = wait_for_ssh(['127.0.0.1'], port=port, timeout=5)
+        self.assertEqual(['127.0.0.1'], list(ready))
+
+    def test_not_ready_without_ssh_banner(self):
+        port = self.listen(b'HTTP/1.0 400\r\n')
+        self.assertRaises(
+            ProbeTimeout, wait_for_ssh, ['127.0.0.1'], port=port,
+            timeout=0.5, interval=0.1)
+
+    def test_connection_is_enough_without_read_banner(self):
+        port = self.listen(b'')
+        ready = wait_for_ssh(
+            ['127.0.0.1'], port=port, timeout=5, read_banner=False)
+        self.assertEqual(['127.0.0.1'], list(ready))
+
+    def test_times_out_when_refused(self):
+        error = self.assertRaises(
+            ProbeTimeout, wait_for_ssh, ['127.0.0.1'],
+            port=self.unused_port(), timeout=0.5, interval=0.1)
+        self.assertEqual({}, error.ready)
@@ -0,0 +1,277 @@
+# Copyright (C) 2015 Cisco, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Tests for the server helpers that don't need an Openstack."""
+
+from __future__ import (
+    absolute_import,
+    print_function,
+    unicode_literals,
+    )
+
+str = None
+
+__metaclass__ = type
+__all__ = []
+
+from concurrent import futures
+import time
+
+import mock
+from novaclient.v2.servers import ServerManager
+from testiny import (
+    cache,
+    probe,
+    utils,
+)
+from testiny.deletions import DeletionTracker
+from testiny.fixtures import server as server_module
+from testiny.fixtures.server import (
+    ping_matrix,
+    run_command_on_servers,
+    ServerFixture,
+    ServerGroupFixture,
+    TimeoutError,
+)
+from testiny.testcase import TestinyTestCase
+
+
+def succeeded(result):
+    future = futures.Future()
+    future.set_result(result)
+    return future
+
+
+def make_server(ip, returncode=0):
+    server = mock.Mock()
+    server.get_ip_address.return_value = ip
+    server.run_command.side_effect = (
+        lambda command, **kwargs: (['%s: %s' % (ip, command)], [], returncode))
+    return server
+
+
+class TestRunCommandOnServers(TestinyTestCase):
+
+    def test_runs_command_on_each_server(self):
+        servers = [make_server('10.0.0.1'), make_server('10.0.0.2')]
+        results = run_command_on_servers(
+            servers, 'uptime', user_name='cirros', key_file_name='/key')
+        self.assertEqual(
+            [['10.0.0.1: uptime'], ['10.0.0.2: uptime']],
+            [result.stdout for result in results])
+        servers[0].run_command.assert_called_once_with(
+            'uptime', user_name='cirros', key_file_name='/key', timeout=60)
+
+    def test_per_server_commands(self):
+        servers = [make_server('10.0.0.1'), make_server('10.0.0.2')]
+        results = run_command_on_servers(
+            servers, lambda server: 'ping %s' % server.get_ip_address(),
+            user_name='cirros', key_file_name='/key')
+        self.assertEqual(
+            [['10.0.0.1: ping 10.0.0.1'], ['10.0.0.2: ping 10.0.0.2']],
+            [result.stdout for result in results])
+
+    def test_records_failures(self):
+        server = make_server('10.0.0.1')
+        server.run_command.side_effect = TimeoutError()
+        [result] = run_command_on_servers(
+            [server], 'uptime', user_name='cirros', key_file_name='/key')
+        self.assertIsNone(result.returncode)
+        self.assertIn('TimeoutError', result.stderr[0])
+
+
+class TestPingMatrix(TestinyTestCase):
+
+    def test_pings_every_other_server(self):
+        servers = [make_server('10.0.0.%d' % i) for i in range(3)]
+        results = ping_matrix(
+            servers, user_name='cirros', key_file_name='/key')
+        self.assertEqual(6, len(results))
+        self.assertEqual(
+            ['10.0.0.0: ping -c 1 -w 60 -q 10.0.0.1'],
+            results[servers[0], servers[1]].stdout)
+
+
+class TestServerGroupFixture(TestinyTestCase):
+
+    def make_group(self, ips):
+        group = ServerGroupFixture(count=len(ips))
+        for ip in ips:
+            member = mock.Mock(time_to_ssh_ready=None)
+            member.boot_started = time.time() - 10
+            member.get_access_ip.return_value = ip
+            group.members.append(member)
+        group.addDetail = mock.Mock()
+        return group
+
+    def test_wait_for_ssh_probes_all_members_at_once(self):
+        group = self.make_group(['10.0.0.1', '10.0.0.2'])
+        wait_for_ssh = mock.Mock(
+            return_value={'10.0.0.1': 1.0, '10.0.0.2': 2.0})
+        self.patch(probe, 'wait_for_ssh', wait_for_ssh)
+        group.wait_for_ssh(timeout=5)
+        self.assertEqual(
+            ['10.0.0.1', '10.0.0.2'],
+            sorted(wait_for_ssh.call_args[0][0]))
+        first, second = group.members
+        self.assertAlmostEqual(11, first.time_to_ssh_ready, places=0)
+        self.assertAlmostEqual(12, second.time_to_ssh_ready, places=0)
+
+    def test_wait_for_ssh_records_partial_readiness(self):
+        group = self.make_group(['10.0.0.1', '10.0.0.2'])
+        self.patch(probe, 'wait_for_ssh', mock.Mock(
+            side_effect=probe.ProbeTimeout("Timeout", {'10.0.0.1': 1.0})))
+        self.assertRaises(probe.ProbeTimeout, group.wait_for_ssh, timeout=5)
+        first, second = group.members
+        self.assertIsNotNone(first.time_to_ssh_ready)
+        self.assertIsNone(second.time_to_ssh_ready)
+
+    def test_create_server_boots_all_members_at_once(self):
+        self.patch(
+            server_module.CONF, 'instance_access',
+            server_module.INSTANCE_ACCESS_LOCAL_NETNS)
+        group = ServerGroupFixture(count=2)
+        nova = mock.Mock()
+        # Checks the arguments against the real signature.
+        nova.servers = mock.create_autospec(ServerManager, instance=True)
+        nova.servers.create.return_value = 'r-123'
+        servers = [mock.Mock(), mock.Mock()]
+        servers[0].name, servers[1].name = 'group-2', 'group-1'
+        nova.servers.list.return_value = servers
+
+        def setup_prerequisites():
+            group.nova = nova
+            group.name = 'group'
+            group.image = group.flavor = mock.Mock()
+            group.nics = [{'net-id': 'network-id'}]
+            group.keypair_fixture = mock.Mock()
+
+        group.setup_prerequisites = setup_prerequisites
+        group.delete_server = mock.Mock()
+        self.useFixture(group)
+        self.assertEqual(
+            2, nova.servers.create.call_args[1]['min_count'])
+        nova.servers.list.assert_called_once_with(
+            search_opts={'reservation_id': 'r-123'})
+        self.assertEqual(
+            [servers[1], servers[0]],
+            [member.server for member in group.members])
+
+    def test_delete_server_deletes_all_members(self):
+        group = self.make_group(['10.0.0.1', '10.0.0.2'])
+        group.name = 'group'
+        tracker = DeletionTracker(mock.Mock())
+        tracker.poller.watch.side_effect = (
+            lambda server_id, predicate, timeout: succeeded(
+                (None, time.time())))
+        self.patch(server_module, 'get_deletion_tracker', lambda: tracker)
+        group.delete_server()
+        for member in group.members:
+            member.server.delete.assert_called_once_with()
+        self.assertEqual(2, len(tracker.deletions))
+
+
+class TestServerPorts(TestinyTestCase):
+
+    def make_server_fixture(self, **kwargs):
+        network_fixture = mock.Mock()
+        network_fixture.network = {'network': {'id': 'network-id'}}
+        self.patch(server_module, 'get_nova_v3_client', mock.Mock())
+        self.patch(cache, '_cache', cache.TTLCache())
+        return ServerFixture(mock.Mock(), mock.Mock(), network_fixture,
+                             **kwargs)
+
+    def test_boots_on_network_by_default(self):
+        server_fixture = self.make_server_fixture()
+        server_fixture.setup_prerequisites()
+        self.assertEqual([{'net-id': 'network-id'}], server_fixture.nics)
+
+    def test_boots_on_given_port(self):
+        server_fixture = self.make_server_fixture(port_id='port-id')
+        server_fixture.setup_prerequisites()
+        self.assertEqual([{'port-id': 'port-id'}], server_fixture.nics)
+
+    def test_group_rejects_single_port(self):
+        self.assertRaises(
+            ValueError, ServerGroupFixture, count=2, precreate_port=True)
+
+
+class TestLocalNetnsAccess(TestinyTestCase):
+
+    def make_server_fixture(self, agent):
+        self.patch(
+            server_module.CONF, 'instance_access',
+            server_module.INSTANCE_ACCESS_LOCAL_NETNS)
+        neutron = mock.Mock()
+        neutron.list_networks.return_value = {
+            'networks': [{'id': 'network-id'}]}
+        self.patch(
+            server_module, 'get_neutron_client',
+            mock.Mock(return_value=neutron))
+        self.patch(
+            server_module, 'get_namespace_watcher',
+            mock.Mock(return_value=mock.Mock()))
+        self.get_netns_agent = mock.Mock(return_value=agent)
+        self.patch(server_module, 'get_netns_agent', self.get_netns_agent)
+        server_fixture = ServerFixture(mock.Mock(), mock.Mock(), mock.Mock())
+        server_fixture.server = mock.Mock()
+        server_fixture.server.manager.get.side_effect = (
+            lambda server_id: mock.Mock(networks={'private': ['10.0.0.3']}))
+        return neutron, server_fixture
+
+    def test_connects_through_agent(self):
+        agent = mock.Mock()
+        agent.proxy_command.return_value = 'proxy %h %p'
+        neutron, server_fixture = self.make_server_fixture(agent)
+        self.assertEqual(
+            ['-o', 'ProxyCommand=proxy %h %p'],
+            server_fixture._get_access_ssh_options())
+        self.assertEqual('', server_fixture._get_access_ssh_prefix_command())
+        self.get_netns_agent.assert_called_with('qdhcp-network-id')
+        self.assertEqual(1, neutron.list_networks.call_count)
+
+    def test_falls_back_on_ip_netns_exec(self):
+        neutron, server_fixture = self.make_server_fixture(None)
+        self.assertEqual([], server_fixture._get_access_ssh_options())
+        self.assertEqual(
+            'sudo ip netns exec qdhcp-network-id',
+            server_fixture._get_access_ssh_prefix_command())
+
+    def test_wait_for_ssh_probes_through_agent(self):
+        agent = mock.Mock()
+        neutron, server_fixture = self.make_server_fixture(agent)
+        server_fixture.name = 'instance'
+        server_fixture.addDetail = mock.Mock()
+        server_fixture.get_ip_address = mock.Mock(return_value='10.0.0.3')
+        server_fixture.wait_for_ssh(timeout=5)
+        self.assertEqual('10.0.0.3', agent.wait_for_ssh.call_args[0][0])
+        self.assertIsNotNone(server_fixture.time_to_ssh_ready)
+
+
+class TestRunCommand(TestinyTestCase):
+
+    def test_does_not_probe_again_after_probe_timeout(self):
+        self.patch(utils.time, 'sleep', mock.Mock())
+        server_fixture = ServerFixture(mock.Mock(), mock.Mock(), mock.Mock())
+        server_fixture.wait_for_ssh = mock.Mock(
+            side_effect=probe.ProbeTimeout("Timeout", {}))
+        server_fixture._run_ssh_command = mock.Mock()
+        self.patch(server_module, 'communicate', mock.Mock(
+            return_value=([], ['ssh: connect to host 10.0.0.3 port 22: '
+                               'Connection refused\n'], 255)))
+        server_fixture.run_command('uptime', 'cirros', '/key')
+        self.assertEqual(5, server_fixture._run_ssh_command.call_count)
+        self.assertEqual(1, server_fixture.wait_for_ssh.call_count)
+        self.assertTrue(server_fixture.ssh_probe_failed)
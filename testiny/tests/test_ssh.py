@@ -0,0 +1,117 @@
+# Copyright (C) 2015 Cisco, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Tests for the SSH helpers."""
+
+from __future__ import (
+    absolute_import,
+    print_function,
+    unicode_literals,
+    )
+
+str = None
+
+__metaclass__ = type
+__all__ = []
+
+import os
+import subprocess
+import time
+
+import fixtures
+from testiny import ssh
+from testiny.ssh import (
+    communicate,
+    SSH_OPTIONS,
+    SSHConnection,
+    SSHConnectionPool,
+    TimeoutError,
+)
+from testiny.testcase import TestinyTestCase
+
+
+def shell(script):
+    return subprocess.Popen(
+        ['sh', '-c', script], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+class TestCommunicate(TestinyTestCase):
+
+    def test_collects_output_and_return_code(self):
+        self.assertEqual(
+            ([b'out\n'], [b'err\n'], 3),
+            communicate(shell('echo out; echo err >&2; exit 3'), timeout=5))
+
+    def test_streams_output(self):
+        lines = []
+        communicate(
+            shell('echo one; echo two'),
+            on_output=lambda name, line: lines.append((name, line)))
+        self.assertEqual(
+            [('stdout', b'one\n'), ('stdout', b'two\n')], lines)
+
+    def test_kills_process_on_timeout(self):
+        process = shell('exec sleep 10')
+        self.assertRaises(TimeoutError, communicate, process, 0.1)
+        self.assertIsNotNone(process.returncode)
+
+    def test_kills_process_without_output_on_timeout(self):
+        with open(os.devnull, 'wb') as devnull:
+            process = subprocess.Popen(
+                ['sleep', '10'], stdout=devnull, stderr=devnull)
+        started = time.time()
+        self.assertRaises(TimeoutError, communicate, process, 0.1)
+        self.assertLess(time.time() - started, 5)
+        self.assertIsNotNone(process.returncode)
+
+
+class TestSSHConnection(TestinyTestCase):
+
+    def test_open_gives_up_on_stalled_master(self):
+        # An ssh stuck after connecting, e.g. in the key exchange.
+        directory = self.make_dir()
+        fake_ssh = os.path.join(directory, 'ssh')
+        with open(fake_ssh, 'w') as script:
+            script.write('#!/bin/sh\nexec sleep 10\n')
+        os.chmod(fake_ssh, 0o755)
+        self.useFixture(fixtures.EnvironmentVariable(
+            'PATH', '%s:%s' % (directory, os.environ['PATH'])))
+        self.patch(ssh, 'MASTER_TIMEOUT', 0.2)
+        connection = SSHConnection(
+            '10.0.0.1', 'cirros', '/key', os.path.join(directory, 'control'))
+        started = time.time()
+        self.assertFalse(connection.open())
+        self.assertLess(time.time() - started, 5)
+
+
+class TestSSHConnectionPool(TestinyTestCase):
+
+    def test_reuses_connections(self):
+        pool = SSHConnectionPool()
+        self.addCleanup(pool.close)
+        connection = pool.get('10.0.0.1', 'cirros', '/key')
+        self.assertIs(connection, pool.get('10.0.0.1', 'cirros', '/key'))
+        self.assertIsNot(connection, pool.get('10.0.0.2', 'cirros', '/key'))
+        self.assertFalse(connection.is_open)
+
+    def test_options_are_passed_to_ssh(self):
+        pool = SSHConnectionPool()
+        self.addCleanup(pool.close)
+        options = ['-o', 'ProxyCommand=proxy %h %p']
+        connection = pool.get('10.0.0.1', 'cirros', '/key', options=options)
+        self.assertIsNot(connection, pool.get('10.0.0.1', 'cirros', '/key'))
+        expected = ['ssh'] + list(SSH_OPTIONS) + options + ['-N']
+        self.assertEqual(
+            expected, connection._ssh_args('-N')[:len(expected)])
@@ -0,0 +1,130 @@
+# Copyright (C) 2015 Cisco, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Tests for the subnet allocator."""
+
+from __future__ import (
+    absolute_import,
+    print_function,
+    unicode_literals,
+    )
+
+str = None
+
+__metaclass__ = type
+__all__ = []
+
+import multiprocessing
+import os
+
+import fixtures
+import mock
+from testiny import subnets
+from testiny.subnets import (
+    PoolExhausted,
+    SubnetAllocator,
+)
+from testiny.testcase import TestinyTestCase
+
+
+def allocate_and_wait(state_dir, count, results, done):
+    allocator = SubnetAllocator('10.128.0.0/12', 24, state_dir=state_dir)
+    for _ in range(count):
+        results.put(allocator.allocate())
+    # Keep the allocations alive until the parent has checked them.
+    done.wait(30)
+
+
+class TestSubnetAllocator(TestinyTestCase):
+
+    def make_allocator(self, pool='10.128.0.0/12', prefixlen=24, **kwargs):
+        state_dir = self.useFixture(fixtures.TempDir()).path
+        return SubnetAllocator(pool, prefixlen, state_dir=state_dir, **kwargs)
+
+    def test_allocates_distinct_subnets(self):
+        allocator = self.make_allocator()
+        self.assertEqual(
+            ['10.128.0.0/24', '10.128.1.0/24', '10.128.2.0/24'],
+            [allocator.allocate() for _ in range(3)])
+        self.assertEqual(4096, allocator.size)
+
+    def test_release_makes_subnet_available(self):
+        allocator = self.make_allocator()
+        first = allocator.allocate()
+        allocator.allocate()
+        allocator.release(first)
+        self.assertEqual(first, allocator.allocate())
+
+    def test_ipv6(self):
+        allocator = self.make_allocator('fd00:7e57::/48', 64)
+        allocator.allocate()
+        self.assertEqual('fd00:7e57:0:1::/64', allocator.allocate())
+
+    def test_first_and_last(self):
+        allocator = self.make_allocator(
+            '10.1.0.0/16', 24, first=11, last=12)
+        self.assertEqual(
+            ['10.1.11.0/24', '10.1.12.0/24'],
+            [allocator.allocate(), allocator.allocate()])
+        self.assertRaises(PoolExhausted, allocator.allocate)
+
+    def test_allocate_many(self):
+        allocator = self.make_allocator('10.1.0.0/22', 24)
+        allocator.allocate()
+        self.assertEqual(
+            ['10.1.1.0/24', '10.1.2.0/24'], allocator.allocate_many(2))
+        self.assertRaises(PoolExhausted, allocator.allocate_many, 2)
+        allocator.release('10.1.1.0/24', '10.1.2.0/24')
+        self.assertEqual(1, allocator.usage()['used'])
+
+    def test_reclaims_subnets_of_dead_processes(self):
+        allocator = self.make_allocator('10.1.0.0/23', 24)
+        allocator.allocate()
+        allocator.allocate()
+        self.patch(subnets, '_pid_is_running', lambda pid: False)
+        self.assertEqual(0, allocator.usage()['used'])
+        self.assertEqual('10.1.0.0/24', allocator.allocate())
+
+    def test_usage(self):
+        allocator = self.make_allocator('10.1.0.0/22', 24)
+        allocator.allocate()
+        # pid 1 is always running.
+        with mock.patch('os.getpid', return_value=1):
+            allocator.allocate()
+        self.assertEqual(
+            {'used': 2, 'total': 4, 'by_pid': {1: 1, os.getpid(): 1}},
+            allocator.usage())
+        self.assertEqual(
+            "2 of 4 subnets of 10.1.0.0/22 in use (50.0%)",
+            allocator.format_usage())
+
+    def test_shared_between_processes(self):
+        state_dir = self.useFixture(fixtures.TempDir()).path
+        results = multiprocessing.Queue()
+        done = multiprocessing.Event()
+        processes = [
+            multiprocessing.Process(
+                target=allocate_and_wait,
+                args=(state_dir, 10, results, done))
+            for _ in range(4)]
+        for process in processes:
+            process.start()
+        try:
+            cidrs = [results.get(timeout=30) for _ in range(40)]
+        finally:
+            done.set()
+            for process in processes:
+                process.join()
+        self.assertEqual(40, len(set(cidrs)))
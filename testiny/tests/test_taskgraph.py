@@ -0,0 +1,153 @@
+# Copyright (C) 2015 Cisco, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Tests for the task graph."""
+
+from __future__ import (
+    absolute_import,
+    print_function,
+    unicode_literals,
+    )
+
+str = None
+
+__metaclass__ = type
+__all__ = []
+
+import threading
+import time
+
+import fixtures
+from testiny.taskgraph import (
+    FixtureGraph,
+    TaskGraph,
+)
+from testiny.testcase import TestinyTestCase
+
+
+class RecordingFixture(fixtures.Fixture):
+
+    def __init__(self, name, log):
+        super(RecordingFixture, self).__init__()
+        self.name = name
+        self.log = log
+
+    def _setUp(self):
+        self.addCleanup(self.log.append, self.name)
+
+
+class TestTaskGraph(TestinyTestCase):
+
+    def test_runs_dependencies_first(self):
+        graph = TaskGraph()
+        graph.add('a', lambda: 1)
+        graph.add('b', lambda: graph.results['a'] + 1, depends_on=['a'])
+        self.assertEqual({'a': 1, 'b': 2}, graph.run())
+        self.assertEqual(['a', 'b'], graph.completed)
+
+    def test_runs_independent_tasks_in_parallel(self):
+        # Each task waits for the other to start.
+        started = dict(a=threading.Event(), b=threading.Event())
+
+        def task(name, other):
+            started[name].set()
+            return started[other].wait(5)
+
+        graph = TaskGraph()
+        graph.add('a', lambda: task('a', 'b'))
+        graph.add('b', lambda: task('b', 'a'))
+        self.assertEqual({'a': True, 'b': True}, graph.run())
+
+    def test_rejects_unknown_dependencies(self):
+        graph = TaskGraph()
+        self.assertRaises(ValueError, graph.add, 'a', int, ['b'])
+
+    def test_failure_stops_dependent_tasks(self):
+        def fail():
+            raise RuntimeError("boom")
+
+        graph = TaskGraph()
+        graph.add('a', fail)
+        graph.add('b', int, depends_on=['a'])
+        self.assertRaises(RuntimeError, graph.run)
+        self.assertEqual([], graph.completed)
+
+    def test_critical_path(self):
+        graph = TaskGraph()
+        graph.add('slow', lambda: time.sleep(0.2))
+        graph.add('fast', int)
+        graph.add('last', int, depends_on=['slow', 'fast'])
+        graph.run()
+        self.assertEqual(['slow', 'last'], graph.critical_path())
+        self.assertIn('slow (', graph.format_critical_path())
+
+    def test_format_timings(self):
+        graph = TaskGraph()
+        graph.add('first', int)
+        graph.add('second', int, depends_on=['first'])
+        graph.add('never', int)
+        graph.timings = {'first': (10.0, 11.0), 'second': (11.0, 13.5)}
+        self.assertEqual(
+            "first: started at +0.00s, took 1.00s\n"
+            "second: started at +1.00s, took 2.50s",
+            graph.format_timings())
+
+
+class TestFixtureGraph(TestinyTestCase):
+
+    def test_cleans_up_in_reverse_dependency_order(self):
+        log = []
+        parent = fixtures.Fixture()
+        parent.setUp()
+        graph = FixtureGraph()
+        graph.add_fixture('a', lambda: RecordingFixture('a', log))
+        graph.add_fixture(
+            'b', lambda: RecordingFixture('b', log), depends_on=['a'])
+        graph.set_up(parent)
+        parent.cleanUp()
+        self.assertEqual(['b', 'a'], log)
+
+    def test_cleans_up_fixtures_set_up_before_a_failure(self):
+        def fail():
+            raise RuntimeError("boom")
+
+        log = []
+        parent = fixtures.Fixture()
+        parent.setUp()
+        graph = FixtureGraph()
+        graph.add_fixture('a', lambda: RecordingFixture('a', log))
+        graph.add('fail', fail, depends_on=['a'])
+        self.assertRaises(RuntimeError, graph.set_up, parent)
+        parent.cleanUp()
+        self.assertEqual(['a'], log)
+
+    def test_cleans_up_in_order_added_not_completed(self):
+        # The router is cleaned up before the network it may be attached
+        # to, even though the network finished setting up last.
+        log = []
+        parent = fixtures.Fixture()
+        parent.setUp()
+        graph = FixtureGraph()
+
+        def make_network():
+            time.sleep(0.1)
+            return RecordingFixture('network', log)
+
+        graph.add_fixture('network', make_network)
+        graph.add_fixture('router', lambda: RecordingFixture('router', log))
+        graph.set_up(parent)
+        self.assertEqual(['router', 'network'], graph.completed)
+        parent.cleanUp()
+        self.assertEqual(['router', 'network'], log)
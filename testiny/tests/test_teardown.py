@@ -0,0 +1,106 @@
+# Copyright (C) 2015 Cisco, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Tests for the background teardown engine."""
+
+from __future__ import (
+    absolute_import,
+    print_function,
+    unicode_literals,
+    )
+
+str = None
+
+__metaclass__ = type
+__all__ = []
+
+import threading
+
+from testiny.teardown import (
+    TEARDOWN_NETWORK,
+    TEARDOWN_SERVER,
+    TeardownEngine,
+)
+from testiny.testcase import TestinyTestCase
+
+
+class ConflictError(Exception):
+    status_code = 409
+
+
+class TestTeardownEngine(TestinyTestCase):
+
+    def make_engine(self, **kwargs):
+        engine = TeardownEngine(**kwargs)
+        self.addCleanup(engine.executor.shutdown)
+        return engine
+
+    def test_waits_for_lower_ranks(self):
+        engine = self.make_engine()
+        release_server = threading.Event()
+        log = []
+
+        def delete_server():
+            release_server.wait(5)
+            log.append('server')
+
+        engine.schedule(TEARDOWN_SERVER, delete_server)
+        engine.schedule(TEARDOWN_NETWORK, log.append, 'network')
+        release_server.set()
+        self.assertEqual([], engine.barrier())
+        self.assertEqual(['server', 'network'], log)
+
+    def test_retries_conflicts(self):
+        engine = self.make_engine(conflict_delay=0)
+        attempts = []
+
+        def delete():
+            attempts.append(None)
+            if len(attempts) < 3:
+                raise ConflictError()
+            return 'deleted'
+
+        future = engine.schedule(TEARDOWN_SERVER, delete)
+        self.assertEqual('deleted', future.result())
+        self.assertEqual(3, len(attempts))
+
+    def test_barrier_reports_failures(self):
+        engine = self.make_engine(conflict_retries=0)
+
+        def delete_server():
+            raise ConflictError()
+
+        engine.schedule(TEARDOWN_SERVER, delete_server)
+        [(description, error)] = engine.barrier()
+        self.assertEqual('delete_server', description)
+        self.assertIsInstance(error, ConflictError)
+        # Failures are only reported once.
+        self.assertEqual([], engine.barrier())
+
+    def test_runs_inline_once_executor_is_shut_down(self):
+        # As from an atexit handler, after concurrent.futures has shut
+        # its workers down.
+        engine = self.make_engine(conflict_retries=0)
+        engine.executor.shutdown()
+
+        def delete_server():
+            raise ConflictError()
+
+        failed = engine.schedule(TEARDOWN_SERVER, delete_server)
+        deleted = engine.schedule(TEARDOWN_NETWORK, lambda: 'deleted')
+        self.assertIsInstance(failed.exception(0), ConflictError)
+        self.assertEqual('deleted', deleted.result(0))
+        [(description, _)] = engine.barrier()
+        self.assertEqual('delete_server', description)
@@ -0,0 +1,244 @@
+# Copyright (C) 2015 Cisco, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Tests for the tenant fixtures and pool."""
+
+from __future__ import (
+    absolute_import,
+    print_function,
+    unicode_literals,
+    )
+
+str = None
+
+__metaclass__ = type
+__all__ = []
+
+import time
+
+import fixtures
+import mock
+from testiny.fixtures import tenant
+from testiny.fixtures.tenant import (
+    KeypairFixture,
+    TenantPool,
+)
+from testiny.keys import SSHKey
+from testiny.testcase import TestinyTestCase
+
+
+class FakeTenant:
+
+    def __init__(self):
+        self.clean = True
+        self.cleaned_up = False
+
+    def setUp(self):
+        self.created = time.time()
+        self.uses = 0
+
+    def scrub(self, timeout):
+        return self.clean
+
+    def cleanUp(self):
+        self.cleaned_up = True
+
+
+class TestTenantPool(TestinyTestCase):
+
+    def make_pool(self, **kwargs):
+        pool = TenantPool(make_tenant=FakeTenant, **kwargs)
+        self.addCleanup(pool.close)
+        return pool
+
+    def test_replenishes_in_background(self):
+        pool = self.make_pool(size=2)
+        tenant = pool.lease()
+        self.assertTrue(pool.wait(10))
+        self.assertEqual((0, 1, 3), (pool.hits, pool.misses, pool.created))
+        self.assertEqual(1, tenant.uses)
+        self.assertEqual(2, len(pool._idle))
+
+    def test_reuses_scrubbed_tenant(self):
+        pool = self.make_pool(size=1)
+        tenant = pool.lease()
+        pool.wait(10)
+        pool.release(tenant).result()
+        pool.lease()
+        reused = pool.lease()
+        self.assertIs(tenant, reused)
+        self.assertEqual(2, tenant.uses)
+        self.assertFalse(tenant.cleaned_up)
+
+    def test_discards_dirty_tenant(self):
+        pool = self.make_pool(size=1)
+        tenant = pool.lease()
+        pool.wait(10)
+        tenant.clean = False
+        pool.release(tenant).result()
+        self.assertTrue(tenant.cleaned_up)
+        self.assertEqual(1, pool.discarded)
+        self.assertNotIn(tenant, pool._idle)
+
+    def test_discards_tenant_used_max_reuse_times(self):
+        pool = self.make_pool(size=1, max_reuse=1)
+        tenant = pool.lease()
+        pool.release(tenant).result()
+        self.assertTrue(tenant.cleaned_up)
+
+    def test_discards_stale_tenant_on_lease(self):
+        pool = self.make_pool(size=1, max_age=60)
+        pool.lease()
+        pool.wait(10)
+        [stale] = pool._idle
+        stale.created -= 120
+        tenant = pool.lease()
+        self.assertIsNot(stale, tenant)
+        self.assertTrue(stale.cleaned_up)
+
+    def test_close_deletes_idle_tenants(self):
+        pool = TenantPool(size=2, make_tenant=FakeTenant)
+        pool.lease()
+        pool.close()
+        self.assertEqual(2, pool.discarded)
+        self.assertEqual([], pool._idle)
+
+
+class FakeNeutron:
+    """Lists the objects of a tenant, from a dict of lists by type."""
+
+    def __init__(self, resources):
+        self.resources = resources
+
+    def __getattr__(self, name):
+        kind = name[len('list_'):]
+        if name.startswith('list_') and kind in self.resources:
+            return lambda **kwargs: {kind: self.resources[kind]}
+        raise AttributeError(name)
+
+
+class ScrubbedTenant(tenant.TenantFixture):
+    """A tenant scrubbed for real, but which creates nothing."""
+
+    def __init__(self):
+        super(ScrubbedTenant, self).__init__()
+        self.project_fixture = mock.Mock()
+        self.project_fixture.project.id = 'project-id'
+        self.keystone = mock.Mock()
+        self.keystone.role_assignments.list.return_value = [
+            mock.Mock(
+                spec=['user', 'role'], user={'id': 'user-id'},
+                role={'id': 'member-id'})]
+        self.neutron = FakeNeutron({
+            'floatingips': [],
+            'networks': [{'id': 'network-id', 'admin_state_up': True}],
+            'subnets': [{'id': 'subnet-id', 'enable_dhcp': True}],
+            'ports': [{'id': 'port-id'}],
+            'routers': [{
+                'id': 'router-id',
+                'external_gateway_info': {'network_id': 'public-id'},
+                'routes': []}],
+            'security_groups': [{'id': 'default-id'}],
+            'security_group_rules': [{'id': 'rule-id'}],
+        })
+        self.nova = mock.Mock()
+        self.nova.servers.list.return_value = []
+        self.nova.keypairs.list.return_value = []
+
+    def _setUp(self):
+        self.created = time.time()
+        self.uses = 0
+        self.baseline = self.snapshot()
+
+    def _get_clients(self):
+        return self.keystone, self.nova, self.neutron, self.nova
+
+
+class TestTenantScrub(TestinyTestCase):
+
+    def setUp(self):
+        super(TestTenantScrub, self).setUp()
+        self.patch(
+            tenant, 'peek_floating_ip_pool', mock.Mock(return_value=None))
+        self.patch(tenant, 'get_server_poller', mock.Mock())
+
+    def lease_and_release(self, change):
+        pool = TenantPool(size=0, make_tenant=ScrubbedTenant)
+        self.addCleanup(pool.close)
+        leased = pool.lease()
+        change(leased)
+        pool.release(leased).result()
+        return pool, leased
+
+    def test_reuses_unchanged_tenant(self):
+        pool, leased = self.lease_and_release(lambda leased: None)
+        self.assertIs(leased, pool.lease())
+
+    def test_does_not_reuse_tenant_without_router_gateway(self):
+        def remove_gateway(leased):
+            [router] = leased.neutron.resources['routers']
+            router['external_gateway_info'] = None
+
+        pool, leased = self.lease_and_release(remove_gateway)
+        self.assertEqual(1, pool.discarded)
+        self.assertIsNot(leased, pool.lease())
+
+    def test_does_not_reuse_tenant_with_added_role_grant(self):
+        def grant_role(leased):
+            leased.keystone.role_assignments.list.return_value.append(
+                mock.Mock(
+                    spec=['user', 'role'], user={'id': 'other-user-id'},
+                    role={'id': 'admin-id'}))
+
+        pool, leased = self.lease_and_release(grant_role)
+        self.assertEqual(1, pool.discarded)
+        self.assertIsNot(leased, pool.lease())
+
+
+class TestKeypairFixture(TestinyTestCase):
+
+    def make_fixture(self, user_fixture, shared):
+        nova = mock.Mock()
+        nova.keypairs.create.side_effect = (
+            lambda name, public_key: mock.Mock(name=name))
+        self.patch(
+            tenant, 'get_nova_v3_client', mock.Mock(return_value=nova))
+        generator = mock.Mock()
+        generator.get.return_value = SSHKey('/keys/id', 'ssh-rsa AAAA')
+        self.patch(
+            tenant, 'get_key_generator', mock.Mock(return_value=generator))
+        return KeypairFixture(mock.Mock(), user_fixture, shared=shared)
+
+    def test_imports_public_key(self):
+        keypair_fixture = self.make_fixture(mock.Mock(), shared=False)
+        self.useFixture(keypair_fixture)
+        self.assertEqual('/keys/id', keypair_fixture.private_key_file)
+        keypair_fixture.nova.keypairs.create.assert_called_once_with(
+            name=mock.ANY, public_key='ssh-rsa AAAA')
+
+    def test_shares_keypair_per_user(self):
+        user_fixture = fixtures.Fixture()
+        user_fixture.name, user_fixture.password = 'user', 'password'
+        user_fixture.user = mock.Mock(id='user-id')
+        user_fixture.setUp()
+        first = self.make_fixture(user_fixture, shared=True)
+        self.useFixture(first)
+        second = self.make_fixture(user_fixture, shared=True)
+        self.useFixture(second)
+        self.assertIs(first.keypair, second.keypair)
+        self.assertEqual(0, second.nova.keypairs.create.call_count)
+        user_fixture.cleanUp()
+        first.keypair.delete.assert_called_once_with()
+        self.assertNotIn('user-id', tenant._shared_keypairs)
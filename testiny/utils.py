@@ -29,6 +29,7 @@ __all__ = [
     "check_network_namespace",
     "list_network_namespaces",
     "parse_ping_output",
+    "percentile",
     "retry",
     "synchronized",
     "wait_until",
@@ -102,6 +103,16 @@ def parse_ping_output(ping_output):
     return match.groups() if match is not None else None
 
 
+def percentile(values, percent):
+    """Return the `percent` percentile of the sorted list `values`.
+
+    Uses the nearest-rank method: the smallest value such that at least
+    `percent` percent of the values are lower or equal.
+    """
+    index = max(0, -(-percent * len(values) // 100) - 1)
+    return values[index]
+
+
 def synchronized(func):
     """Decorator to make a function threadsafe."""
     lock = threading.Lock()